@@ -0,0 +1,146 @@
+from asyncio import Queue, create_task, gather
+from asyncio import sleep as async_sleep
+from time import monotonic
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Union
+
+import nextcord
+from nextcord.types.message import Message as MessagePayload
+
+from utils import do_log
+
+HISTORY_PAGE_SIZE = 100  # Maximum allowed by the Discord API
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every backfill worker. nextcord already serializes requests per route
+    bucket (one per channel for history), so this only keeps the combined request rate of all
+    workers under Discord's global limit. A rate of 0 doesn't limit it.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = monotonic()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            now = monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await async_sleep((1 - self.tokens) / self.rate)
+
+
+class BackfillJob:
+    def __init__(
+        self,
+        channel: Union[nextcord.TextChannel, nextcord.Thread],
+        after: Optional[int] = None,
+    ):
+        self.channel = channel
+        self.after = after
+        self.messages = 0
+        self.pages = 0
+        self.done = False
+
+
+class BackfillScheduler:
+    """
+    Pulls channel history for several channels at once, with at most 'concurrency' channels in
+    flight and at most 'requests_per_second' history requests across all of them.
+    """
+
+    def __init__(
+        self,
+        client: nextcord.Client,
+        concurrency: int = 4,
+        requests_per_second: float = 20.0,
+        report_interval: float = 15.0,
+    ):
+        self.client = client
+        self.concurrency = max(1, concurrency)
+        self.limiter = RateLimiter(requests_per_second, burst=self.concurrency)
+        self.report_interval = report_interval
+        self.jobs: List[BackfillJob] = []
+        self.started = 0.0
+
+    async def run(
+        self, jobs: List[BackfillJob], process: Callable[[BackfillJob], Awaitable[Any]]
+    ):
+        """
+        Runs 'process' for every job, 'concurrency' jobs at a time. Exceptions are logged per
+        channel so a single inaccessible channel doesn't stop the rest of the backfill.
+        """
+        self.jobs = jobs
+        self.started = monotonic()
+        pending: Queue[BackfillJob] = Queue()
+        for job in jobs:
+            pending.put_nowait(job)
+
+        async def worker():
+            while not pending.empty():
+                job = pending.get_nowait()
+                try:
+                    await process(job)
+                except Exception as e:  # nosec
+                    do_log(f"Exception when processing #{job.channel.name} ({e})")
+                job.done = True
+                self.report_channel(job)
+
+        reporter = create_task(self.report_loop())
+        try:
+            await gather(*[worker() for _ in range(min(self.concurrency, len(jobs)))])
+        finally:
+            reporter.cancel()
+        self.report_overall()
+
+    async def history(self, job: BackfillJob) -> AsyncIterator[List[MessagePayload]]:
+        """
+        Yields raw message payloads for a channel in pages, oldest first, starting after
+        'job.after' (or at the very beginning of the channel).
+        """
+        after = job.after or 0
+        while True:
+            await self.limiter.acquire()
+            page = await self.client.http.logs_from(
+                job.channel.id, HISTORY_PAGE_SIZE, after=after
+            )
+            if not page:
+                return
+            page.sort(key=lambda data: int(data["id"]))
+            after = int(page[-1]["id"])
+            job.pages += 1
+            job.messages += len(page)
+            if job.pages % 10 == 0:
+                self.report_channel(job)
+            yield page
+            if len(page) < HISTORY_PAGE_SIZE:
+                return
+
+    def report_channel(self, job: BackfillJob):
+        state = "done" if job.done else "in progress"
+        do_log(
+            f"Scraping #{job.channel.name} ({job.messages} messages processed, {state})"
+        )
+
+    def report_overall(self):
+        elapsed = max(monotonic() - self.started, 0.001)
+        done = sum(1 for job in self.jobs if job.done)
+        messages = sum(job.messages for job in self.jobs)
+        do_log(
+            f"Backfill progress: {done}/{len(self.jobs)} channels, {messages} messages "
+            f"({messages / elapsed:.0f} messages/s)"
+        )
+
+    async def report_loop(self):
+        while True:
+            await async_sleep(self.report_interval)
+            self.report_overall()
@@ -0,0 +1,59 @@
+from argparse import ArgumentParser
+from random import Random
+from time import perf_counter
+
+from repost_index import HammingIndex
+
+
+def main():
+    parser = ArgumentParser(
+        description="Near-duplicate image hash lookup benchmark. Run from the 'src' directory "
+        "with 'python -m benchmarks.hamming_index'."
+    )
+    parser.add_argument("--hashes", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--distance", type=int, default=6)
+    args = parser.parse_args()
+
+    random = Random(1)  # nosec
+    hashes = [random.getrandbits(64) for _ in range(args.hashes)]
+    index = HammingIndex(args.distance, expected_size=args.hashes)
+    start = perf_counter()
+    for position, value in enumerate(hashes):
+        index.add(value, position)
+    print(
+        f"Indexed {args.hashes} hashes in {perf_counter() - start:.2f}s "
+        f"({len(index.bands)} bands, searched within {index.radius} bits each)"
+    )
+
+    # Half the queries are near-duplicates of stored hashes, half are new images
+    queries = []
+    for i in range(args.queries):
+        value = random.choice(hashes) if i % 2 else random.getrandbits(64)
+        for bit in random.sample(range(64), random.randint(0, args.distance)):
+            value ^= 1 << bit
+        queries.append(value)
+
+    start = perf_counter()
+    indexed = [index.search(value) for value in queries]
+    index_time = perf_counter() - start
+
+    start = perf_counter()
+    scanned = [
+        sorted(
+            (distance, position)
+            for position, stored in enumerate(hashes)
+            if (distance := (stored ^ value).bit_count()) <= args.distance
+        )
+        for value in queries[: max(1, args.queries // 10)]
+    ]
+    scan_time = (perf_counter() - start) / len(scanned)
+
+    for index_matches, scan_matches in zip(indexed, scanned):
+        assert sorted(index_matches) == scan_matches  # nosec
+    print(f"HammingIndex: {index_time / len(queries) * 1000:.3f} ms/query")
+    print(f"Linear scan:  {scan_time * 1000:.3f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+from argparse import ArgumentParser
+from asyncio import run
+from time import perf_counter
+from typing import Any, List
+
+import nextcord
+
+from benchmarks.synthetic import PayloadFactory
+from message_store import ExtraDataRows, message_to_record, payload_to_record
+
+
+def generate_payloads(message_count: int) -> List[Any]:
+    factory = PayloadFactory(
+        1, [10 + i for i in range(20)], [100 + i for i in range(500)], seed=1
+    )
+    return [factory.message() for _ in range(message_count)]
+
+
+async def benchmark(message_count: int):
+    # Building a Message mutates its payload, so each path gets its own (identical) copy
+    payloads = generate_payloads(message_count)
+    old_payloads = generate_payloads(message_count)
+    client = nextcord.Client()
+    state = client._connection
+    channels = {
+        data["channel_id"]: client.get_partial_messageable(int(data["channel_id"]))
+        for data in payloads
+    }
+
+    def old_path(data: Any):
+        channel = channels[data["channel_id"]]
+        return message_to_record(state.create_message(channel=channel, data=data))
+
+    # Both paths must produce the same stored rows
+    for data, old_data in zip(payloads[:2000], old_payloads[:2000]):
+        old_record, new_record = old_path(old_data), payload_to_record(data)
+        old_rows, new_rows = ExtraDataRows(), ExtraDataRows()
+        old_extra = old_rows.split(old_record[0], old_record[5], False)
+        new_extra = new_rows.split(new_record[0], new_record[5], False)
+        assert old_record[:5] == new_record[:5], (old_record, new_record)  # nosec
+        assert old_extra == new_extra, (old_extra, new_extra)  # nosec
+        assert vars(old_rows) == vars(new_rows), data  # nosec
+    old_payloads = generate_payloads(message_count)
+
+    start = perf_counter()
+    for data in old_payloads:
+        old_path(data)
+    before = perf_counter() - start
+
+    start = perf_counter()
+    for data in payloads:
+        payload_to_record(data)
+    after = perf_counter() - start
+
+    print(f"{message_count} messages")
+    print(f"Message object + message_to_record: {message_count / before:>10.0f} rows/s")
+    print(f"payload_to_record:                  {message_count / after:>10.0f} rows/s")
+    print(f"Speedup: {before / after:.1f}x")
+
+
+def main():
+    parser = ArgumentParser(
+        description="Message log row decoding benchmark. Run from the 'src' directory with "
+        "'python -m benchmarks.message_decode'."
+    )
+    parser.add_argument("--messages", type=int, default=50000)
+    args = parser.parse_args()
+    run(benchmark(args.messages))
+
+
+if __name__ == "__main__":
+    main()
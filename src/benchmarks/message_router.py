@@ -0,0 +1,112 @@
+from argparse import ArgumentParser
+from asyncio import create_task, gather, run
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Any, List, cast
+
+import nextcord
+from nextcord.ext import commands
+from nextcord.types.user import User as UserPayload
+
+from benchmarks.synthetic import PayloadFactory
+from message_router import MessageRouter
+
+GUILD_ID = 900000000000000000
+OWNER_ID = 123
+
+
+async def media_handler(message: nextcord.Message):
+    pass  # Dispatch cost only; what the media cog does with the message is the same either way
+
+
+def main():
+    parser = ArgumentParser(
+        description="Per-message dispatch cost with and without the message router. Run from "
+        "the 'src' directory with 'python -m benchmarks.message_router'."
+    )
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--channels", type=int, default=6)
+    parser.add_argument("--commands", type=float, default=0.01)
+    args = parser.parse_args()
+
+    client = commands.Bot(command_prefix="/", intents=nextcord.Intents.default())
+
+    @client.command(name="ping")
+    async def ping(ctx: Any, *, text: str = ""):
+        pass
+
+    state = client._connection
+    channel_ids = [GUILD_ID + 1 + i for i in range(args.channels)]
+    media_channel_ids = channel_ids[:1]
+    factory = PayloadFactory(GUILD_ID, channel_ids, [1000 + i for i in range(500)])
+    state.user = nextcord.ClientUser(
+        state=state, data=cast(UserPayload, factory.user(999))
+    )
+    channels = {
+        channel_id: SimpleNamespace(id=channel_id, guild=None)
+        for channel_id in channel_ids
+    }
+
+    def messages() -> List[nextcord.Message]:
+        result = []
+        for i in range(args.messages):
+            data: Any = factory.message(factory.random.choice(channel_ids))
+            if factory.random.random() < args.commands:
+                data["content"] = "/ping with arguments"
+            channel = channels[int(data["channel_id"])]
+            result.append(nextcord.Message(state=state, channel=channel, data=data))
+        return result
+
+    # As before the router: main.on_message plus one listener task per cog for every message
+    async def legacy_on_message(message: nextcord.Message):
+        if message.author.id == OWNER_ID and message.content.lower().startswith("/off"):
+            return
+        message.content = message.content.replace("@everyone", "@ everyone")
+        message.content = message.content.replace("@here", "@ here")
+        await client.process_commands(message)
+
+    media_channel_list = list(media_channel_ids)
+
+    async def legacy_media_listener(message: nextcord.Message):
+        if message.channel.id not in media_channel_list:
+            return
+        await media_handler(message)
+
+    async def legacy(batch: List[nextcord.Message]):
+        tasks = []
+        for message in batch:
+            tasks.append(create_task(legacy_on_message(message)))
+            tasks.append(create_task(legacy_media_listener(message)))
+        await gather(*tasks)
+
+    router = MessageRouter(on_error=print)
+
+    async def on_command_message(message: nextcord.Message):
+        await client.process_commands(message)
+
+    router.add("commands", on_command_message, prefixes=["/"], allow_bots=False)
+    router.add("media_rate", media_handler, channel_ids=media_channel_ids)
+
+    async def routed_on_message(message: nextcord.Message):
+        if "@" in message.content:
+            message.content = message.content.replace("@everyone", "@ everyone")
+            message.content = message.content.replace("@here", "@ here")
+        await router.dispatch(message)
+
+    async def routed(batch: List[nextcord.Message]):
+        await gather(*(create_task(routed_on_message(message)) for message in batch))
+
+    async def measure():
+        for name, function in (("Listeners", legacy), ("Router", routed)):
+            batch = messages()
+            start = perf_counter()
+            await function(batch)
+            elapsed = perf_counter() - start
+            print(f"{name:<10} {elapsed / len(batch) * 1e6:.1f} µs/message")
+        print(f"Router: {router.stats()}")
+
+    run(measure())
+
+
+if __name__ == "__main__":
+    main()
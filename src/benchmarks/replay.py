@@ -0,0 +1,540 @@
+import os
+import socket
+import sys
+from argparse import ArgumentParser
+from asyncio import Task, all_tasks, create_task, current_task
+from asyncio import sleep as async_sleep
+from asyncio import wait
+from collections import Counter, deque
+from datetime import datetime, timezone
+from random import Random
+from re import compile as regex_compile
+from tempfile import TemporaryDirectory
+from time import perf_counter, process_time
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, cast
+
+import nextcord
+from aiohttp import web
+from nextcord.types.user import User as UserPayload
+
+from benchmarks.synthetic import PayloadFactory
+
+GUILD_ID = 900000000000000000
+OWNER_ID = 1
+BOT_USER_ID = 2
+CHANNEL_NAMES = ["general", "memes", "gaming", "clips", "staff", "welcome"]
+MEDIA_CHANNEL = "memes"
+WELCOME_CHANNEL = "welcome"
+MENTION_REGEX = regex_compile(r"<@\d+>")
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class FakeHTTP:
+    """
+    Stands in for nextcord's HTTPClient. Every request is counted and takes 'latency' seconds;
+    channel history is served from pre-generated payloads.
+    """
+
+    def __init__(self, latency: float, history: Dict[int, List[Any]]):
+        self.latency = latency
+        self.history = history
+        self.calls: Counter[str] = Counter()
+
+    async def request(self, route: str):
+        self.calls[route] += 1
+        await async_sleep(self.latency)
+
+    async def logs_from(
+        self,
+        channel_id: int,
+        limit: int,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+        around: Optional[int] = None,
+    ) -> List[Any]:
+        await self.request("logs_from")
+        page = [
+            data
+            for data in self.history.get(channel_id, [])
+            if int(data["id"]) > (after or 0)
+        ][:limit]
+        return page[::-1]  # Newest first, like the API
+
+    async def add_reaction(self, channel_id: int, message_id: int, emoji: str):
+        await self.request("add_reaction")
+
+    async def delete_message(self, channel_id: int, message_id: int, **kwargs: Any):
+        await self.request("delete_message")
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.bot = False
+        self.mention = f"<@{user_id}>"
+        self.joined_at: Optional[datetime] = None
+
+
+class FakeInvite:
+    def __init__(
+        self,
+        code: str,
+        inviter: FakeUser,
+        max_uses: int = 0,
+        uses: int = 0,
+        created_at: Optional[datetime] = None,
+    ):
+        self.code = code
+        self.inviter = inviter
+        self.max_uses = max_uses
+        self.uses = uses
+        self.created_at = created_at or datetime.now(timezone.utc)
+        # Never expire, like invites created with no time limit
+        self.max_age = 0
+        self.expires_at: Optional[datetime] = None
+
+    def copy(self) -> "FakeInvite":
+        return FakeInvite(
+            self.code, self.inviter, self.max_uses, self.uses, self.created_at
+        )
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, name: str, guild: "FakeGuild"):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.mention = f"<#{channel_id}>"
+        self.sent: List[Tuple[float, str]] = []
+
+    async def send(self, content: Optional[str] = None, **kwargs: Any):
+        await self.guild.http.request("send_message")
+        self.sent.append((perf_counter(), content or ""))
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, http: FakeHTTP):
+        self.id = guild_id
+        self.http = http
+        self.text_channels: List[FakeChannel] = []
+        self.threads: List[FakeChannel] = []
+        self.active_invites: Dict[str, FakeInvite] = {}
+        self.members: List[FakeUser] = []
+
+    def get_channel_or_thread(self, channel_id: int) -> Optional[FakeChannel]:
+        for channel in self.threads + self.text_channels:
+            if channel.id == channel_id:
+                return channel
+        return None
+
+    async def invites(self) -> List[FakeInvite]:
+        await self.http.request("invites")
+        return [invite.copy() for invite in self.active_invites.values()]
+
+
+class LatencyRecorder:
+    """
+    Times every listener nextcord schedules, from the moment the event is dispatched until the
+    listener returns, and samples event loop lag from a background task.
+    """
+
+    def __init__(self, lag_interval: float = 0.01):
+        self.latencies: Dict[str, List[float]] = {}
+        self.lag: List[float] = []
+        self.lag_interval = lag_interval
+        self.pending: set = set()
+        self.errors = 0
+
+    def record(self, name: str, elapsed: float):
+        self.latencies.setdefault(name, []).append(elapsed)
+
+    def install(self, client: Any):
+        original_schedule_event: Callable[..., Task] = client._schedule_event
+
+        def schedule_event(coro, event_name, *args, **kwargs) -> Task:
+            name = getattr(coro, "__qualname__", event_name)
+            scheduled = perf_counter()
+
+            async def timed(*args, **kwargs):
+                try:
+                    await coro(*args, **kwargs)
+                except Exception:
+                    self.errors += 1
+                    raise
+                finally:
+                    self.record(name, perf_counter() - scheduled)
+
+            task = original_schedule_event(timed, event_name, *args, **kwargs)
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+            return task
+
+        setattr(client, "_schedule_event", schedule_event)
+
+    async def lag_loop(self):
+        while True:
+            start = perf_counter()
+            await async_sleep(self.lag_interval)
+            self.lag.append(max(0.0, perf_counter() - start - self.lag_interval))
+
+
+class Replay:
+    """
+    Builds a fake guild around the real bot (main.bot), loads the real cogs through
+    main.post_init() and feeds them synthetic gateway events at a fixed rate. Only the network is
+    faked: REST calls go to FakeHTTP, and links in messages point at a local web server.
+    """
+
+    def __init__(self, args: Any, main_module: Any):
+        self.args = args
+        self.main = main_module
+        self.bot = main_module.bot
+        self.client = self.bot.client
+        self.random = Random(args.seed)  # nosec
+        self.recorder = LatencyRecorder()
+        self.http = FakeHTTP(args.api_latency_ms / 1000, {})
+        self.guild = FakeGuild(GUILD_ID, self.http)
+        self.recent_messages: Deque[Tuple[str, str]] = deque(maxlen=500)
+        self.event_counts: Counter[str] = Counter()
+        self.next_member_id = 10 ** 17
+        self.join_times: Dict[str, float] = {}
+
+    async def page_handler(self, request: web.Request) -> web.Response:
+        await async_sleep(self.args.page_latency_ms / 1000)
+        page = int(request.match_info["page"])
+        meta = '<meta property="og:image" content="/thumb.jpg">' if page % 2 else ""
+        filler = "<p>" + "Lorem ipsum dolor sit amet. " * 1000 + "</p>"
+        return web.Response(
+            text=f"<html><head>{meta}</head><body>{filler}</body></html>",
+            content_type="text/html",
+        )
+
+    async def start_web_server(self) -> Tuple[web.AppRunner, str]:
+        app = web.Application()
+        app.router.add_get("/page/{page}", self.page_handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        await web.SockSite(runner, sock).start()
+        return runner, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+    def setup_bot(self, base_url: str):
+        args = self.args
+        channel_ids = {name: GUILD_ID + 1 + i for i, name in enumerate(CHANNEL_NAMES)}
+        for name, channel_id in channel_ids.items():
+            self.guild.text_channels.append(FakeChannel(channel_id, name, self.guild))
+        inviters = [FakeUser(500 + i) for i in range(5)]
+        for i in range(args.invites):
+            code = f"code{i:04d}"
+            self.guild.active_invites[code] = FakeInvite(
+                code, inviters[i % len(inviters)], max_uses=1 if i % 5 == 0 else 0
+            )
+
+        links = [f"{base_url}/page/{i}" for i in range(200)]
+        links += [f"{base_url}/image/{i}.png" for i in range(20)]
+        self.factory = PayloadFactory(
+            GUILD_ID,
+            [
+                channel_id
+                for name, channel_id in channel_ids.items()
+                if name != "welcome"
+            ],
+            [1000 + i for i in range(args.authors)],
+            seed=args.seed,
+            links=links,
+            link_embeds=False,
+        )
+        for name, channel_id in channel_ids.items():
+            self.http.history[channel_id] = [
+                self.factory.message(channel_id) for _ in range(args.history)
+            ]
+
+        self.bot.CFG = {
+            "custom_invite_channel": WELCOME_CHANNEL,
+            "discord_bot_owner_id": OWNER_ID,
+            "discord_guild_id": GUILD_ID,
+            "media_rate_channels": [MEDIA_CHANNEL],
+            "message_log": True,
+        }
+        self.bot.guild = self.guild
+        self.bot.channels = {
+            channel.name: channel for channel in self.guild.text_channels
+        }
+        self.bot.roles = {}
+        self.client.http = self.http
+        self.client._connection.http = self.http
+        self.client._connection.user = nextcord.ClientUser(
+            state=self.client._connection,
+            data=cast(UserPayload, self.factory.user(BOT_USER_ID)),
+        )
+        self.recorder.install(self.client)
+
+    def message_create(self):
+        data = self.factory.message()
+        self.recent_messages.append((data["id"], data["channel_id"]))
+        self.parse("MESSAGE_CREATE", data)
+
+    def message_update(self):
+        if not self.recent_messages:
+            return self.message_create()
+        message_id, channel_id = self.random.choice(self.recent_messages)
+        self.parse(
+            "MESSAGE_UPDATE",
+            {
+                "id": message_id,
+                "channel_id": channel_id,
+                "guild_id": str(GUILD_ID),
+                "content": "edited " * self.random.randint(1, 10),
+                "edited_timestamp": datetime.now(timezone.utc).isoformat(),
+            },
+        )
+
+    def message_delete(self):
+        if not self.recent_messages:
+            return self.message_create()
+        message_id, channel_id = self.recent_messages.pop()
+        self.parse(
+            "MESSAGE_DELETE",
+            {"id": message_id, "channel_id": channel_id, "guild_id": str(GUILD_ID)},
+        )
+
+    def member_join(self):
+        # Mostly reusable invites, sometimes a single-use invite that is deleted once used
+        invite = self.random.choice(list(self.guild.active_invites.values()))
+        invite.uses += 1
+        if invite.max_uses and invite.uses >= invite.max_uses:
+            del self.guild.active_invites[invite.code]
+            self.client.dispatch("invite_delete", invite.copy())
+        self.next_member_id += 1
+        member = FakeUser(self.next_member_id)
+        member.joined_at = datetime.now(timezone.utc)
+        self.join_times[member.mention] = perf_counter()
+        self.client.dispatch("member_join", member)
+
+    def invite_create(self):
+        code = (
+            f"new{len(self.guild.active_invites)}-{self.event_counts['invite_create']}"
+        )
+        invite = FakeInvite(code, FakeUser(500), max_uses=self.random.choice([0, 1]))
+        self.guild.active_invites[code] = invite
+        self.client.dispatch("invite_create", invite.copy())
+
+    def parse(self, event: str, data: Any):
+        start = perf_counter()
+        self.client._connection.parsers[event](data)
+        self.recorder.record(f"parse {event}", perf_counter() - start)
+
+    def welcome_latencies(self, channel: FakeChannel) -> Tuple[List[float], int]:
+        latencies = []
+        unattributed = 0
+        for sent_time, content in channel.sent:
+            for line in content.splitlines():
+                member = MENTION_REGEX.search(line)
+                if member is not None and member.group(0) in self.join_times:
+                    latencies.append(sent_time - self.join_times[member.group(0)])
+                unattributed += "[ERROR]" in line
+        return latencies, unattributed
+
+    async def wait_for_backfill(self):
+        cog = self.client.get_cog("MessageLogging")
+        start = perf_counter()
+        while cog.loading:
+            await async_sleep(0.05)
+        await cog.writer.flush()
+        elapsed = perf_counter() - start
+        messages = self.args.history * len(CHANNEL_NAMES)
+        print(f"Backfill: {messages} messages in {elapsed:.2f}s")
+
+    async def generate(self) -> float:
+        args = self.args
+        generators: List[Tuple[str, Callable[[], Any], float]] = [
+            ("message_create", self.message_create, 0.9),
+            ("message_update", self.message_update, 0.04),
+            ("message_delete", self.message_delete, 0.03),
+            ("member_join", self.member_join, args.join_share),
+            ("invite_create", self.invite_create, 0.005),
+        ]
+        names = [name for name, _, _ in generators]
+        functions = {name: function for name, function, _ in generators}
+        weights = [weight for _, _, weight in generators]
+
+        total = int(args.rate * args.duration)
+        start = perf_counter()
+        for i in range(total):
+            delay = start + i / args.rate - perf_counter()
+            if delay > 0:
+                await async_sleep(delay)
+            elif i % 50 == 0:
+                await async_sleep(0)  # Behind schedule; still let handlers run
+            name = self.random.choices(names, weights)[0]
+            self.event_counts[name] += 1
+            functions[name]()
+        return perf_counter() - start
+
+    async def run(self) -> bool:
+        args = self.args
+        runner, base_url = await self.start_web_server()
+        self.setup_bot(base_url)
+        await self.main.post_init()
+        self.bot.ready = True
+        await self.wait_for_backfill()
+
+        lag_task = create_task(self.recorder.lag_loop())
+        cpu_start = process_time()
+        elapsed = await self.generate()
+        events = sum(self.event_counts.values())
+        drain_start = perf_counter()
+        if self.recorder.pending:
+            await wait(self.recorder.pending, timeout=args.drain_timeout)
+        # Welcomes are sent in the background after the join listener returns
+        welcome_channel = self.bot.channels[WELCOME_CHANNEL]
+        while perf_counter() - drain_start < args.drain_timeout and len(
+            self.welcome_latencies(welcome_channel)[0]
+        ) < len(self.join_times):
+            await async_sleep(0.1)
+        drain = perf_counter() - drain_start
+        cpu = process_time() - cpu_start
+        lag_task.cancel()
+
+        cog = self.client.get_cog("MessageLogging")
+        await cog.writer.flush()
+        print(
+            f"Replayed {events} events in {elapsed:.2f}s ({events / elapsed:.0f} events/s, "
+            f"target {args.rate:.0f}); handlers drained {drain:.2f}s later; "
+            f"{cpu / events * 1e6:.0f} µs CPU per event (all threads)"
+        )
+        print(
+            "Events: "
+            + ", ".join(f"{name} {count}" for name, count in self.event_counts.items())
+        )
+        print(f"{'handler':<40}{'calls':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        worst_p99 = 0.0
+        for name, values in sorted(self.recorder.latencies.items()):
+            p99 = percentile(values, 0.99) * 1000
+            worst_p99 = max(worst_p99, p99)
+            print(
+                f"{name:<40}{len(values):>8}{percentile(values, 0.5) * 1000:>10.2f}"
+                f"{p99:>10.2f}{max(values) * 1000:>10.2f}"
+            )
+        lag = self.recorder.lag
+        max_lag = max(lag, default=0.0) * 1000
+        print(
+            f"Event loop lag: p50 {percentile(lag, 0.5) * 1000:.2f} ms, "
+            f"p99 {percentile(lag, 0.99) * 1000:.2f} ms, max {max_lag:.2f} ms"
+        )
+        print(
+            "API calls: "
+            + ", ".join(
+                f"{route} {count}" for route, count in sorted(self.http.calls.items())
+            )
+        )
+        listener_tasks = sum(
+            len(values)
+            for name, values in self.recorder.latencies.items()
+            if name.split(".")[-1] == "on_message"
+        )
+        print(
+            f"Message listeners: {listener_tasks} tasks for "
+            f"{self.event_counts['message_create']} messages; router: {self.bot.router.stats()}"
+        )
+        media_cog = self.client.get_cog("MediaRate")
+        probe = media_cog.probe
+        print(
+            f"Media probes: {probe.requests} requests, {probe.failures} failed, "
+            f"{probe.bytes_read / 1024:.0f} KiB read; URL cache: {media_cog.url_cache.stats()}"
+        )
+        print(f"Media reactions: {media_cog.reactions.stats()}")
+        latencies, unattributed = self.welcome_latencies(welcome_channel)
+        print(
+            f"Joins: {len(latencies)}/{len(self.join_times)} welcomed in "
+            f"{len(welcome_channel.sent)} messages, {unattributed} without an invite; "
+            f"join to welcome p50 {percentile(latencies, 0.5) * 1000:.0f} ms, "
+            f"p99 {percentile(latencies, 0.99) * 1000:.0f} ms"
+        )
+        print(
+            f"Message log: {cog.writer.committed_items} items in {cog.writer.commits} commits"
+            f", {len(self.recorder.pending)} handlers unfinished"
+            f", {self.recorder.errors} handler errors"
+        )
+
+        for name in list(self.client.cogs):
+            self.client.remove_cog(name)
+        await async_sleep(0.25)  # Let cogs finish closing their sessions
+        await runner.cleanup()
+        for task in all_tasks():
+            if task is not current_task():
+                task.cancel()
+
+        passed = True
+        if args.max_lag_ms is not None and max_lag > args.max_lag_ms:
+            print(f"FAILED: event loop lag {max_lag:.2f} ms > {args.max_lag_ms} ms")
+            passed = False
+        if args.max_p99_ms is not None and worst_p99 > args.max_p99_ms:
+            print(f"FAILED: handler p99 {worst_p99:.2f} ms > {args.max_p99_ms} ms")
+            passed = False
+        # Broken handlers can be fast; a run that loses events or welcomes doesn't pass either
+        if self.recorder.errors:
+            print(f"FAILED: {self.recorder.errors} handler errors")
+            passed = False
+        if len(latencies) < len(self.join_times):
+            print(f"FAILED: {len(latencies)}/{len(self.join_times)} joins welcomed")
+            passed = False
+        return passed
+
+
+def main():
+    parser = ArgumentParser(
+        description="Offline replay of synthetic gateway events through the real bot and cogs. "
+        "Run from the 'src' directory with 'python -m benchmarks.replay'."
+    )
+    parser.add_argument("--rate", type=float, default=200.0, help="Events per second")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--authors", type=int, default=500)
+    parser.add_argument("--invites", type=int, default=50)
+    parser.add_argument(
+        "--history", type=int, default=500, help="Messages per channel to backfill"
+    )
+    parser.add_argument(
+        "--join-share", type=float, default=0.01, help="Share of events that are joins"
+    )
+    parser.add_argument("--api-latency-ms", type=float, default=50.0)
+    parser.add_argument(
+        "--page-latency-ms", type=float, default=100.0, help="Latency of linked pages"
+    )
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument(
+        "--max-lag-ms", type=float, help="Fail if event loop lag ever exceeds this"
+    )
+    parser.add_argument(
+        "--max-p99-ms",
+        type=float,
+        help="Fail if any handler's p99 latency exceeds this",
+    )
+    args = parser.parse_args()
+
+    source_dir = os.getcwd()
+    with TemporaryDirectory() as data_dir:
+        # The bot writes its log files and databases relative to the working directory
+        os.chdir(data_dir)
+        try:
+            import main as main_module
+
+            main_module.utils.setup_logging()  # As main() does, so logging costs the same
+            replay = Replay(args, main_module)
+            passed = main_module.bot.client.loop.run_until_complete(replay.run())
+        finally:
+            os.chdir(source_dir)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+from datetime import datetime, timezone
+from random import Random
+from typing import Any, Dict, List, Optional
+
+DISCORD_EPOCH_MS = 1420070400000
+
+WORDS = (
+    "the a meme lol this is so good when you post it again guys check out my new clip "
+    "anyone up for games tonight wait what happened here"
+).split()
+LINKS = [
+    "https://twitter.com/someone/status/1468298342",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://i.imgur.com/abcdEFG.png",
+    "https://tenor.com/view/cat-dance-gif-123456",
+    "https://example.com/blog/post",
+]
+
+
+def snowflake(timestamp: float, sequence: int = 0) -> int:
+    return ((int(timestamp * 1000) - DISCORD_EPOCH_MS) << 22) | (sequence & 0x3FFFFF)
+
+
+class PayloadFactory:
+    """
+    Generates realistic raw Discord payloads (as received from the gateway or the API), with a
+    mix of plain text, replies, links with embeds, attachments and stickers. With 'link_embeds'
+    off, links arrive without an embed, as they do in MESSAGE_CREATE before Discord unfurls them.
+    """
+
+    def __init__(
+        self,
+        guild_id: int,
+        channel_ids: List[int],
+        author_ids: List[int],
+        seed: int = 0,
+        links: Optional[List[str]] = None,
+        link_embeds: bool = True,
+    ):
+        self.guild_id = guild_id
+        self.channel_ids = channel_ids
+        self.author_ids = author_ids
+        self.links = links or LINKS
+        self.link_embeds = link_embeds
+        self.random = Random(seed)  # nosec
+        self.sequence = 0
+        self.timestamp = 1640995200.0  # 2022-01-01
+
+    def next_id(self) -> int:
+        self.sequence += 1
+        self.timestamp += self.random.random() * 2
+        return snowflake(self.timestamp, self.sequence)
+
+    def user(self, user_id: int) -> Dict[str, Any]:
+        return {
+            "id": str(user_id),
+            "username": f"user{user_id % 1000}",
+            "discriminator": f"{user_id % 10000:04d}",
+            "avatar": None,
+        }
+
+    def message(
+        self,
+        channel_id: Optional[int] = None,
+        author_id: Optional[int] = None,
+        content: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        random = self.random
+        message_id = self.next_id()
+        channel_id = channel_id or random.choice(self.channel_ids)
+        author_id = author_id or random.choice(self.author_ids)
+        if content is None:
+            content = " ".join(random.choices(WORDS, k=random.randint(1, 20)))
+        data: Dict[str, Any] = {
+            "id": str(message_id),
+            "channel_id": str(channel_id),
+            "guild_id": str(self.guild_id),
+            "author": self.user(author_id),
+            "content": content,
+            "timestamp": datetime.fromtimestamp(
+                self.timestamp, timezone.utc
+            ).isoformat(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "type": 0,
+        }
+        roll = random.random()
+        if roll < 0.15:
+            link = random.choice(self.links)
+            data["content"] += " " + link
+            if self.link_embeds:
+                data["embeds"].append(
+                    {
+                        "type": "rich",
+                        "url": link,
+                        "title": "A post title " * random.randint(1, 4),
+                        "description": " ".join(random.choices(WORDS, k=40)),
+                        "thumbnail": {
+                            "url": link + "/thumb.jpg",
+                            "width": 400,
+                            "height": 300,
+                        },
+                    }
+                )
+        elif roll < 0.25:
+            attachment_id = self.next_id()
+            data["attachments"].append(
+                {
+                    "id": str(attachment_id),
+                    "filename": "image.png",
+                    "size": random.randint(1000, 8000000),
+                    "url": "https://cdn.discordapp.com/attachments/"
+                    f"{channel_id}/{attachment_id}/image.png",
+                    "proxy_url": "https://media.discordapp.net/attachments/"
+                    f"{channel_id}/{attachment_id}/image.png",
+                    "content_type": "image/png",
+                }
+            )
+        elif roll < 0.28:
+            data["sticker_items"] = [
+                {"id": "749054660769218631", "name": "Wave", "format_type": 3}
+            ]
+        if random.random() < 0.2:
+            data["message_reference"] = {
+                "message_id": str(message_id - random.randint(1, 10 ** 9)),
+                "channel_id": str(channel_id),
+            }
+        return data
@@ -0,0 +1,107 @@
+from argparse import ArgumentParser
+from collections import Counter
+from mimetypes import guess_type
+from random import Random
+from time import perf_counter
+from typing import Callable, List, Tuple
+
+from url_rules import MEDIA, NOT_MEDIA, PROBE, UrlRules
+
+# (weight, template) pairs roughly matching what gets posted in a meme channel; '{id}' and
+# '{n}' are filled with random tokens and numbers
+URL_TEMPLATES: List[Tuple[float, str]] = [
+    (12, "https://tenor.com/view/cat-dance-gif-{n}"),
+    (6, "https://media.tenor.com/{id}/tenor.gif"),
+    (8, "https://i.imgur.com/{id}.png"),
+    (4, "https://imgur.com/{id}"),
+    (2, "https://imgur.com/gallery/{id}"),
+    (10, "https://www.youtube.com/watch?v={id}"),
+    (4, "https://youtube.com/shorts/{id}?si={id}"),
+    (6, "https://youtu.be/{id}?t={n}"),
+    (10, "https://twitter.com/someone/status/{n}?s=20"),
+    (4, "https://x.com/someone/status/{n}"),
+    (5, "https://www.reddit.com/r/memes/comments/{id}/some_title/"),
+    (5, "https://i.redd.it/{id}.jpg"),
+    (3, "https://v.redd.it/{id}"),
+    (
+        8,
+        "https://cdn.discordapp.com/attachments/{n}/{n}/image.png?ex={id}&is={id}&hm={id}",
+    ),
+    (3, "https://media.discordapp.net/attachments/{n}/{n}/clip.mp4"),
+    (2, "https://discord.gg/{id}"),
+    (2, "https://discord.com/channels/{n}/{n}/{n}"),
+    (2, "https://www.tiktok.com/@someone/video/{n}"),
+    (2, "https://clips.twitch.tv/{id}"),
+    (1, "https://giphy.com/gifs/{id}"),
+    (2, "https://store.steampowered.com/app/{n}/"),
+    (2, "https://github.com/someone/{id}"),
+    (2, "https://en.wikipedia.org/wiki/{id}"),
+    (4, "https://www.somenewssite.com/2022/01/{id}.html"),
+    (2, "https://someblog.net/posts/{id}"),
+    (1, "https://example.com/files/{id}.pdf"),
+]
+
+
+def generate_corpus(count: int, seed: int) -> List[str]:
+    random = Random(seed)  # nosec
+    weights = [weight for weight, _ in URL_TEMPLATES]
+    templates = [template for _, template in URL_TEMPLATES]
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+    def token() -> str:
+        return "".join(random.choices(alphabet, k=random.randint(6, 11)))
+
+    corpus = []
+    for template in random.choices(templates, weights, k=count):
+        url = template
+        while "{id}" in url or "{n}" in url:
+            url = url.replace("{id}", token(), 1).replace(
+                "{n}", str(random.randint(10 ** 6, 10 ** 18)), 1
+            )
+        corpus.append(url)
+    return corpus
+
+
+def extension_only(url: str) -> str:
+    # What MediaRate did before the rule engine
+    mime_type, _ = guess_type(url)
+    if mime_type and mime_type.startswith(("image", "video", "audio")):
+        return MEDIA
+    return PROBE
+
+
+def measure(corpus: List[str], classify: Callable[[str], str]) -> Tuple[float, Counter]:
+    start = perf_counter()
+    verdicts = Counter(classify(url) for url in corpus)
+    return perf_counter() - start, verdicts
+
+
+def main():
+    parser = ArgumentParser(
+        description="URL rule engine benchmark. Run from the 'src' directory with "
+        "'python -m benchmarks.url_rules'."
+    )
+    parser.add_argument("--urls", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    corpus = generate_corpus(args.urls, args.seed)
+    rules = UrlRules()
+    print(f"{len(corpus)} URLs, {len(set(corpus))} unique")
+    for name, classify in (
+        ("Extension only", extension_only),
+        ("Rule engine", rules.classify),
+    ):
+        elapsed, verdicts = measure(corpus, classify)
+        shares = ", ".join(
+            f"{verdict} {verdicts[verdict] / len(corpus):.1%}"
+            for verdict in (MEDIA, NOT_MEDIA, PROBE)
+        )
+        print(
+            f"{name:<16}{len(corpus) / elapsed:>10.0f} URLs/s "
+            f"({elapsed / len(corpus) * 1e6:.2f} us/URL); {shares}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+from asyncio import Lock, create_task
+from asyncio import sleep as async_sleep
+from asyncio import to_thread
+from time import perf_counter
+from traceback import format_exc
+from typing import Awaitable, Callable, List, Optional, Set
+
+from nextcord.ext import commands
+
+from config_schema import (
+    RESTART_SETTINGS,
+    ConfigError,
+    changed_settings,
+    resolve_guild_objects,
+)
+from utils import BotClass, do_log, is_owner, log_error, read_config, send_lines
+
+# Called with the changed settings once they're in place; returns the cogs it had to reload
+ApplyConfig = Callable[[Set[str]], Awaitable[List[str]]]
+
+
+class ConfigReload(commands.Cog):
+    """
+    Reloads the config file on '/reload' or when it changes on disk, without reconnecting. The
+    new file is parsed and validated off the event loop and only swapped in if it is valid; the
+    bot's settings, channels and roles are then replaced together and the cogs told which
+    settings changed. If a cog fails to apply them, the old config is put back.
+    """
+
+    def __init__(self, bot: BotClass, apply_config: ApplyConfig):
+        self.bot = bot
+        self.disabled = False
+        self.apply_config = apply_config
+        self.lock = Lock()
+        self.mtime = self.config_mtime()
+        self.watch_task = create_task(self.watch_loop())
+
+    def cog_unload(self):
+        self.watch_task.cancel()
+
+    def config_mtime(self) -> Optional[float]:
+        try:
+            return self.bot.config_path.stat().st_mtime
+        except OSError:
+            return None
+
+    async def watch_loop(self):
+        while True:
+            interval = self.bot.CFG.get("config_watch_interval", 5.0)
+            if not interval:
+                # Watching is off, but a reload could turn it back on
+                await async_sleep(60)
+                continue
+            await async_sleep(interval)
+            try:
+                mtime = self.config_mtime()
+                if mtime is None or mtime == self.mtime:
+                    continue
+                lines = await self.reload()
+                do_log("[Config] " + "\n".join(lines))
+            except Exception:
+                # Keep watching; the next change to the file gets another try
+                log_error(f"[Config] Watching the config failed\n{format_exc()}")
+
+    async def reload(self) -> List[str]:
+        """
+        Reloads the config file, returning a summary of what happened.
+        """
+        async with self.lock:
+            self.mtime = self.config_mtime()
+            start = perf_counter()
+            try:
+                settings = await to_thread(read_config, self.bot.config_path)
+            except ConfigError as e:
+                log_error(f"[Config] Kept the current config: {e}")
+                return ["Kept the current config, the new one is invalid:"] + [
+                    f"- {problem}" for problem in e.problems
+                ]
+            except OSError as e:
+                return [f"Could not read '{self.bot.config_path}' ({e})"]
+
+            changed = changed_settings(self.bot.CFG, settings)
+            if not changed:
+                return ["Config unchanged"]
+            needs_restart = [key for key in RESTART_SETTINGS if key in changed]
+            if needs_restart:
+                return [
+                    f"Kept the current config, {', '.join(needs_restart)} can only change "
+                    "with a restart"
+                ]
+
+            try:
+                channels, roles = resolve_guild_objects(self.bot.guild, settings)
+            except Exception:
+                log_error(f"[Config] Kept the current config\n{format_exc()}")
+                return [
+                    "Kept the current config, looking up its channels and roles failed"
+                ]
+
+            old = (self.bot.CFG, self.bot.channels, self.bot.roles)
+            # No awaits between these, so no handler sees a mix of old and new settings
+            self.bot.CFG, self.bot.channels, self.bot.roles = settings, channels, roles
+            try:
+                reloaded = await self.apply_config(changed)
+            except Exception:
+                log_error(f"[Config] Kept the current config\n{format_exc()}")
+                self.bot.CFG, self.bot.channels, self.bot.roles = old
+                try:
+                    # Cogs that already took the new settings get the old ones back
+                    await self.apply_config(changed)
+                except Exception:
+                    log_error(
+                        f"[Config] Restoring the current config failed\n{format_exc()}"
+                    )
+                return ["Kept the current config, applying the new one failed"]
+
+            lines = [
+                f"Applied the new config in {(perf_counter() - start) * 1000:.0f} ms, "
+                f"changed: {', '.join(sorted(changed))}"
+            ]
+            if reloaded:
+                lines.append(f"Reloaded cogs: {', '.join(reloaded)}")
+            return lines
+
+    @commands.command(name="reload")
+    async def reload_command(self, ctx: commands.Context):
+        """
+        Reloads the config file without restarting. Owner only.
+        """
+        if not is_owner(self.bot, ctx.author):
+            return
+        await send_lines(ctx, await self.reload())
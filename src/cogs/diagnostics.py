@@ -0,0 +1,131 @@
+import logging
+import marshal
+import threading
+from asyncio import Event
+from asyncio import TimeoutError as AsyncTimeoutError
+from asyncio import get_running_loop, to_thread, wait_for
+from cProfile import Profile
+from io import BytesIO, StringIO
+from pstats import Stats
+from typing import List, Optional, Tuple
+
+import nextcord
+from nextcord.ext import commands
+
+from profiler import LoopMonitor, SamplingProfiler
+from utils import BotClass, do_log, is_owner
+
+PROFILE_FORMATS = ("collapsed", "pstats")
+MAX_PROFILE_SECONDS = 600
+
+
+class Diagnostics(commands.Cog):
+    def __init__(self, bot: BotClass):
+        self.bot = bot
+        self.disabled = False
+        self.profile_stop: Optional[Event] = None
+
+        self.loop_monitor: Optional[LoopMonitor] = None
+        threshold = self.bot.CFG.get("loop_monitor_threshold", 0.25)
+        if not threshold:
+            print("[loop_monitor_threshold set to 0, disabling event loop monitor]")
+            return
+        self.loop_monitor = LoopMonitor(
+            get_running_loop(),
+            threshold,
+            on_slow=lambda report: do_log(report, logging.WARNING),
+        )
+        self.loop_monitor.start()
+
+    def cog_unload(self):
+        if self.profile_stop is not None:
+            self.profile_stop.set()
+        if self.loop_monitor is not None:
+            self.loop_monitor.stop()
+            do_log(f"[Loop monitor] {self.loop_monitor.stats()}")
+
+    @commands.group(name="profile", invoke_without_command=True)
+    async def profile(
+        self, ctx: commands.Context, seconds: int = 30, report: str = "collapsed"
+    ):
+        """
+        Profiles the bot for 'seconds' seconds (or until '/profile stop') and uploads the report:
+        sampled stacks in collapsed form for flame graph tools, or a cProfile pstats dump with a
+        text summary. Owner only.
+        """
+        if not is_owner(self.bot, ctx.author):
+            return
+        if report not in PROFILE_FORMATS:
+            await ctx.send(f"Report format must be one of {', '.join(PROFILE_FORMATS)}")
+            return
+        if self.profile_stop is not None:
+            await ctx.send("Already profiling, use `/profile stop` to end it")
+            return
+        seconds = max(1, min(seconds, MAX_PROFILE_SECONDS))
+        self.profile_stop = Event()
+        await ctx.send(f"Profiling for {seconds}s ({report})")
+        try:
+            if report == "collapsed":
+                files = await self.sample(seconds)
+            else:
+                files = await self.trace(seconds)
+        finally:
+            self.profile_stop = None
+        await ctx.send("Profile finished", files=files)
+
+    @profile.command(name="stop")
+    async def profile_stop_command(self, ctx: commands.Context):
+        """
+        Ends a running profile early; its report is uploaded as usual.
+        """
+        if not is_owner(self.bot, ctx.author):
+            return
+        if self.profile_stop is None:
+            await ctx.send("Not profiling")
+            return
+        self.profile_stop.set()
+
+    async def wait_for_stop(self, seconds: int):
+        assert self.profile_stop is not None  # nosec
+        try:
+            await wait_for(self.profile_stop.wait(), timeout=seconds)
+        except AsyncTimeoutError:
+            pass
+
+    async def sample(self, seconds: int) -> List[nextcord.File]:
+        profiler = SamplingProfiler(threading.get_ident())
+        profiler.start()
+        try:
+            await self.wait_for_stop(seconds)
+        finally:
+            await to_thread(profiler.stop)
+        collapsed = await to_thread(profiler.collapsed)
+        do_log(f"[Profile] {profiler.samples} samples, {len(profiler.stacks)} stacks")
+        return [
+            nextcord.File(BytesIO(collapsed.encode()), filename="profile.collapsed.txt")
+        ]
+
+    async def trace(self, seconds: int) -> List[nextcord.File]:
+        # cProfile hooks the thread that enables it, which is the event loop's
+        profile = Profile()
+        profile.enable()
+        try:
+            await self.wait_for_stop(seconds)
+        finally:
+            profile.disable()
+        summary, dump = await to_thread(format_pstats, profile)
+        return [
+            nextcord.File(BytesIO(summary.encode()), filename="profile.txt"),
+            nextcord.File(BytesIO(dump), filename="profile.prof"),
+        ]
+
+
+def format_pstats(profile: Profile, limit: int = 60) -> Tuple[str, bytes]:
+    """
+    A text summary of the slowest functions by cumulative time, and the raw stats in the format
+    'pstats'/snakeviz load.
+    """
+    stream = StringIO()
+    stats = Stats(profile, stream=stream)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue(), marshal.dumps(stats.stats)  # type: ignore[attr-defined]
@@ -1,148 +1,540 @@
-from asyncio import create_task
+import atexit
+from asyncio import Task, create_task
 from asyncio import sleep as async_sleep
-from time import time
-from typing import Any, Dict, List, Union
+from collections import Counter, deque
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter, time
+from traceback import format_exc
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple, Union
 
 import nextcord
+from nextcord import AllowedMentions
 from nextcord.ext import commands
 
-from utils import BotClass, do_log, log_error
+from invite_log import InviteLog
+from invite_state import InviteRecord, InviteState, describe_invites
+from utils import BotClass, do_log, is_staff, log_error, send_lines
+
+# Settings 'apply_config' can change without reloading the cog ('custom_invite_log' can't)
+LIVE_SETTINGS = frozenset(
+    {
+        "custom_invite_attempts",
+        "custom_invite_channel",
+        "custom_invite_debug",
+        "custom_invite_format",
+        "custom_invite_gap_limit",
+        "custom_invite_join_window",
+        "custom_invite_messages",
+        "custom_invite_reconcile_interval",
+        "custom_invite_snapshot_interval",
+        "discord_channel_ids",
+    }
+)
+# A single-use invite deleted within this many seconds of a join was most likely used up by it
+USED_UP_DELETE_WINDOW = 4.0
 
 
 class InviteCheck(commands.Cog):
     def __init__(self, bot: BotClass):
         self.bot = bot
+        self.disabled = True
+        # Set by Metrics.instrument_cog; joins are handled in windows, after the listener returns
+        self.observe: Optional[Callable[[str, str, float, bool], None]] = None
+        if not self.load_settings():
+            return
+
+        self.pending_joins: List[nextcord.Member] = []
+        # When each pending member's join event arrived, for members without a 'joined_at'
+        self.queued_at: Dict[int, float] = {}
+        self.join_task: Union[None, Task] = None
+        # (time of the delete event, invite) for single-use invites that were probably used up
+        self.deleted_invites: List[Tuple[float, InviteRecord]] = []
+        self.invite_fetches = 0
+        self.joins_seen = 0
+
+        # Recently welcomed (or queued) members, so catching up after a gap doesn't repeat them
+        self.recent_member_ids: Deque[int] = deque(maxlen=5000)
+        # Set while disconnected: joins since then may have had no event
+        self.gap_start: Union[None, float] = None
+
+        # Loaded synchronously, so joins right after startup are diffed against the state the
+        # bot shut down with instead of an empty one
+        self.invite_state = InviteState(Path.cwd() / "data" / "invite_snapshot.json")
+        # Whether the state is a usable baseline for finding this window's uses. Until it is, joins
+        # aren't attributed and the state isn't saved
+        self.state_current = False
+        saved_at = self.invite_state.load()
+        if saved_at is not None:
+            self.state_current = True
+            do_log(f"Loaded {len(self.invite_state)} invites from snapshot")
+            self.catch_up(saved_at)
+        self.reconcile_task = create_task(self.reconcile_loop())
+        self.snapshot_task = create_task(self.save_snapshot_loop())
 
+        self.invite_log: Optional[InviteLog] = None
+        if self.bot.CFG.get("custom_invite_log", False):
+            self.invite_log = InviteLog(Path.cwd() / "data" / "invite_log.sqlite")
+            self.invite_log.start()
+            atexit.register(self.invite_log.close)  # In case the cog is never unloaded
+        self.disabled = False
+
+    def load_settings(self) -> bool:
+        """
+        Reads the settings that can change while the cog is loaded. Returns False, after saying
+        why, if invite checking has to stay disabled.
+        """
         welcome_channel_name = self.bot.CFG.get("custom_invite_channel", "welcome")
         welcome_channel = self.bot.channels.get(welcome_channel_name, None)
         if welcome_channel is None:
             print("['welcome' channel not set, disabling invite check subroutine]")
-            return
+            return False
         self.welcome_channel = welcome_channel
 
         self.debug = self.bot.CFG.get("custom_invite_debug", False)
 
         self.attempts = self.bot.CFG.get("custom_invite_attempts", 3)
 
-        self.custom_invite_format = bot.CFG.get(
+        self.custom_invite_format = self.bot.CFG.get(
             "custom_invite_format", "> {member_name} has joined from {invite_name}"
         )
-        self.custom_invite_messages = bot.CFG.get("custom_invite_messages", {})
-        self.latest_join_time = 0.0
-        self.latest_single_use = 0.0
-        self.latest_single_use_invite: Union[None, Dict[str, Any]] = None
-
-        create_task(self.update_invites())
-
-    async def update_invites(self):
-        self.invites = (await self.bot.guild.invites())[:]
-        self.invite_map = await self.map_invites(self.invites)
-
-    async def map_invites(self, invites: List[nextcord.Invite]):
-        invite_map: Dict[str, Dict] = {}
-        for invite in invites:
-            invite_map[invite.code] = {
-                "uses": invite.uses,
-                "inviter": invite.inviter,
-                "max_uses": invite.max_uses,
-            }
-        return invite_map.copy()
+        self.custom_invite_messages = self.bot.CFG.get("custom_invite_messages", {})
+        self.join_window = self.bot.CFG.get("custom_invite_join_window", 2.0)
+        self.gap_limit = self.bot.CFG.get("custom_invite_gap_limit", 3600)
+        self.reconcile_interval = self.bot.CFG.get(
+            "custom_invite_reconcile_interval", 3600
+        )
+        self.snapshot_interval = self.bot.CFG.get("custom_invite_snapshot_interval", 30)
+        return True
+
+    def apply_config(self, changed: Set[str]) -> bool:
+        """
+        Applies changed settings in place. Returns False if the cog has to be reloaded for them.
+        """
+        if self.disabled or not changed <= LIVE_SETTINGS:
+            return False
+        return self.load_settings()
+
+    def cog_unload(self):
+        if self.disabled:
+            return
+        self.reconcile_task.cancel()
+        self.snapshot_task.cancel()
+        self.save_snapshot()
+        if self.invite_log is not None:
+            self.invite_log.close()
+
+    def save_snapshot(self):
+        # The snapshot's time is where the next start catches up from, so it is only saved while no
+        # join is waiting to be attributed, and never while the state itself is out of date
+        if self.gap_start is not None or self.pending_joins or not self.state_current:
+            return
+        try:
+            self.invite_state.save(force=True)
+        except OSError:
+            log_error(f"[FAILED TO SAVE INVITE SNAPSHOT]\n{format_exc()}")
+
+    async def save_snapshot_loop(self):
+        while True:
+            await async_sleep(self.snapshot_interval)
+            self.save_snapshot()
+
+    def catch_up(self, since: float):
+        """
+        Queues members who joined after 'since' (the start of a disconnect, or when the snapshot
+        was saved) but were never welcomed, since their join events were missed. The join window
+        then attributes their uses like any other join, against the state from before the gap.
+        """
+        self.gap_start = None
+        if time() - since > self.gap_limit:
+            # Uses from the missed joins are still in the state's diff, and would be pinned on the
+            # next members to join
+            do_log(
+                "Invite state is too old to attribute joins during the gap, "
+                "skipping attribution until the next invite fetch"
+            )
+            self.state_current = False
+            return
+        welcomed = set(self.recent_member_ids)
+        missed = sorted(
+            (
+                member
+                for member in self.bot.guild.members
+                if member.joined_at is not None
+                and member.joined_at.timestamp() > since
+                and member.id not in welcomed
+            ),
+            key=lambda member: member.joined_at,
+        )
+        if not missed:
+            return
+        do_log(f"Catching up on {len(missed)} joins missed while disconnected")
+        self.pending_joins[:0] = missed
+        self.recent_member_ids.extend(member.id for member in missed)
+        if self.join_task is None or self.join_task.done():
+            self.join_task = create_task(self.process_joins())
 
     @commands.Cog.listener()
-    async def on_member_join(self, member: nextcord.Member):
-        # Intercept a recently finished finite-use invite
-        self.latest_join_time = time()
-        await async_sleep(2)
-
-        found_invite = False
-        attempts = self.attempts
-        invite_message = self.custom_invite_format.format(
-            member_name=member.mention, invite_name="{invite_name}"
+    async def on_disconnect(self):
+        if not self.disabled and self.gap_start is None:
+            self.gap_start = time()
+
+    @commands.Cog.listener()
+    async def on_resumed(self):
+        # Events missed during a resumed session are replayed before this, so only joins that
+        # never had an event are left over
+        if not self.disabled and self.gap_start is not None:
+            self.catch_up(self.gap_start)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # Fired instead of on_resumed when the session couldn't be resumed
+        if not self.disabled and self.gap_start is not None:
+            self.catch_up(self.gap_start)
+
+    async def reconcile_loop(self):
+        """
+        The invite state is kept up to date from join and invite events; a full fetch every
+        'custom_invite_reconcile_interval' seconds (and once at startup) only catches anything
+        those missed, such as events dropped while disconnected.
+        """
+        while True:
+            try:
+                await self.reconcile_invites()
+            except Exception:
+                log_error(f"[FAILED TO RECONCILE INVITES]\n{format_exc()}")
+            await async_sleep(self.reconcile_interval)
+
+    async def reconcile_invites(self):
+        joins_seen = self.joins_seen
+        if not self.joins_idle():
+            return
+        current_invites = await self.bot.guild.invites()
+        self.invite_fetches += 1
+        # A member who joined during the fetch may already be counted in it; applying it now would
+        # absorb their use and leave the join window unable to attribute it. The same goes for
+        # members who joined while disconnected, until they have been caught up on
+        if self.joins_seen != joins_seen or not self.joins_idle():
+            return
+        trusted = self.state_current
+        changes = self.invite_state.reconcile(current_invites)
+        self.state_current = True
+        if changes and trusted:
+            do_log(f"Invite reconciliation corrected {changes} invites")
+
+    def joins_idle(self) -> bool:
+        return (
+            self.gap_start is None
+            and not self.pending_joins
+            and (self.join_task is None or self.join_task.done())
         )
-        current_invites: List[nextcord.Invite] = await self.bot.guild.invites()
-        if self.debug:
-            do_log(f"Old Invite Map:\n{self.invite_map}\n")
-            new_invite_map = await self.map_invites(current_invites)
-            do_log(f"New Invite Map:\n{new_invite_map}\n")
 
-        if (
-            abs(self.latest_single_use - self.latest_join_time) < 4
-            and self.latest_single_use_invite is not None
-        ):
-            found_invite = True
-            attempts = 0
-            inviter_mention = self.latest_single_use_invite["inviter"].mention
+    @commands.Cog.listener()
+    async def on_member_join(self, member: nextcord.Member):
+        if self.disabled:
+            return
+        self.joins_seen += 1
+        self.recent_member_ids.append(member.id)
+        self.queued_at[member.id] = time()
+        self.pending_joins.append(member)
+        if self.join_task is None or self.join_task.done():
+            self.join_task = create_task(self.process_joins())
 
-            invite_message = invite_message.format(
-                invite_name=f"{inviter_mention}'s invite ({self.latest_single_use_invite['code']})"
-            )
+    async def process_joins(self):
+        """
+        Handles joins in windows of 'custom_invite_join_window' seconds, with one invite fetch per
+        window no matter how many members joined in it. Windows are processed one at a time, so
+        the invite map is never updated concurrently and welcomes go out in join order.
+        """
+        while self.pending_joins:
+            await async_sleep(self.join_window)
+            members = self.pending_joins
+            self.pending_joins = []
+            start = perf_counter()
+            failed = False
+            try:
+                await self.welcome_members(members)
+            except Exception:
+                failed = True
+                log_error(f"[FAILED TO WELCOME {len(members)} MEMBERS]\n{format_exc()}")
+            finally:
+                for member in members:
+                    self.queued_at.pop(member.id, None)
+            if self.observe is not None:
+                self.observe("job", "welcome_members", perf_counter() - start, failed)
 
-        for _ in range(attempts):
-            for invite in current_invites:
-                # Skip any invites that were not used
-                if invite.uses is not None and invite.uses <= 0:
-                    continue
-
-                if invite.inviter is not None:
-                    inviter_mention = invite.inviter.mention
-
-                # If the invite wasn't logged, it was newly added (and used)
-                old_invite: Union[Dict, None] = self.invite_map.get(invite.code)
-                if old_invite is None:
-                    invite_message = invite_message.format(
-                        invite_name=f"{inviter_mention}'s invite ({invite.code})"
-                    )
-                    found_invite = True
-                    break
-
-                # If it was logged and it hasn't increased since our record of it, skip
-                if invite.uses <= old_invite["uses"]:
-                    continue
-
-                # Show a custom message for any invites we know the source of and have a message for
-                found_invite = True
-                invite_name = f"{inviter_mention}'s invite ({invite.code})"
-                custom_msg = self.custom_invite_messages.get(invite.code)
-                if custom_msg is not None:
-                    invite_name = custom_msg
-                invite_message = invite_message.format(invite_name=invite_name)
+    async def welcome_members(self, members: List[nextcord.Member]):
+        current_invites: List[nextcord.Invite] = []
+        used_invites: List[InviteRecord] = []
+        attributing = self.state_current
+        for attempt in range(max(1, self.attempts) if attributing else 1):
+            if attempt > 0:
+                await async_sleep(
+                    1
+                )  # Invite uses can lag slightly behind the join event
+            current_invites = await self.bot.guild.invites()
+            self.invite_fetches += 1
+            if not attributing:
+                # Every use since the state was saved would look like one from this window
+                do_log(
+                    f"Invite state is out of date, not attributing {len(members)} joins"
+                )
                 break
-
-            if found_invite:
+            used_invites = self.find_used_invites(current_invites, members)
+            # Members who joined while the invites were being fetched may already be counted in
+            # them; they belong to this window, or their uses would be lost from the next one
+            extra_uses = len(used_invites) - len(members)
+            if extra_uses > 0 and self.pending_joins:
+                members += self.pending_joins[:extra_uses]
+                del self.pending_joins[:extra_uses]
+            if len(used_invites) >= len(members):
                 break
 
-        if not (found_invite):
-            new_invite_map = await self.map_invites(current_invites)
+        if self.debug:
+            do_log(f"Old Invite Map:\n{self.invite_state}\n")
+            do_log(f"New Invite Map:\n{describe_invites(current_invites)}\n")
+
+        if attributing and len(used_invites) < len(members):
             log_error(
-                "[COULD NOT FIND INVITE USED]\n"
-                f"Old Invite Map:\n{self.invite_map}\n\n"
-                f"New Invite Map:\n{new_invite_map}\n\n"
+                f"[COULD NOT FIND INVITE USED BY {len(members) - len(used_invites)} "
+                f"OF {len(members)} MEMBERS]\n"
+                f"Old Invite Map:\n{self.invite_state}\n\n"
+                f"New Invite Map:\n{describe_invites(current_invites)}\n\n"
+            )
+
+        # The window's fetch doubles as a full reconciliation
+        self.invite_state.reconcile(current_invites)
+        self.state_current = True
+        used = {id(record) for record in used_invites}
+        self.deleted_invites = [
+            (deleted_at, record)
+            for deleted_at, record in self.deleted_invites
+            if id(record) not in used
+        ]
+        self.prune_deleted_invites()
+        self.save_snapshot()
+
+        self.log_attributions(members, used_invites)
+
+        # Welcomes from one window share as few messages as possible, still in join order
+        unknown_name = "[ERROR]" if attributing else "an unknown invite"
+        welcomes = [
+            self.custom_invite_format.format(
+                member_name=member.mention,
+                invite_name=(
+                    self.invite_name(used_invites[position])
+                    if position < len(used_invites)
+                    else unknown_name
+                ),
+            )
+            for position, member in enumerate(members)
+        ]
+        await send_lines(
+            self.welcome_channel, welcomes, allowed_mentions=AllowedMentions.all()
+        )
+
+    def log_attributions(
+        self, members: List[nextcord.Member], used_invites: List[InviteRecord]
+    ):
+        """
+        Records which invite each member was matched to. The confidence is the share of the
+        window's uses that came from that invite: 1 when every use was of the same invite, lower
+        when uses of several invites were handed out by join order.
+        """
+        if self.invite_log is None:
+            return
+        uses_per_code = Counter(record.code for record in used_invites)
+        for position, member in enumerate(members):
+            joined_at = self.join_time(member)
+            if position < len(used_invites):
+                record = used_invites[position]
+                confidence = uses_per_code[record.code] / len(used_invites)
+                self.invite_log.record_join(
+                    member.id, joined_at, record.code, record.inviter_id, confidence
+                )
+            else:
+                self.invite_log.record_join(member.id, joined_at, None, None, 0.0)
+
+    def find_used_invites(
+        self, current_invites: List[nextcord.Invite], members: List[nextcord.Member]
+    ) -> List[InviteRecord]:
+        """
+        Returns one invite per use since the invite state was last updated: single-use invites
+        deleted within a few seconds of one of the 'members' joining, then every increase in an
+        invite's use count. Discord doesn't say which member used which invite, so when several
+        invites were used within one window, the uses are handed out to members in join order.
+        """
+        join_times = [self.join_time(member) for member in members]
+        used_invites = [
+            record
+            for deleted_at, record in self.deleted_invites
+            if any(
+                abs(deleted_at - joined_at) < USED_UP_DELETE_WINDOW
+                for joined_at in join_times
             )
-            invite_message = invite_message.format(invite_name="[ERROR]")
+        ]
+        # Single-use invites whose delete event was missed (while offline or disconnected).
+        # Expired ones ran out of time, not uses
+        now = time()
+        current_codes = {invite.code for invite in current_invites}
+        used_invites += [
+            record
+            for record in self.invite_state.records.values()
+            if record.code not in current_codes
+            and record.max_uses != 0
+            and record.max_uses - record.uses <= 1
+            and not record.expired(now)
+        ]
+        for invite in current_invites:
+            old_invite = self.invite_state.get(invite.code)
+            # If the invite wasn't logged, it was newly added (and possibly used)
+            old_uses = old_invite.uses if old_invite is not None else 0
+            new_uses = max(0, (invite.uses or 0) - old_uses)
+            if new_uses:
+                used_invites += [InviteRecord.from_invite(invite)] * new_uses
+        return used_invites
 
-        self.invites = current_invites[:]
-        self.invite_map = await self.map_invites(self.invites)
+    def join_time(self, member: nextcord.Member) -> float:
+        if member.joined_at is not None:
+            return member.joined_at.timestamp()
+        # nextcord doesn't always know it; the join event arrived moments after the join
+        return self.queued_at.get(member.id, time())
 
-        await self.welcome_channel.send(invite_message)
+    def invite_name(self, invite: InviteRecord) -> str:
+        # Show a custom message for any invites we know the source of and have a message for
+        custom_msg = self.custom_invite_messages.get(invite.code)
+        if custom_msg is not None:
+            return custom_msg
+        return f"{invite.inviter_mention or 'an unknown user'}'s invite ({invite.code})"
 
     @commands.Cog.listener()
     async def on_invite_create(self, invite: nextcord.Invite):
-        await self.update_invites()
+        if self.disabled:
+            return
+        # The event has everything the state needs, and a refetch could race with pending joins
+        self.invite_state.add(InviteRecord.from_invite(invite))
 
     @commands.Cog.listener()
     async def on_invite_delete(self, invite: nextcord.Invite):
-        mapped_invite = self.invite_map.get(invite.code)
-        if mapped_invite is not None:
-            single_use = mapped_invite["max_uses"] != 0
-            if (
-                single_use
-                and mapped_invite["uses"] is not None
-                and mapped_invite["max_uses"] is not None
-            ):
-                uses_left = mapped_invite["max_uses"] - mapped_invite["uses"]
-                if uses_left <= 1:
-                    self.latest_single_use = time()
-                    mapped_invite["code"] = invite.code
-                    self.latest_single_use_invite = mapped_invite
-        else:
-            await self.update_invites()
+        if self.disabled:
+            return
+        # Unknown codes have nothing to remove; the next reconciliation covers anything missed
+        record = self.invite_state.remove(invite.code)
+        now = time()
+        if record is not None and record.max_uses != 0 and not record.expired(now):
+            if record.max_uses - record.uses <= 1:
+                # Probably used up by a member whose join is about to be processed; if no join
+                # comes within a few seconds, it was deleted by hand instead
+                self.deleted_invites.append((now, record))
+        if self.join_task is None or self.join_task.done():
+            self.prune_deleted_invites()
+
+    def prune_deleted_invites(self):
+        """
+        Drops deleted invites too old to match any join still waiting, or any join to come.
+        Not called while a window is being processed, since its members are no longer pending.
+        """
+        cutoff = (
+            min([time()] + [self.join_time(member) for member in self.pending_joins])
+            - USED_UP_DELETE_WINDOW
+        )
+        self.deleted_invites = [
+            (deleted_at, record)
+            for deleted_at, record in self.deleted_invites
+            if deleted_at > cutoff
+        ]
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: nextcord.Member):
+        if not self.disabled and self.invite_log is not None:
+            self.invite_log.record_leave(member.id, time())
+
+    @commands.group(name="invites", invoke_without_command=True)
+    async def invites(self, ctx: commands.Context, days: Optional[int] = None):
+        """
+        Top inviters by joins, over the last 'days' days (UTC) or all time.
+        """
+        if (
+            self.disabled
+            or self.invite_log is None
+            or not is_staff(self.bot, ctx.author)
+        ):
+            return
+        rows = await self.invite_log.top_inviters(days)
+        lines = [f"**Top inviters, {period_name(days)}**"]
+        lines += [
+            f"{place}. <@{inviter_id}>: {joins} joins, {kept} still here"
+            for place, (inviter_id, joins, kept) in enumerate(rows, start=1)
+        ]
+        await send_lines(ctx, lines)
+
+    @invites.command(name="codes")
+    async def invites_codes(self, ctx: commands.Context, days: Optional[int] = None):
+        """
+        Top invites by joins, over the last 'days' days (UTC) or all time.
+        """
+        if (
+            self.disabled
+            or self.invite_log is None
+            or not is_staff(self.bot, ctx.author)
+        ):
+            return
+        rows = await self.invite_log.top_invites(days)
+        lines = [f"**Top invites, {period_name(days)}**"]
+        lines += [
+            f"{place}. `{code}` ({self.invite_name(InviteRecord(code, 0, 0, inviter_id))}): "
+            f"{joins} joins, {kept} still here"
+            for place, (code, inviter_id, joins, kept) in enumerate(rows, start=1)
+        ]
+        await send_lines(ctx, lines)
+
+    @invites.command(name="retention")
+    async def invites_retention(
+        self, ctx: commands.Context, days: Optional[int] = None, min_joins: int = 5
+    ):
+        """
+        Share of each inviter's joins still in the server, for inviters with at least
+        'min_joins' joins over the last 'days' days (UTC) or all time.
+        """
+        if (
+            self.disabled
+            or self.invite_log is None
+            or not is_staff(self.bot, ctx.author)
+        ):
+            return
+        rows = await self.invite_log.retention(days, min_joins)
+        lines = [f"**Inviter retention, {period_name(days)}**"]
+        lines += [
+            f"{place}. <@{inviter_id}>: {kept}/{joins} still here ({kept / joins:.0%})"
+            for place, (inviter_id, joins, kept) in enumerate(rows, start=1)
+        ]
+        await send_lines(ctx, lines)
+
+    @invites.command(name="member")
+    async def invites_member(self, ctx: commands.Context, user: nextcord.User):
+        """
+        Which invites a member joined through, latest first.
+        """
+        if (
+            self.disabled
+            or self.invite_log is None
+            or not is_staff(self.bot, ctx.author)
+        ):
+            return
+        rows = await self.invite_log.member_joins(user.id)
+        lines = [f"**Joins of {user.mention}**"]
+        for joined, code, inviter_id, confidence, left in rows:
+            line = f"`{datetime.utcfromtimestamp(joined):%Y-%m-%d %H:%M}` "
+            if code is None:
+                line += "unknown invite"
+            else:
+                line += f"{self.invite_name(InviteRecord(code, 0, 0, inviter_id))}"
+                line += f" ({confidence:.0%} sure)"
+            if left is not None:
+                line += f", left `{datetime.utcfromtimestamp(left):%Y-%m-%d}`"
+            lines.append(line)
+        await send_lines(ctx, lines)
+
+
+def period_name(days: Optional[int]) -> str:
+    return f"last {days} days" if days is not None else "all time"
@@ -1,45 +1,231 @@
-from mimetypes import guess_type
+from asyncio import FIRST_COMPLETED, Task, create_task
+from asyncio import sleep as async_sleep
+from asyncio import wait
+from pathlib import Path
 from re import compile as regex_compile
+from time import monotonic
+from typing import Any, Dict, List, Set
 
 import nextcord
-from aiohttp import ClientSession as AioClientSession
 from nextcord.ext import commands
 
-from utils import BotClass
+from media_probe import MediaProbe
+from reaction_dispatch import ReactionDispatcher
+from repost_index import RepostDetector, pillow_available
+from url_cache import UrlVerdictCache, normalize_url
+from url_rules import MEDIA, NOT_MEDIA, UrlRules
+from utils import BotClass, do_log
+
+# Settings 'apply_config' can change without reloading the cog
+LIVE_SETTINGS = frozenset(
+    {
+        "discord_channel_ids",
+        "media_rate_channels",
+        "media_rate_downvote",
+        "media_rate_probe_deadline",
+        "media_rate_reaction_interval",
+        "media_rate_repost_emoji",
+        "media_rate_upvote",
+        "media_rate_url_rules",
+    }
+)
+# Rated messages whose late link previews are still checked for reposts
+RECENT_MEDIA_SIZE = 1000
+
+
+class RecentMedia:
+    __slots__ = ("message", "checked_urls", "marked")
+
+    def __init__(self, message: nextcord.Message):
+        self.message = message
+        self.checked_urls: Set[str] = set()
+        self.marked = False
+
+
+def raw_embed_image_urls(embeds: List[Dict[str, Any]]) -> List[str]:
+    """
+    Image and thumbnail URLs of embeds in a raw gateway payload.
+    """
+    urls = []
+    for embed in embeds:
+        for key in ("image", "thumbnail"):
+            image = embed.get(key) or {}
+            url = image.get("proxy_url") or image.get("url")
+            if url:
+                urls.append(url)
+    return urls
 
 
 class MediaRate(commands.Cog):
     def __init__(self, bot: BotClass):
         self.bot = bot
+        self.disabled = True
         self.url_regex = regex_compile(
             r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+"
         )
 
+        if not self.load_settings():
+            return
+
+        self.probe = MediaProbe(
+            connections=self.bot.CFG.get("media_rate_probe_connections", 20),
+            connections_per_host=self.bot.CFG.get(
+                "media_rate_probe_connections_per_host", 4
+            ),
+            timeout=self.bot.CFG.get("media_rate_probe_timeout", 10.0),
+            max_bytes=self.bot.CFG.get("media_rate_probe_max_bytes", 524288),
+        )
+        self.reactions = ReactionDispatcher(
+            interval=self.bot.CFG.get("media_rate_reaction_interval", 0.25),
+            name="Media rate reactions",
+        )
+        self.url_cache = UrlVerdictCache(
+            Path.cwd() / "data" / "media_url_cache.json",
+            max_entries=self.bot.CFG.get("media_rate_cache_size", 10000),
+            ttl=self.bot.CFG.get("media_rate_cache_ttl", 604800),
+            failure_ttl=self.bot.CFG.get("media_rate_cache_failure_ttl", 3600),
+        )
+        self.url_cache.load()
+        self.save_task = create_task(self.save_url_cache_loop())
+        self.disabled = False
+
+        self.reposts: RepostDetector | None = None
+        self.repost_checks: Set[Task] = set()
+        self.recent_media: Dict[int, RecentMedia] = {}
+        if not self.bot.CFG.get("media_rate_repost_check", False):
+            print(
+                "[media_rate_repost_check set to 'false' or missing, disabling repost check]"
+            )
+        elif not pillow_available():
+            print("[Pillow not installed, disabling repost check subroutine]")
+        else:
+            self.reposts = RepostDetector(
+                Path.cwd() / "data" / "media_hashes.sqlite",
+                max_distance=self.bot.CFG.get("media_rate_repost_distance", 6),
+                workers=self.bot.CFG.get("media_rate_repost_workers", 2),
+            )
+            create_task(self.reposts.start())
+
+        self.bot.router.add(
+            "media_rate", self.on_message, channel_ids=self.media_rate_channel_ids
+        )
+
+    def load_settings(self) -> bool:
+        """
+        Reads the settings that can change while the cog is loaded. Returns False, after saying
+        why, if media rating has to stay disabled.
+        """
         media_rate_channels = self.bot.CFG.get("media_rate_channels", [])
 
         if not media_rate_channels:
             print(
                 "['media_rate_channels' channels not set, disabling media rating subroutine]"
             )
-            return
+            return False
 
         self.media_rate_channel_ids = []
         for channel_name in media_rate_channels:
-            if channel_name not in self.bot.channels:
+            if self.bot.channels.get(channel_name) is None:
                 print(
                     f"['{channel_name}' not found, disabling media rating subroutine]"
                 )
-                return
+                return False
             self.media_rate_channel_ids.append(self.bot.channels[channel_name].id)
 
         self.downvote_emoji = self.bot.CFG.get("media_rate_downvote", "👎")
         self.upvote_emoji = self.bot.CFG.get("media_rate_upvote", "👍")
 
-    @commands.Cog.listener()
-    async def on_message(self, message: nextcord.Message):
-        if message.channel.id not in self.media_rate_channel_ids:
+        try:
+            self.url_rules = UrlRules(self.bot.CFG.get("media_rate_url_rules", []))
+        except (TypeError, ValueError) as e:
+            print(
+                f"[Invalid 'media_rate_url_rules' ({e}), disabling media rating subroutine]"
+            )
+            return False
+
+        self.probe_deadline = self.bot.CFG.get("media_rate_probe_deadline", 8.0)
+        self.repost_emoji = self.bot.CFG.get("media_rate_repost_emoji", "♻️")
+        return True
+
+    def apply_config(self, changed: Set[str]) -> bool:
+        """
+        Applies changed settings in place. Returns False if the cog has to be reloaded for them.
+        """
+        if self.disabled or not changed <= LIVE_SETTINGS:
+            return False
+        if not self.load_settings():
+            return False
+        self.reactions.interval = self.bot.CFG.get("media_rate_reaction_interval", 0.25)
+        self.bot.router.add(
+            "media_rate", self.on_message, channel_ids=self.media_rate_channel_ids
+        )
+        return True
+
+    def cog_unload(self):
+        if self.disabled:
             return
+        self.bot.router.remove("media_rate")
+        self.save_task.cancel()
+        self.reactions.close()
+        if self.reposts is not None:
+            for task in self.repost_checks:
+                task.cancel()
+            self.reposts.close()
+        self.url_cache.save()
+        create_task(self.probe.close())
+
+    async def save_url_cache_loop(self):
+        while True:
+            await async_sleep(300)
+            if self.url_cache.dirty:
+                self.url_cache.save()
+                do_log(f"[Media rate] URL cache: {self.url_cache.stats()}")
+                do_log(f"[Media rate] Reactions: {self.reactions.stats()}")
+
+    async def probe_url(self, url: str) -> bool:
+        verdict = await self.probe.has_media(url)
+        self.url_cache.put(url, verdict)
+        return bool(verdict)
+
+    async def probe_urls(self, urls: List[str]) -> bool:
+        """
+        Checks links that no URL rule could classify: cached verdicts first, then all uncached
+        links at once. Returns as soon as any of them has media (cancelling the other probes), or
+        False once all have answered or 'media_rate_probe_deadline' has passed.
+        """
+        unique_urls = {normalize_url(url): url for url in urls}.values()
+        uncached = []
+        for url in unique_urls:
+            verdict = self.url_cache.get(url)
+            if verdict:
+                return True
+            if verdict is None:
+                uncached.append(url)
+        if not uncached:
+            return False
+
+        deadline = monotonic() + self.probe_deadline
+        pending: Set[Task] = {create_task(self.probe_url(url)) for url in uncached}
+        try:
+            while pending:
+                done, pending = await wait(
+                    pending,
+                    timeout=max(0.0, deadline - monotonic()),
+                    return_when=FIRST_COMPLETED,
+                )
+                if not done:
+                    return False  # Deadline passed
+                if any(task.result() for task in done):
+                    return True
+            return False
+        finally:
+            for task in pending:
+                task.cancel()
 
+    async def on_message(self, message: nextcord.Message):
+        """
+        Only called for messages in media channels, which the message router filters for.
+        """
         has_media = False
         if len(message.attachments) > 0:
             has_media = True
@@ -54,28 +240,101 @@ class MediaRate(commands.Cog):
         if not has_media:
             message_urls = self.url_regex.findall(message.content)
 
+            probe_urls = []
             for url in message_urls:
-                mime_type, _ = guess_type(url)
-                if (mime_type) and mime_type.startswith(("image", "video", "audio")):
+                verdict = self.url_rules.classify(url)
+                if verdict == MEDIA:
                     has_media = True
                     break
+                if verdict != NOT_MEDIA:
+                    probe_urls.append(url)
 
-                async with AioClientSession() as session:
-                    async with session.get(url) as response:
-                        try:
-                            body = await response.text()
-                            if (
-                                "og:image" in body
-                                or "og:video" in body
-                                or "og:audio" in body
-                            ):
-                                has_media = True
-                                break
-                        except Exception:  # nosec
-                            continue
+            if not has_media and probe_urls:
+                has_media = await self.probe_urls(probe_urls)
 
         if not has_media:
             return
 
-        await message.add_reaction(self.upvote_emoji)
-        await message.add_reaction(self.downvote_emoji)
+        self.reactions.enqueue(message, [self.upvote_emoji, self.downvote_emoji])
+
+        if self.reposts is not None:
+            recent = self.recent_media[message.id] = RecentMedia(message)
+            if len(self.recent_media) > RECENT_MEDIA_SIZE:
+                del self.recent_media[next(iter(self.recent_media))]
+            image_urls = [
+                attachment.proxy_url
+                for attachment in message.attachments
+                if (attachment.content_type or "").startswith("image/")
+            ]
+            for embed in message.embeds:
+                for image in (embed.image, embed.thumbnail):
+                    url = image.proxy_url or image.url
+                    if url:
+                        image_urls.append(str(url))
+            self.start_repost_check(recent, image_urls)
+
+    def start_repost_check(self, recent: RecentMedia, image_urls: List[str]):
+        """
+        Checks the images of a rated message that haven't been checked yet.
+        """
+        new_urls = [url for url in image_urls if url not in recent.checked_urls]
+        if not new_urls:
+            return
+        recent.checked_urls.update(new_urls)
+        task = create_task(self.check_repost(recent, new_urls))
+        self.repost_checks.add(task)
+        task.add_done_callback(self.repost_checks.discard)
+
+    async def check_repost(self, recent: RecentMedia, image_urls: List[str]):
+        """
+        Reacts to (and logs) media whose images were already posted in a media channel.
+        """
+        if self.reposts is None:
+            return
+        message = recent.message
+        matches = await self.reposts.check(
+            self.probe.get_session(),
+            message.id,
+            message.channel.id,
+            message.author.id,
+            image_urls,
+        )
+        if not matches or recent.marked:
+            return
+        recent.marked = True
+        distance, original_id, original_channel_id = matches[0]
+        self.reactions.enqueue(message, [self.repost_emoji])
+        do_log(
+            f"[Media rate] Repost by {message.author} in #{message.channel}: "
+            f"https://discord.com/channels/{self.bot.guild.id}/{original_channel_id}/"
+            f"{original_id} ({distance} bits apart, {len(matches)} earlier posts)"
+        )
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: nextcord.RawMessageUpdateEvent):
+        """
+        Link previews usually arrive in a MESSAGE_UPDATE after the message was rated, so their
+        images are only checked for reposts here.
+        """
+        if self.disabled or self.reposts is None:
+            return
+        recent = self.recent_media.get(payload.message_id)
+        if recent is not None:
+            data: Dict[str, Any] = dict(payload.data)
+            embeds = data.get("embeds") or []
+            self.start_repost_check(recent, raw_embed_image_urls(embeds))
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: nextcord.RawMessageDeleteEvent):
+        if not self.disabled:
+            self.reactions.discard([payload.message_id])
+            self.recent_media.pop(payload.message_id, None)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(
+        self, payload: nextcord.RawBulkMessageDeleteEvent
+    ):
+        if not self.disabled:
+            self.reactions.discard(payload.message_ids)
+            for message_id in payload.message_ids:
+                self.recent_media.pop(message_id, None)
@@ -1,22 +1,80 @@
-import sqlite3
-from asyncio import create_task
-from datetime import datetime
-from json import dumps as json_dumps
+import atexit
+from asyncio import create_task, to_thread
+from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from time import perf_counter, time
+from traceback import format_exc
+from typing import Any, Callable, Dict, List, Optional, Set
 
 import nextcord
 from nextcord.ext import commands
-
-from utils import BotClass, do_log, get_est_time
-
-MessageColumnsType = Tuple[int, float, int, int, str, Optional[str]]
+from nextcord.types.message import Message as MessagePayload
+from nextcord.utils import parse_time, snowflake_time, time_snowflake
+
+from backfill import BackfillJob, BackfillScheduler
+from db_writer import BatchedWriter
+from message_store import (
+    MessageRecordType,
+    RevisionRecordType,
+    build_search_query,
+    fts_query,
+    insert_message_records,
+    insert_revision_records,
+    migrate,
+    pause_rollups,
+    payload_to_record,
+    rebuild_pending_rollups,
+)
+from utils import BotClass, do_log, get_est_time, is_staff, log_error, send_lines
+
+
+def parse_snowflake(value: Optional[str]) -> Optional[int]:
+    """
+    Reads an ID from a raw number or a user/channel/role mention.
+    """
+    if value is None:
+        return None
+    digits = value.strip("<@!#&>")
+    if not digits.isdigit():
+        raise ValueError(f"'{value}' is not a mention or ID")
+    return int(digits)
+
+
+def parse_date_snowflake(value: Optional[str]) -> Optional[int]:
+    """
+    Converts a YYYY-MM-DD date (UTC midnight) to the lowest snowflake of that moment.
+    """
+    if value is None:
+        return None
+    try:
+        date = datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise ValueError(f"'{value}' is not a YYYY-MM-DD date")
+    return time_snowflake(date)
+
+
+# Settings 'apply_config' can change without reloading the cog ('message_log' itself can't). A new
+# backfill concurrency only takes effect on the next backfill
+LIVE_SETTINGS = frozenset(
+    {
+        "message_log_backfill_chunk_size",
+        "message_log_backfill_concurrency",
+        "message_log_backfill_rps",
+        "message_log_batch_size",
+        "message_log_compress",
+        "message_log_flush_interval",
+        "message_log_queue_size",
+    }
+)
 
 
 class MessageLogging(commands.Cog):
     def __init__(self, bot: BotClass):
         self.bot = bot
         self.disabled = False
+        # Set by Metrics.instrument_cog; the gateway hook isn't a listener, so it times itself
+        self.observe: Optional[Callable[[str, str, float, bool], None]] = None
         if not self.bot.CFG.get("message_log", False):
             print(
                 "[message_log set to 'false' or missing from config, disabling message logging subroutine."
@@ -25,220 +83,414 @@ class MessageLogging(commands.Cog):
             return
         self.loading = True
         self.db_path = Path.cwd() / "data" / "message_log.sqlite"
-        self.message_buffer: List[MessageColumnsType] = []
+        self.message_buffer: List[MessageRecordType] = []
         self.message_buffer_not_empty = False
-        self.setup_db()
+        self.scheduler: Optional[BackfillScheduler] = None
+        self.writer = BatchedWriter(self.db_path, {}, name="message-log-writer")
+        self.load_settings()
+        atexit.register(self.writer.close)  # In case the cog is never unloaded
+        self.install_message_parser()
+        self.backfill_task = create_task(self.setup_db())
+
+    def load_settings(self):
+        """
+        Reads the settings that can change while the cog is loaded. The writer thread picks up its
+        new settings with its next item.
+        """
+        compress = self.bot.CFG.get("message_log_compress", False)
+        self.writer.handlers = {
+            "message": partial(insert_message_records, compress=compress),
+            "buffered_message": partial(
+                insert_message_records, compress=compress, advance_checkpoints=False
+            ),
+            "revision": partial(insert_revision_records, compress=compress),
+        }
+        self.writer.batch_size = self.bot.CFG.get("message_log_batch_size", 500)
+        self.writer.flush_interval = self.bot.CFG.get("message_log_flush_interval", 1.0)
+        self.writer.resize_queue(self.bot.CFG.get("message_log_queue_size", 20000))
+        self.backfill_chunk_size = self.bot.CFG.get(
+            "message_log_backfill_chunk_size", 1000
+        )
+        if self.scheduler is not None:
+            self.scheduler.limiter.rate = self.bot.CFG.get(
+                "message_log_backfill_rps", 20.0
+            )
 
-    def setup_db(self):
-        self.db_connection = sqlite3.connect(self.db_path)
-        self.db_cursor = self.db_connection.cursor()
+    def apply_config(self, changed: Set[str]) -> bool:
+        """
+        Applies changed settings in place. Returns False if the cog has to be reloaded for them.
+        Reloading would restart the backfill, so everything but turning logging on or off is
+        applied to the running writer and backfill.
+        """
+        if self.disabled or not changed <= LIVE_SETTINGS:
+            return False
+        self.load_settings()
+        return True
+
+    def cog_unload(self):
+        if self.disabled:
+            return
+        self.bot.client._connection.parsers[
+            "MESSAGE_CREATE"
+        ] = self.original_message_parser
+        self.backfill_task.cancel()
+        if self.message_buffer:
+            # The interrupted backfill resumes from the old checkpoints on the next start
+            self.writer.put_blocking("buffered_message", self.message_buffer)
+            self.message_buffer = []
+        self.writer.close()
 
-        db_table_structure = [
-            "CREATE TABLE messages(message_id INTEGER PRIMARY KEY DESC, utc_time REAL, channel_id INTEGER, "
-            "author_id INTEGER, message_content TEXT, extra_data TEXT)",
-        ]
-        new_db = True
-        try:
-            for query in db_table_structure:
-                self.db_cursor.execute(query)
-        except Exception:  # nosec
-            new_db = False  # TODO: figure out db-exists exception
+    async def setup_db(self):
+        """
+        Migrates the database in a worker thread (large upgrades rewrite whole tables), then
+        starts the writer and the backfill. Live messages are buffered until the backfill is done.
+        """
+        new_db = await to_thread(self.migrate_db)
+        self.writer.start()
 
         if new_db:
-            create_task(self.scrape_server_messages())
+            await self.scrape_server_messages()
         else:
-            create_task(self.find_channel_checkpoints())
+            await self.find_channel_checkpoints()
+
+    def migrate_db(self) -> bool:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        db_connection = self.writer.connect()
+        try:
+            return migrate(db_connection)
+        finally:
+            db_connection.close()
 
     async def find_channel_checkpoints(self):
         do_log("Identifying what channels to scrape/when to scrape from")
         time_maps = {}
-        existing_channels = [
-            item[0]
-            for item in self.db_cursor.execute(
-                "SELECT DISTINCT channel_id FROM MESSAGES"
-            ).fetchall()
-        ]
-        for channel_id in existing_channels:
+        checkpoints = await self.writer.fetchall(
+            "SELECT channel_id, last_message_id FROM channel_checkpoints"
+        )
+        for channel_id, last_message_id in checkpoints:
             channel_object = self.bot.guild.get_channel_or_thread(channel_id)
             if channel_object is None:
                 continue  # Channel no longer accessible
-
-            try:
-                newest_msg = self.db_cursor.execute(
-                    "SELECT * FROM messages WHERE channel_id=:id ORDER BY utc_time DESC LIMIT 1",
-                    {"id": channel_id},
-                ).fetchone()
-                epoch_time = newest_msg[1]
-                newest_time = datetime.fromtimestamp(epoch_time)
-
-            except Exception:  # nosec
-                continue
-
-            time_maps[channel_id] = {"time": newest_time, "obj": channel_object}
+            time_maps[channel_id] = {"after": last_message_id, "obj": channel_object}
 
         all_channels = self.bot.guild.threads + self.bot.guild.text_channels
         for channel in all_channels:
             if channel.id not in time_maps:
-                time_maps[channel.id] = {"time": None, "obj": channel}
+                time_maps[channel.id] = {"after": None, "obj": channel}
 
         await self.scrape_server_messages(time_maps)
 
-    async def scrape_server_messages(self, time_maps: Dict[str, Any] | None = None):
+    async def scrape_server_messages(self, time_maps: Dict[int, Any] | None = None):
         if time_maps is None:
             do_log("No message log database found, scraping full server")
             channels = self.bot.guild.threads + self.bot.guild.text_channels
         else:
             do_log(f"Updating logs for {len(time_maps)} channels")
             channels = [channel["obj"] for channel in time_maps.values()]
+        jobs: List[BackfillJob] = []
         for channel in channels:
             if (
                 time_maps is not None
-                and time_maps.get(channel.id, {}).get("time") is not None
+                and time_maps.get(channel.id, {}).get("after") is not None
             ):
-                after_datetime = time_maps[channel.id]["time"]
+                after_id = time_maps[channel.id]["after"]
+                after_datetime = snowflake_time(after_id).replace(tzinfo=None)
                 do_log(
                     f"Scraping messages in #{channel.name} after {get_est_time(after_datetime)}"
                 )
+                jobs.append(BackfillJob(channel, after_id))
             else:
                 do_log(f"Scraping all messages in #{channel.name}")
-                after_datetime = None
+                jobs.append(BackfillJob(channel))
 
-            message_rows: List[MessageColumnsType] = []
-            try:
-                async for message in channel.history(limit=None, after=after_datetime):
-                    row = await self.message_to_db_columns(message)
-                    message_rows.append(row)
-                    if len(message_rows) % 100 != 0:
-                        continue
-                    do_log(
-                        f"Scraping #{channel.name} ({len(message_rows)} messages processed)"
-                    )
-            except Exception as e:  # nosec
-                do_log(f"Exception when processing #{channel.name} ({e})")
-            if not message_rows:
-                continue
-            do_log(
-                f"Committing {len(message_rows)} messages from #{channel.name} to database"
-            )
-            await self.insert_many_to_db(message_rows)
-            do_log(
-                f"Committed {len(message_rows)} messages from #{channel.name} to database"
+        self.scheduler = BackfillScheduler(
+            self.bot.client,
+            concurrency=self.bot.CFG.get("message_log_backfill_concurrency", 4),
+            requests_per_second=self.bot.CFG.get("message_log_backfill_rps", 20.0),
+        )
+        await self.writer.call(
+            partial(
+                pause_rollups,
+                channels=[(job.channel.id, job.after or 0) for job in jobs],
             )
+        )
+        await self.scheduler.run(jobs, self.scrape_channel)
+        rebuilt_channels = await self.writer.call(rebuild_pending_rollups)
+        do_log(f"Rebuilt activity rollups for {rebuilt_channels} channels")
         do_log("Message scraping complete")
         self.loading = False
 
         if self.message_buffer:
             do_log(f"Committing {len(self.message_buffer)} unprocessed messages")
             await self.insert_many_to_db(self.message_buffer)
+            await self.writer.flush()
             do_log(f"Committed {len(self.message_buffer)} unprocessed messages")
             self.message_buffer = []
 
         do_log("Message logging ready")
 
-    @commands.Cog.listener()
-    async def on_message(self, message: nextcord.Message):
-        if self.disabled:
+    async def scrape_channel(self, job: BackfillJob):
+        """
+        Streams a channel's history to the database in chunks. The writer advances the channel's
+        checkpoint with every chunk, so an interrupted scrape resumes after the last stored chunk.
+        """
+        assert self.scheduler is not None  # nosec
+        message_records: List[MessageRecordType] = []
+        try:
+            async for page in self.scheduler.history(job):
+                message_records += [payload_to_record(data) for data in page]
+                if len(message_records) >= self.backfill_chunk_size:
+                    await self.insert_many_to_db(message_records)
+                    message_records = []
+        finally:
+            # Skipped when cancelled by an unload; the checkpoint still points before them
+            if not self.writer.closed:
+                await self.insert_many_to_db(message_records)
+
+    @commands.command(name="search")
+    async def search(self, ctx: commands.Context, *, query: str = ""):
+        """
+        Full-text search of the message log, e.g.
+        /search some words from:@user in:#channel after:2022-01-01 before:2022-02-01 page:2
+        """
+        if self.disabled or not is_staff(self.bot, ctx.author):
             return
 
-        message_entry = await self.message_to_db_columns(message)
+        filters: Dict[str, str] = {}
+        words = []
+        for word in query.split():
+            key, _, value = word.partition(":")
+            if key in ("from", "in", "after", "before", "page") and value:
+                filters[key] = value
+            else:
+                words.append(word)
+        # Words made only of '*' leave nothing to match, and FTS5 rejects an empty MATCH
+        if not fts_query(" ".join(words)):
+            await ctx.send(
+                "Usage: `/search <words> [from:@user] [in:#channel] "
+                "[after:YYYY-MM-DD] [before:YYYY-MM-DD] [page:N]`"
+            )
+            return
 
-        if self.loading:
-            self.message_buffer.append(message_entry)
+        try:
+            page = max(1, int(filters.get("page", 1)))
+            author_id = parse_snowflake(filters.get("from"))
+            channel_id = parse_snowflake(filters.get("in"))
+            after_id = parse_date_snowflake(filters.get("after"))
+            before_id = parse_date_snowflake(filters.get("before"))
+        except ValueError as e:
+            await ctx.send(f"Invalid search filter ({e})")
             return
 
-        await self.insert_to_db(message_entry)
+        page_size = 10
+        sql, params = build_search_query(
+            " ".join(words),
+            author_id=author_id,
+            channel_id=channel_id,
+            after_id=after_id,
+            before_id=before_id,
+            limit=page_size + 1,
+            offset=(page - 1) * page_size,
+        )
+        results = await self.writer.fetchall(sql, params)
+        if not results:
+            await ctx.send("No matching messages found")
+            return
 
-    async def insert_to_db(self, message_row: MessageColumnsType):
-        self.db_cursor.execute(
-            "INSERT OR IGNORE INTO messages VALUES(?,?,?,?,?,?);", message_row
+        lines = []
+        for (
+            message_id,
+            result_channel_id,
+            result_author_id,
+            utc_time,
+            snippet,
+        ) in results[:page_size]:
+            timestamp = get_est_time(datetime.utcfromtimestamp(utc_time))
+            link = f"https://discord.com/channels/{self.bot.guild.id}/{result_channel_id}/{message_id}"
+            lines.append(
+                f"`{timestamp}` <#{result_channel_id}> <@{result_author_id}>: "
+                f"{snippet.replace(chr(10), ' ')[:200]} ({link})"
+            )
+        footer = f"Page {page}"
+        if len(results) > page_size:
+            footer += f" (add `page:{page + 1}` for more)"
+        lines.append(footer)
+        await send_lines(ctx, lines)
+
+    @commands.group(name="stats", invoke_without_command=True)
+    async def stats(self, ctx: commands.Context, days: int = 7):
+        """
+        Messages per channel over the last 'days' days (UTC), from the activity rollups.
+        """
+        if self.disabled or not is_staff(self.bot, ctx.author):
+            return
+        rows = await self.writer.fetchall(
+            "SELECT channel_id, SUM(messages) AS total FROM activity_daily WHERE day > ? "
+            "GROUP BY channel_id ORDER BY total DESC LIMIT 15",
+            (int(time() // 86400) - days,),
         )
-        self.db_connection.commit()
-
-    async def insert_many_to_db(self, message_row_list: List[MessageColumnsType]):
-        query = "INSERT OR IGNORE INTO messages VALUES(?,?,?,?,?,?);"
-        self.db_cursor.executemany(query, message_row_list)
-        self.db_connection.commit()
-
-    async def message_to_db_columns(
-        self, message: nextcord.Message
-    ) -> MessageColumnsType:
-        extra_data: Dict[str, Any] = {}
-
-        # Prioritizing edge case handling over readability
-        if message.reference is not None and message.reference.message_id is not None:
-            extra_data["replying_to"] = message.reference.message_id
-
-        attachments = []
-        for attachment in message.attachments:
-            attachment_obj: Dict[str, Any] = {
-                "content_type": None,
-                "filename": None,
-                "url": None,
-            }
-            try:
-                attachment_obj["content_type"] = attachment.content_type
-            except Exception:  # nosec
-                pass
-            try:
-                attachment_obj["filename"] = attachment.filename
-            except Exception:  # nosec
-                pass
+        lines = [f"**Messages per channel, last {days} days**"]
+        lines += [f"<#{channel_id}>: {total}" for channel_id, total in rows]
+        await send_lines(ctx, lines)
+
+    @stats.command(name="top")
+    async def stats_top(
+        self,
+        ctx: commands.Context,
+        days: int = 30,
+        channel: Optional[nextcord.TextChannel] = None,
+    ):
+        """
+        Top posters over the last 'days' days (UTC), optionally in a single channel.
+        """
+        if self.disabled or not is_staff(self.bot, ctx.author):
+            return
+        query = (
+            "SELECT author_id, SUM(messages) AS total FROM activity_daily WHERE day > ?"
+        )
+        params: List[Any] = [int(time() // 86400) - days]
+        if channel is not None:
+            query += " AND channel_id = ?"
+            params.append(channel.id)
+        rows = await self.writer.fetchall(
+            query + " GROUP BY author_id ORDER BY total DESC LIMIT 15", params
+        )
+        where = f" in <#{channel.id}>" if channel is not None else ""
+        lines = [f"**Top posters{where}, last {days} days**"]
+        lines += [
+            f"{place}. <@{author_id}>: {total}"
+            for place, (author_id, total) in enumerate(rows, start=1)
+        ]
+        await send_lines(ctx, lines)
+
+    @stats.command(name="daily")
+    async def stats_daily(
+        self,
+        ctx: commands.Context,
+        channel: Optional[nextcord.TextChannel] = None,
+        days: int = 14,
+    ):
+        """
+        Messages per day (UTC) over the last 'days' days, optionally in a single channel.
+        """
+        if self.disabled or not is_staff(self.bot, ctx.author):
+            return
+        query = "SELECT day, SUM(messages) FROM activity_daily WHERE day > ?"
+        params: List[Any] = [int(time() // 86400) - days]
+        if channel is not None:
+            query += " AND channel_id = ?"
+            params.append(channel.id)
+        rows = await self.writer.fetchall(query + " GROUP BY day ORDER BY day", params)
+        where = f" in <#{channel.id}>" if channel is not None else ""
+        lines = [f"**Messages per day{where}, last {days} days**"]
+        lines += [
+            f"`{datetime.utcfromtimestamp(day * 86400):%Y-%m-%d}`: {total}"
+            for day, total in rows
+        ]
+        await send_lines(ctx, lines)
+
+    def install_message_parser(self):
+        """
+        Wraps nextcord's MESSAGE_CREATE parser so messages are logged straight from the gateway
+        payload, before (and independently of) nextcord building a Message object for listeners.
+        Logging errors are caught here: anything raised would end up in the gateway's event
+        handling and take the connection down with it.
+        """
+        parsers = self.bot.client._connection.parsers
+        self.original_message_parser = parsers["MESSAGE_CREATE"]
+
+        def parse_message_create(data):
+            start = perf_counter()
+            failed = False
             try:
-                attachment_obj["url"] = attachment.url
-            except Exception:  # nosec
-                pass
+                self.on_raw_message_create(data)
+            except Exception:
+                failed = True
+                log_error(f"[FAILED TO LOG MESSAGE {data.get('id')}]\n{format_exc()}")
+            if self.observe is not None:
+                self.observe(
+                    "parser",
+                    "on_raw_message_create",
+                    perf_counter() - start,
+                    failed,
+                )
+            self.original_message_parser(data)
 
-            attachments.append(attachment_obj)
-        if attachments:
-            extra_data["attachments"] = attachments
+        parsers["MESSAGE_CREATE"] = parse_message_create
 
-        embeds = []
-        for embed in message.embeds:
-            try:
-                embeds.append(embed.to_dict())
-            except Exception:  # nosec
-                pass
-        if embeds:
-            extra_data["embeds"] = embeds
-
-        stickers = []
-        for sticker in message.stickers:
-            sticker_obj: Dict[str, Any] = {
-                "id": None,
-                "name": None,
-                "format": None,
-                "url": None,
-            }
-            try:
-                sticker_obj["id"] = sticker.id
-            except Exception:  # nosec
-                pass
-            try:
-                sticker_obj["name"] = sticker.name
-            except Exception:  # nosec
-                pass
-            try:
-                sticker_obj["format"] = sticker.format
-            except Exception:  # nosec
-                pass
-            try:
-                sticker_obj["url"] = sticker.url
-            except Exception:  # nosec
-                pass
+    def on_raw_message_create(self, data: MessagePayload):
+        if data.get("guild_id") != str(self.bot.guild.id):
+            return
 
-            stickers.append(sticker_obj)
-        if stickers:
-            extra_data["stickers"] = stickers
+        message_entry = payload_to_record(data)
 
-        extra_data_column = (
-            json_dumps(extra_data, separators=(",", ":")) if extra_data else None
+        if self.loading:
+            self.message_buffer.append(message_entry)
+            return
+
+        self.writer.submit("message", message_entry)
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: nextcord.RawMessageUpdateEvent):
+        if self.disabled or payload.guild_id != self.bot.guild.id:
+            return
+        data: Dict[str, Any] = dict(payload.data)
+        extra_data = {
+            key: data[key] for key in ("attachments", "embeds") if data.get(key)
+        }
+        edited_timestamp = parse_time(data.get("edited_timestamp"))
+        if edited_timestamp is not None:
+            revision: RevisionRecordType = (
+                payload.message_id,
+                payload.channel_id,
+                edited_timestamp.timestamp(),
+                "edit",
+                data.get("content"),
+                extra_data or None,
+            )
+        elif extra_data:
+            # Updates without an edit time aren't edits by the author; they're Discord adding link
+            # previews after the fact, kept apart so they don't clutter the edit history
+            revision = (
+                payload.message_id,
+                payload.channel_id,
+                time(),
+                "embed",
+                None,
+                extra_data,
+            )
+        else:
+            return  # Pins, flags and the like
+        await self.writer.put("revision", revision)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: nextcord.RawMessageDeleteEvent):
+        if self.disabled or payload.guild_id != self.bot.guild.id:
+            return
+        revision: RevisionRecordType = (
+            payload.message_id,
+            payload.channel_id,
+            time(),
+            "delete",
+            None,
+            None,
         )
-        columns = (
-            int(message.id),
-            float(message.created_at.timestamp()),
-            int(message.channel.id),
-            int(message.author.id),
-            str(message.content),
-            extra_data_column,
+        await self.writer.put("revision", revision)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(
+        self, payload: nextcord.RawBulkMessageDeleteEvent
+    ):
+        if self.disabled or payload.guild_id != self.bot.guild.id:
+            return
+        deleted_time = time()
+        await self.writer.put_many(
+            "revision",
+            [
+                (message_id, payload.channel_id, deleted_time, "delete", None, None)
+                for message_id in sorted(payload.message_ids)
+            ],
         )
-        return columns
+
+    async def insert_many_to_db(self, message_record_list: List[MessageRecordType]):
+        await self.writer.put_many("message", message_record_list)
@@ -0,0 +1,182 @@
+from string import Formatter
+from typing import Any, Dict, List, Set, Tuple
+
+from url_rules import UrlRules
+
+NUMBER = (int, float)
+
+# Expected type of every setting the bot reads
+SETTING_TYPES: Dict[str, Tuple[type, ...]] = {
+    "config_watch_interval": NUMBER,
+    "custom_invite_attempts": (int,),
+    "custom_invite_channel": (str,),
+    "custom_invite_debug": (bool,),
+    "custom_invite_format": (str,),
+    "custom_invite_gap_limit": NUMBER,
+    "custom_invite_join_window": NUMBER,
+    "custom_invite_log": (bool,),
+    "custom_invite_messages": (dict,),
+    "custom_invite_reconcile_interval": NUMBER,
+    "custom_invite_snapshot_interval": NUMBER,
+    "discord_bot_owner_id": (int,),
+    "discord_channel_ids": (dict,),
+    "discord_guild_id": (int,),
+    "discord_role_ids": (dict,),
+    "loop_monitor_threshold": NUMBER,
+    "media_rate_cache_failure_ttl": NUMBER,
+    "media_rate_cache_size": (int,),
+    "media_rate_cache_ttl": NUMBER,
+    "media_rate_channels": (list,),
+    "media_rate_downvote": (str,),
+    "media_rate_probe_connections": (int,),
+    "media_rate_probe_connections_per_host": (int,),
+    "media_rate_probe_deadline": NUMBER,
+    "media_rate_probe_max_bytes": (int,),
+    "media_rate_probe_timeout": NUMBER,
+    "media_rate_reaction_interval": NUMBER,
+    "media_rate_repost_check": (bool,),
+    "media_rate_repost_distance": (int,),
+    "media_rate_repost_emoji": (str,),
+    "media_rate_repost_workers": (int,),
+    "media_rate_upvote": (str,),
+    "media_rate_url_rules": (list,),
+    "message_log": (bool,),
+    "message_log_backfill_chunk_size": (int,),
+    "message_log_backfill_concurrency": (int,),
+    "message_log_backfill_rps": NUMBER,
+    "message_log_batch_size": (int,),
+    "message_log_compress": (bool,),
+    "message_log_flush_interval": NUMBER,
+    "message_log_queue_size": (int,),
+    "metrics_host": (str,),
+    "metrics_port": (int,),
+    "watchdog": (dict,),
+}
+REQUIRED_SETTINGS = (
+    "discord_bot_owner_id",
+    "discord_channel_ids",
+    "discord_guild_id",
+    "discord_role_ids",
+)
+# Read once when connecting or starting the metrics server; changing them needs a restart
+RESTART_SETTINGS = ("discord_guild_id", "metrics_host", "metrics_port")
+
+
+class ConfigError(ValueError):
+    def __init__(self, problems: List[str]):
+        super().__init__("Invalid config:\n" + "\n".join(problems))
+        self.problems = problems
+
+
+TYPE_NAMES = {
+    bool: "true or false",
+    dict: "an object",
+    int: "a whole number",
+    list: "a list",
+    str: "a string",
+}
+
+
+def type_name(types: Tuple[type, ...]) -> str:
+    return "a number" if types == NUMBER else TYPE_NAMES[types[0]]
+
+
+def json_type_name(value: Any) -> str:
+    for value_type in (bool, int, float, str, list, dict):
+        if isinstance(value, value_type):
+            return "a number" if value_type is float else TYPE_NAMES[value_type]
+    return "null"
+
+
+def validate_config(settings: Dict[Any, Any]) -> Tuple[List[str], List[str]]:
+    """
+    Checks every known setting's type, the invite message format and the URL rules. Returns the
+    problems that make the config unusable, and warnings that don't: unknown settings (likely
+    typos) and channel names missing from 'discord_channel_ids', which disable the feature using
+    them as before.
+    """
+    problems: List[str] = []
+    warnings: List[str] = []
+    for key in REQUIRED_SETTINGS:
+        if key not in settings:
+            problems.append(f"'{key}' is missing")
+    for key, value in settings.items():
+        types = SETTING_TYPES.get(key)
+        if types is None:
+            warnings.append(f"'{key}' is not a known setting")
+            continue
+        # bool is an int subclass, but true/false is never meant as a number
+        if not isinstance(value, types) or (
+            isinstance(value, bool) and bool not in types
+        ):
+            problems.append(
+                f"'{key}' should be {type_name(types)}, not {json_type_name(value)}"
+            )
+        elif isinstance(value, NUMBER) and value < 0:
+            problems.append(f"'{key}' can't be negative")
+    if problems:
+        return problems, warnings
+
+    for key in ("discord_channel_ids", "discord_role_ids"):
+        for name, object_id in settings[key].items():
+            if not isinstance(object_id, int) or isinstance(object_id, bool):
+                problems.append(f"'{key}': '{name}' should be an ID")
+
+    channel_names = set(settings["discord_channel_ids"])
+    for name in settings.get("media_rate_channels", []):
+        if name not in channel_names:
+            warnings.append(
+                f"'media_rate_channels': '{name}' is not in 'discord_channel_ids'"
+            )
+    invite_channel = settings.get("custom_invite_channel")
+    if invite_channel is not None and invite_channel not in channel_names:
+        warnings.append(
+            f"'custom_invite_channel': '{invite_channel}' is not in 'discord_channel_ids'"
+        )
+
+    for code, message in settings.get("custom_invite_messages", {}).items():
+        if not isinstance(message, str):
+            problems.append(f"'custom_invite_messages': '{code}' should be a string")
+    invite_format = settings.get("custom_invite_format")
+    if invite_format is not None:
+        try:
+            fields = {
+                field for _, field, _, _ in Formatter().parse(invite_format) if field
+            }
+        except ValueError as e:
+            problems.append(f"'custom_invite_format': {e}")
+        else:
+            unknown = fields - {"member_name", "invite_name"}
+            if unknown:
+                problems.append(
+                    f"'custom_invite_format': unknown fields {', '.join(sorted(unknown))}"
+                    " (only member_name and invite_name are filled in)"
+                )
+
+    try:
+        UrlRules(settings.get("media_rate_url_rules", []))
+    except (TypeError, ValueError) as e:
+        problems.append(f"'media_rate_url_rules': {e}")
+    return problems, warnings
+
+
+def changed_settings(old: Dict[Any, Any], new: Dict[Any, Any]) -> Set[str]:
+    return {key for key in old.keys() | new.keys() if old.get(key) != new.get(key)}
+
+
+def resolve_guild_objects(
+    guild: Any, settings: Dict[Any, Any]
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Looks up the channels and roles the config names, by name. Ones that no longer exist map to
+    None.
+    """
+    channels = {
+        name: guild.get_channel(channel_id)
+        for name, channel_id in settings["discord_channel_ids"].items()
+    }
+    roles = {
+        name: guild.get_role(role_id)
+        for name, role_id in settings["discord_role_ids"].items()
+    }
+    return channels, roles
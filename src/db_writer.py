@@ -0,0 +1,376 @@
+import sqlite3
+import threading
+from asyncio import (
+    AbstractEventLoop,
+    Event,
+    Future,
+    Task,
+    create_task,
+    get_running_loop,
+    to_thread,
+)
+from collections import deque
+from pathlib import Path
+from queue import Empty, Full, Queue
+from time import monotonic
+from traceback import format_exc
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from utils import do_log, log_error
+
+WriteHandler = Callable[[sqlite3.Cursor, List[Any]], None]
+WriterCall = Callable[[sqlite3.Cursor], Any]
+
+_CALL = "__call__"
+_STOP = "__stop__"
+
+
+class BatchedWriter:
+    """
+    Owns a SQLite connection on a dedicated thread and applies queued items in group commits.
+
+    Items are queued as (kind, item) pairs; every kind maps to a handler that receives all items of
+    that kind from one batch. A batch is committed once it reaches 'batch_size' items or once its
+    oldest item is 'flush_interval' seconds old, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        handlers: Dict[str, WriteHandler],
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_queue: int = 20000,
+        name: str = "db-writer",
+    ):
+        self.db_path = db_path
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.name = name
+        self.queue: Queue[Tuple[str, Any]] = Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.closed = False
+
+        self.committed_items = 0
+        self.commits = 0
+        self.backpressure_waits = 0
+        self.dropped_items = 0
+
+        # Puts waiting for room wait on the event loop, not in executor threads: the writer thread
+        # sets '_space' through '_space_loop' when it takes an item while '_space_wanted' is set
+        self._space: Optional[Event] = None
+        self._space_loop: Optional[AbstractEventLoop] = None
+        self._space_wanted = False
+        # Items submitted while the queue was full, in order, and the one task feeding them in
+        self._overflow: Deque[Tuple[str, Any]] = deque()
+        self._overflow_task: Optional[Task] = None
+        self._reader: Optional[sqlite3.Connection] = None
+        self._reader_lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def start(self):
+        self.thread.start()
+
+    async def put(self, kind: str, item: Any):
+        """
+        Queues a single item, waiting (without blocking the event loop) if the queue is full.
+        """
+        if self.closed:
+            self._report_dropped(kind, 1)
+            return
+        try:
+            self.queue.put_nowait((kind, item))
+        except Full:
+            self.backpressure_waits += 1
+            if self.backpressure_waits % 1000 == 1:
+                do_log(
+                    f"[{self.name}] Write queue full ({self.queue.maxsize} items), "
+                    f"waiting for writer ({self.backpressure_waits} waits so far)"
+                )
+            while True:
+                await self._wait_for_space()
+                if self.closed:  # Closed while waiting; nothing will write it anymore
+                    self._report_dropped(kind, 1)
+                    return
+                try:
+                    self.queue.put_nowait((kind, item))
+                    return
+                except Full:
+                    pass  # Another producer took the room first
+
+    def submit(self, kind: str, item: Any):
+        """
+        Queues a single item from synchronous code. If the queue is full, the item is kept in an
+        overflow list that one task feeds into the queue as it empties, so it is delayed rather
+        than dropped.
+        """
+        if self.closed:
+            self._report_dropped(kind, 1)
+            return
+        if not self._overflow:
+            try:
+                self.queue.put_nowait((kind, item))
+                return
+            except Full:
+                self.backpressure_waits += 1
+        # Behind any earlier overflow, to keep the order items were submitted in
+        self._overflow.append((kind, item))
+        if self._overflow_task is None or self._overflow_task.done():
+            self._overflow_task = create_task(self._feed_overflow())
+
+    async def _feed_overflow(self):
+        # Whatever is left once the writer is closed, close() writes itself
+        while self._overflow and not self.closed:
+            try:
+                self.queue.put_nowait(self._overflow[0])
+            except Full:
+                await self._wait_for_space()
+                continue
+            self._overflow.popleft()
+
+    async def _wait_for_space(self):
+        """
+        Waits until the writer thread takes an item from a full queue, or the writer is closed.
+        """
+        if self._space is None:
+            self._space = Event()
+        self._space_loop = get_running_loop()
+        self._space.clear()
+        # Wanted before checking again, so room made in between is either seen here or signalled
+        self._space_wanted = True
+        if self.closed or not self.queue.full():
+            return
+        await self._space.wait()
+
+    async def put_many(self, kind: str, items: Iterable[Any]):
+        for item in items:
+            await self.put(kind, item)
+
+    def depth(self) -> int:
+        """
+        Items waiting for the writer, including submitted ones still waiting for room.
+        """
+        return self.queue.qsize() + len(self._overflow)
+
+    def resize_queue(self, max_queue: int):
+        """
+        Changes how many items can wait for the writer. Puts waiting on a full queue see any new
+        room right away.
+        """
+        with self.queue.mutex:
+            self.queue.maxsize = max_queue
+            self.queue.not_full.notify_all()
+        self._signal_space()
+
+    def put_blocking(self, kind: str, items: Iterable[Any]):
+        """
+        Queues items from synchronous code, blocking the calling thread while the queue is full.
+        Meant for shutdown, to hand over the last items right before close().
+        """
+        if self.closed:
+            self._report_dropped(kind, len(list(items)))
+            return
+        for item in items:
+            self.queue.put((kind, item))
+
+    async def call(self, function: WriterCall) -> Any:
+        """
+        Runs 'function' on the writer thread after everything queued before it has been committed,
+        and returns its result once its own changes have been committed too.
+        """
+        if self.closed:
+            raise RuntimeError(f"{self.name} is closed")
+        loop = get_running_loop()
+        future: Future = loop.create_future()
+        if self._overflow:
+            # After the items submitted before it, which are still waiting for room
+            self._overflow.append((_CALL, (function, loop, future)))
+        else:
+            await self.put(_CALL, (function, loop, future))
+        return await future
+
+    async def flush(self):
+        await self.call(lambda cursor: None)
+
+    async def fetchall(self, query: str, params: Any = ()) -> List[Any]:
+        """
+        Runs a read query on a separate connection in a worker thread; WAL mode lets it proceed
+        while the writer is committing.
+        """
+        return await to_thread(self._fetchall, query, params)
+
+    def _fetchall(self, query: str, params: Any) -> List[Any]:
+        with self._reader_lock:
+            if self._reader is None:
+                self._reader = self.connect()
+            return self._reader.execute(query, params).fetchall()
+
+    def close(self):
+        """
+        Commits everything still queued and stops the writer thread. Blocks until done. Items
+        queued afterwards are dropped with an error logged, and calls raise RuntimeError.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.thread.is_alive():
+            # Submitted items still waiting for room are written too
+            while self._overflow:
+                self.queue.put(self._overflow.popleft())
+            self.queue.put((_STOP, None))
+            self.thread.join()
+        self._drain_closed()
+        # Wakes waiting puts, which report their items as dropped
+        self._signal_space()
+        with self._reader_lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+        do_log(
+            f"[{self.name}] Closed after {self.commits} commits ({self.committed_items} items)"
+        )
+
+    def _run(self):
+        connection = self.connect()
+        cursor = connection.cursor()
+        pending: List[Tuple[str, Any]] = []
+        deadline = 0.0
+        stopping = False
+        while True:
+            if stopping:
+                # Items that raced in just before the stop are still committed
+                try:
+                    kind, item = self.queue.get_nowait()
+                except Empty:
+                    break
+            else:
+                timeout = max(0.0, deadline - monotonic()) if pending else None
+                try:
+                    kind, item = self.queue.get(timeout=timeout)
+                except Empty:
+                    kind, item = "", None
+                if self._space_wanted:
+                    self._signal_space()
+
+            if kind == _STOP:
+                stopping = True
+            elif kind == _CALL:
+                self._commit(connection, cursor, pending)
+                pending = []
+                self._run_call(connection, cursor, *item)
+            elif kind:
+                if not pending:
+                    deadline = monotonic() + self.flush_interval
+                pending.append((kind, item))
+
+            if pending and (len(pending) >= self.batch_size or monotonic() >= deadline):
+                self._commit(connection, cursor, pending)
+                pending = []
+        self._commit(connection, cursor, pending)
+        connection.close()
+
+    def _signal_space(self):
+        """
+        Wakes puts waiting for room in the queue. Safe to call from any thread.
+        """
+        self._space_wanted = False
+        if self._space is None or self._space_loop is None:
+            return
+        try:
+            self._space_loop.call_soon_threadsafe(self._space.set)
+        except RuntimeError:  # nosec
+            pass  # Event loop already closed during shutdown
+
+    def _report_dropped(self, kind: str, count: int):
+        self.dropped_items += count
+        log_error(
+            f"[{self.name}] Dropped {count} '{kind}' items queued after the writer was closed"
+        )
+
+    def _drain_closed(self):
+        """
+        Empties the queue once the writer thread has stopped, reporting anything left in it and
+        failing any waiting calls, so nothing queued late is lost silently and no put stays
+        blocked on a full queue.
+        """
+        dropped: Dict[str, int] = {}
+        while True:
+            try:
+                kind, item = self.queue.get_nowait()
+            except Empty:
+                break
+            if kind == _CALL:
+                _, loop, future = item
+                try:
+                    loop.call_soon_threadsafe(
+                        _resolve_future,
+                        future,
+                        None,
+                        RuntimeError(f"{self.name} is closed"),
+                    )
+                except RuntimeError:  # nosec
+                    pass  # Event loop already closed during shutdown
+            elif kind != _STOP:
+                dropped[kind] = dropped.get(kind, 0) + 1
+        for kind, count in dropped.items():
+            self._report_dropped(kind, count)
+
+    def _commit(
+        self,
+        connection: sqlite3.Connection,
+        cursor: sqlite3.Cursor,
+        pending: List[Tuple[str, Any]],
+    ):
+        if not pending:
+            return
+        grouped: Dict[str, List[Any]] = {}
+        for kind, item in pending:
+            grouped.setdefault(kind, []).append(item)
+        try:
+            for kind, items in grouped.items():
+                self.handlers[kind](cursor, items)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            log_error(
+                f"[{self.name}] FAILED TO COMMIT {len(pending)} ITEMS "
+                f"({', '.join(f'{len(v)} {k}' for k, v in grouped.items())})\n{format_exc()}"
+            )
+            return
+        self.commits += 1
+        self.committed_items += len(pending)
+
+    def _run_call(
+        self,
+        connection: sqlite3.Connection,
+        cursor: sqlite3.Cursor,
+        function: WriterCall,
+        loop: AbstractEventLoop,
+        future: Future,
+    ):
+        result, error = None, None
+        try:
+            result = function(cursor)
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            error = e
+        try:
+            loop.call_soon_threadsafe(_resolve_future, future, result, error)
+        except RuntimeError:  # nosec
+            pass  # Event loop already closed during shutdown
+
+
+def _resolve_future(future: Future, result: Any, error: Optional[BaseException]):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
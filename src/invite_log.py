@@ -0,0 +1,190 @@
+import sqlite3
+from pathlib import Path
+from time import time
+from typing import Any, List, Optional, Tuple
+
+from db_writer import BatchedWriter
+from utils import do_log
+
+# (member_id, utc_time, invite_code, inviter_id, confidence); the code is None for joins that
+# couldn't be attributed
+JoinRecordType = Tuple[int, float, Optional[str], Optional[int], float]
+# (member_id, utc_time)
+LeaveRecordType = Tuple[int, float]
+
+INSERT_JOIN_QUERY = (
+    "INSERT INTO invite_joins(member_id, utc_time, invite_code, inviter_id, confidence) "
+    "VALUES(?,?,?,?,?);"
+)
+# Only the member's latest join, so a rejoin doesn't mark their earlier join as left twice
+UPDATE_LEAVE_QUERY = (
+    "UPDATE invite_joins SET left_time = ? WHERE join_id = "
+    "(SELECT MAX(join_id) FROM invite_joins WHERE member_id = ?) AND left_time IS NULL;"
+)
+
+# Same versioning scheme as the message log (PRAGMA user_version, one entry per version)
+MIGRATIONS: List[List[str]] = [
+    [
+        "CREATE TABLE IF NOT EXISTS invite_joins(join_id INTEGER PRIMARY KEY, "
+        "member_id INTEGER NOT NULL, utc_time REAL NOT NULL, invite_code TEXT, "
+        "inviter_id INTEGER, confidence REAL NOT NULL, left_time REAL)",
+        "CREATE INDEX IF NOT EXISTS invite_joins_member ON invite_joins(member_id)",
+        "CREATE INDEX IF NOT EXISTS invite_joins_inviter "
+        "ON invite_joins(inviter_id, utc_time)",
+        "CREATE INDEX IF NOT EXISTS invite_joins_code ON invite_joins(invite_code, utc_time)",
+        # Joins and later leaves per invite, bucketed by the UTC day of the join, so leaderboards
+        # and retention read a few rows per invite and day instead of every join
+        "CREATE TABLE IF NOT EXISTS invite_daily(day INTEGER, invite_code TEXT, "
+        "inviter_id INTEGER, joins INTEGER, leaves INTEGER, PRIMARY KEY(day, invite_code)) "
+        "WITHOUT ROWID",
+        "CREATE TRIGGER IF NOT EXISTS invite_daily_join AFTER INSERT ON invite_joins "
+        "WHEN new.invite_code IS NOT NULL BEGIN "
+        "INSERT INTO invite_daily VALUES(CAST(new.utc_time / 86400 AS INTEGER), "
+        "new.invite_code, new.inviter_id, 1, 0) ON CONFLICT(day, invite_code) "
+        "DO UPDATE SET joins = joins + 1; END",
+        "CREATE TRIGGER IF NOT EXISTS invite_daily_leave AFTER UPDATE OF left_time "
+        "ON invite_joins WHEN old.left_time IS NULL AND new.left_time IS NOT NULL "
+        "AND new.invite_code IS NOT NULL BEGIN "
+        "UPDATE invite_daily SET leaves = leaves + 1 "
+        "WHERE day = CAST(new.utc_time / 86400 AS INTEGER) "
+        "AND invite_code = new.invite_code; END",
+        # The same counts over all time, one row per invite
+        "CREATE TABLE IF NOT EXISTS invite_totals(invite_code TEXT PRIMARY KEY, "
+        "inviter_id INTEGER, joins INTEGER, leaves INTEGER) WITHOUT ROWID",
+        "CREATE TRIGGER IF NOT EXISTS invite_totals_join AFTER INSERT ON invite_joins "
+        "WHEN new.invite_code IS NOT NULL BEGIN "
+        "INSERT INTO invite_totals VALUES(new.invite_code, new.inviter_id, 1, 0) "
+        "ON CONFLICT(invite_code) DO UPDATE SET joins = joins + 1; END",
+        "CREATE TRIGGER IF NOT EXISTS invite_totals_leave AFTER UPDATE OF left_time "
+        "ON invite_joins WHEN old.left_time IS NULL AND new.left_time IS NOT NULL "
+        "AND new.invite_code IS NOT NULL BEGIN "
+        "UPDATE invite_totals SET leaves = leaves + 1 "
+        "WHERE invite_code = new.invite_code; END",
+    ],
+]
+
+
+def migrate(connection: sqlite3.Connection):
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    for target_version in range(version + 1, len(MIGRATIONS) + 1):
+        do_log(f"Migrating invite log database to version {target_version}")
+        with connection:
+            for query in MIGRATIONS[target_version - 1]:
+                connection.execute(query)
+            connection.execute(f"PRAGMA user_version={target_version}")
+
+
+def insert_join_records(cursor: sqlite3.Cursor, records: List[JoinRecordType]):
+    cursor.executemany(INSERT_JOIN_QUERY, records)
+
+
+def insert_leave_records(cursor: sqlite3.Cursor, records: List[LeaveRecordType]):
+    # Parameters are (left_time, member_id)
+    cursor.executemany(
+        UPDATE_LEAVE_QUERY, [(utc_time, member_id) for member_id, utc_time in records]
+    )
+
+
+def counts_source(days: Optional[int]) -> Tuple[str, Tuple[int, ...]]:
+    """
+    Table (or subquery) with (invite_code, inviter_id, joins, leaves) rows for the last 'days'
+    UTC days, or all time if 'days' is None, and its parameters.
+    """
+    if days is None:
+        return "invite_totals", ()
+    return (
+        "(SELECT invite_code, inviter_id, joins, leaves FROM invite_daily WHERE day >= ?)",
+        (int(time() // 86400) - days + 1,),
+    )
+
+
+class InviteLog:
+    """
+    Every join attribution (who joined, through which invite, whose it was, and how sure the
+    match is), plus when members left, in a SQLite database written in batches. Per-invite daily
+    and all-time rollups keep the leaderboard and retention queries fast however many joins are
+    stored.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.writer = BatchedWriter(
+            db_path,
+            {"join": insert_join_records, "leave": insert_leave_records},
+            name="invite-log-writer",
+        )
+
+    def start(self):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        connection = self.writer.connect()
+        migrate(connection)
+        connection.close()
+        self.writer.start()
+
+    def record_join(
+        self,
+        member_id: int,
+        utc_time: float,
+        invite_code: Optional[str],
+        inviter_id: Optional[int],
+        confidence: float,
+    ):
+        self.writer.submit(
+            "join", (member_id, utc_time, invite_code, inviter_id, confidence)
+        )
+
+    def record_leave(self, member_id: int, utc_time: float):
+        self.writer.submit("leave", (member_id, utc_time))
+
+    async def top_inviters(self, days: Optional[int] = None, limit: int = 15):
+        """
+        (inviter_id, joins, still in the guild) per inviter, most joins first.
+        """
+        source, params = counts_source(days)
+        return await self.writer.fetchall(
+            f"SELECT inviter_id, SUM(joins) AS total, SUM(joins - leaves) FROM {source} "  # nosec
+            "WHERE inviter_id IS NOT NULL GROUP BY inviter_id "
+            "ORDER BY total DESC LIMIT ?",
+            (*params, limit),
+        )
+
+    async def top_invites(self, days: Optional[int] = None, limit: int = 15):
+        """
+        (invite_code, inviter_id, joins, still in the guild) per invite, most joins first.
+        """
+        source, params = counts_source(days)
+        return await self.writer.fetchall(
+            "SELECT invite_code, inviter_id, SUM(joins) AS total, SUM(joins - leaves) "  # nosec
+            f"FROM {source} GROUP BY invite_code ORDER BY total DESC LIMIT ?",
+            (*params, limit),
+        )
+
+    async def retention(
+        self, days: Optional[int] = None, min_joins: int = 5, limit: int = 15
+    ):
+        """
+        (inviter_id, joins, still in the guild) for inviters with at least 'min_joins' joins,
+        best retention first.
+        """
+        source, params = counts_source(days)
+        return await self.writer.fetchall(
+            "SELECT inviter_id, SUM(joins) AS total, SUM(joins - leaves) AS kept "  # nosec
+            f"FROM {source} WHERE inviter_id IS NOT NULL "
+            "GROUP BY inviter_id HAVING total >= ? "
+            "ORDER BY CAST(kept AS REAL) / total DESC, total DESC LIMIT ?",
+            (*params, min_joins, limit),
+        )
+
+    async def member_joins(self, member_id: int, limit: int = 10) -> List[Any]:
+        """
+        (utc_time, invite_code, inviter_id, confidence, left_time) of a member's joins, latest
+        first.
+        """
+        return await self.writer.fetchall(
+            "SELECT utc_time, invite_code, inviter_id, confidence, left_time "
+            "FROM invite_joins WHERE member_id = ? ORDER BY join_id DESC LIMIT ?",
+            (member_id, limit),
+        )
+
+    def close(self):
+        self.writer.close()
@@ -0,0 +1,158 @@
+import os
+from json import dump as json_dump
+from json import load as json_load
+from pathlib import Path
+from time import time
+from typing import Dict, Iterable, Optional
+
+import nextcord
+
+from utils import do_log
+
+
+class InviteRecord:
+    __slots__ = ("code", "uses", "max_uses", "inviter_id", "expires_at")
+
+    def __init__(
+        self,
+        code: str,
+        uses: int,
+        max_uses: int,
+        inviter_id: Optional[int] = None,
+        expires_at: Optional[float] = None,
+    ):
+        self.code = code
+        self.uses = uses
+        self.max_uses = max_uses  # 0 means unlimited
+        self.inviter_id = inviter_id
+        self.expires_at = expires_at  # None means it never expires
+
+    @classmethod
+    def from_invite(cls, invite: nextcord.Invite) -> "InviteRecord":
+        inviter = invite.inviter
+        expires_at = None
+        if invite.expires_at is not None:
+            expires_at = invite.expires_at.timestamp()
+        elif invite.max_age and invite.created_at is not None:
+            expires_at = invite.created_at.timestamp() + invite.max_age
+        return cls(
+            invite.code,
+            invite.uses or 0,
+            invite.max_uses or 0,
+            inviter.id if inviter is not None else None,
+            expires_at,
+        )
+
+    def expired(self, now: float) -> bool:
+        return self.expires_at is not None and self.expires_at <= now
+
+    @property
+    def inviter_mention(self) -> Optional[str]:
+        return f"<@{self.inviter_id}>" if self.inviter_id is not None else None
+
+    def __repr__(self) -> str:
+        return f"{self.code}: {self.uses}/{self.max_uses or '∞'} uses, inviter {self.inviter_id}"
+
+
+def describe_invites(invites: Iterable[nextcord.Invite]) -> str:
+    return "\n".join(repr(InviteRecord.from_invite(invite)) for invite in invites)
+
+
+class InviteState:
+    """
+    Last known use count of every guild invite. Invite create/delete events update it in place;
+    'reconcile' replaces it with a full fetch and reports how much had drifted. The state is saved
+    to a JSON snapshot so a restarted bot can attribute joins before its first fetch.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.records: Dict[str, InviteRecord] = {}
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __repr__(self) -> str:
+        return "\n".join(repr(record) for record in self.records.values())
+
+    def get(self, code: str) -> Optional[InviteRecord]:
+        return self.records.get(code)
+
+    def add(self, record: InviteRecord):
+        self.records[record.code] = record
+        self.dirty = True
+
+    def remove(self, code: str) -> Optional[InviteRecord]:
+        record = self.records.pop(code, None)
+        if record is not None:
+            self.dirty = True
+        return record
+
+    def reconcile(self, invites: Iterable[nextcord.Invite]) -> int:
+        """
+        Brings the state in line with a full list of invites and returns the number of invites
+        that were added, removed or had a different use count.
+        """
+        changes = 0
+        fetched: Dict[str, InviteRecord] = {}
+        for invite in invites:
+            record = InviteRecord.from_invite(invite)
+            known = self.records.get(record.code)
+            if known is None or known.uses != record.uses:
+                changes += 1
+            fetched[record.code] = record
+        changes += sum(1 for code in self.records if code not in fetched)
+        self.records = fetched
+        if changes:
+            self.dirty = True
+        return changes
+
+    def load(self) -> Optional[float]:
+        """
+        Loads the saved snapshot, returning when it was saved (None if there is none).
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as snapshot_file:
+                snapshot = json_load(snapshot_file)
+            # Snapshots saved before expiry times were recorded have three fields
+            records = {
+                code: InviteRecord(code, *fields)
+                for code, fields in snapshot["invites"].items()
+            }
+            saved_at = float(snapshot["saved_at"])
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError):
+            do_log(f"Ignoring unreadable invite snapshot '{self.path}'")
+            return None
+        self.records = records
+        self.dirty = False
+        return saved_at
+
+    def save(self, force: bool = False):
+        """
+        Writes the snapshot to a temporary file and swaps it in, so a crash mid-write can't leave a
+        truncated snapshot behind. 'force' saves even without changes, to record that the state
+        was still accurate at this time.
+        """
+        if not self.dirty and not force:
+            return
+        self.dirty = False
+        snapshot = {
+            "saved_at": time(),
+            "invites": {
+                code: (
+                    record.uses,
+                    record.max_uses,
+                    record.inviter_id,
+                    record.expires_at,
+                )
+                for code, record in self.records.items()
+            },
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as snapshot_file:
+            json_dump(snapshot, snapshot_file)
+        os.replace(temp_path, self.path)
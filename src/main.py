@@ -1,17 +1,29 @@
 import os
 from traceback import format_exc
+from typing import List, Set
 
 import nextcord
 from dotenv import load_dotenv
 
 import utils
+from cogs.config_reload import ConfigReload as ConfigReloadCog
+from cogs.diagnostics import Diagnostics as DiagnosticsCog
 from cogs.invite_check import InviteCheck as InviteCheckCog
 from cogs.media_rate import MediaRate as MediaRateCog
 from cogs.message_logging import MessageLogging as MessageLoggingCog
+from config_schema import resolve_guild_objects
 
 global bot
 bot = utils.BotClass()
 
+# Cogs in load order, with the prefixes of the settings each one reads
+COGS = [
+    (InviteCheckCog, ("custom_invite_", "discord_channel_ids")),
+    (MessageLoggingCog, ("message_log",)),
+    (MediaRateCog, ("media_rate_", "discord_channel_ids")),
+    (DiagnosticsCog, ("loop_monitor_",)),
+]
+
 
 @bot.client.event
 async def on_error(event, args="", kwargs=""):
@@ -24,10 +36,19 @@ async def on_message(message: nextcord.Message):
     if not bot.ready:  # Handle race condition
         return
 
+    # For safety, strip sensitive pings
+    if "@" in message.content:
+        message.content = message.content.replace("@everyone", "@ everyone")
+        message.content = message.content.replace("@here", "@ here")
+
+    await bot.router.dispatch(message)
+
+
+async def on_command_message(message: nextcord.Message):
     # Basic non-overridable shutdown command
-    if message.author.id == bot.CFG[
-        "discord_bot_owner_id"
-    ] and message.content.lower().startswith("/off"):
+    if utils.is_owner(bot, message.author) and message.content.lower().startswith(
+        "/off"
+    ):
         try:
             await message.delete()
         finally:
@@ -35,34 +56,101 @@ async def on_message(message: nextcord.Message):
             await bot.client.logout()
             return
 
-    # For safety, strip sensitive pings
-    message.content = message.content.replace("@everyone", "@ everyone")
-    message.content = message.content.replace("@here", "@ here")
-
     # Process commands
     await bot.client.process_commands(message)
 
 
 async def post_init():
-    bot.client.add_cog(InviteCheckCog(bot))
-    bot.client.add_cog(MessageLoggingCog(bot))
-    bot.client.add_cog(MediaRateCog(bot))
+    # Only messages that can be commands are parsed as commands (bots' are ignored anyway)
+    bot.router.add(
+        "commands",
+        on_command_message,
+        prefixes=[bot.client.command_prefix],
+        allow_bots=False,
+    )
+    bot.metrics.install(bot.client)
+    for cog_class, _ in COGS:
+        bot.client.add_cog(bot.metrics.instrument_cog(cog_class(bot)))
+    bot.client.add_cog(bot.metrics.instrument_cog(ConfigReloadCog(bot, apply_config)))
+    await start_metrics()
+
+
+async def apply_config(changed: Set[str]) -> List[str]:
+    """
+    Hands the changed settings to every cog that reads one of them. Cogs that can't apply them in
+    place (or have no 'apply_config') are reloaded instead; returns the names of those.
+    """
+    reloaded = []
+    for cog_class, prefixes in COGS:
+        cog_changed = {key for key in changed if key.startswith(prefixes)}
+        if not cog_changed:
+            continue
+        name = cog_class.__name__
+        cog = bot.client.get_cog(name)
+        if cog is not None:
+            apply = getattr(cog, "apply_config", None)
+            if apply is not None and apply(cog_changed):
+                continue
+            bot.client.remove_cog(name)
+        bot.client.add_cog(bot.metrics.instrument_cog(cog_class(bot)))
+        reloaded.append(name)
+    return reloaded
+
+
+def enabled_cog(name: str):
+    cog = bot.client.get_cog(name)
+    return None if cog is None or cog.disabled else cog
+
+
+async def start_metrics():
+    metrics = bot.metrics
+    metrics.gauge(
+        "bot_gateway_latency_seconds",
+        "Latest gateway heartbeat round trip.",
+        lambda: bot.client.latency,
+    )
+    metrics.gauge(
+        "bot_message_log_write_queue",
+        "Message log items waiting for the writer thread.",
+        lambda: enabled_cog("MessageLogging").writer.depth(),
+    )
+    metrics.gauge(
+        "bot_media_probes_in_flight",
+        "Media rate link probes currently fetching.",
+        lambda: enabled_cog("MediaRate").probe.in_flight,
+    )
+    metrics.gauge(
+        "bot_media_reaction_queue",
+        "Rated messages waiting for their reactions.",
+        lambda: enabled_cog("MediaRate").reactions.depth(),
+    )
+    metrics.gauge(
+        "bot_invite_pending_joins",
+        "Joins waiting for the current join window's invite fetch.",
+        lambda: len(enabled_cog("InviteCheck").pending_joins),
+    )
+    metrics.gauge(
+        "bot_slow_callbacks",
+        "Callbacks that blocked the event loop past loop_monitor_threshold.",
+        lambda: bot.client.get_cog("Diagnostics").loop_monitor.slow_callbacks,
+    )
+
+    port = bot.CFG.get("metrics_port", 0)
+    if not port:
+        print("[metrics_port set to 0 or missing, not serving metrics]")
+        return
+    host = bot.CFG.get("metrics_host", "127.0.0.1")
+    try:
+        await metrics.start(host, port)
+    except OSError as e:
+        utils.log_error(f"[Metrics] Could not listen on {host}:{port} ({e})")
+        return
+    utils.do_log(f"Serving metrics on http://{host}:{port}/metrics")
 
 
 async def config():
     bot.guild = bot.client.get_guild(bot.CFG["discord_guild_id"])
-
-    # Instantiate channel objects
-    bot.channels = {}
-    for channel_name in bot.CFG["discord_channel_ids"]:
-        channel_id = bot.CFG["discord_channel_ids"][channel_name]
-        bot.channels[channel_name] = bot.guild.get_channel(channel_id)
-
-    # Instantiate role objects
-    bot.roles = {}
-    for role_name in bot.CFG["discord_role_ids"]:
-        role_id = bot.CFG["discord_role_ids"][role_name]
-        bot.roles[role_name] = bot.guild.get_role(role_id)
+    bot.channels, bot.roles = resolve_guild_objects(bot.guild, bot.CFG)
 
 
 @bot.client.event
@@ -73,11 +161,13 @@ async def on_ready():
         # await bot.client.change_presence(
         #     activity=nextcord.Game(name="/help", type=0)
         # )
+        first_ready = not bot.ready
         await config()
 
         utils.do_log("Ready\n\n")
         bot.ready = True
-        await post_init()
+        if first_ready:  # Fired again after a reconnect, with the cogs still loaded
+            await post_init()
     except Exception:
         utils.log_error(f"\n\n\nCRITICAL ERROR: FAILURE TO INITIALIZE{format_exc()}")
         await bot.client.close()
@@ -87,6 +177,7 @@ async def on_ready():
 
 def main():
     global bot
+    utils.setup_logging()
     bot.ready = False
     utils.do_log("Loading Config")
 
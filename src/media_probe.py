@@ -0,0 +1,94 @@
+from asyncio import TimeoutError as AsyncTimeoutError
+from typing import Optional
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+
+MEDIA_TAGS = (b"og:image", b"og:video", b"og:audio")
+HEAD_END = b"</head>"
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+MEDIA_TYPES = ("image/", "video/", "audio/")
+OVERLAP = max(len(tag) for tag in MEDIA_TAGS + (HEAD_END,)) - 1
+
+
+class MediaProbe:
+    """
+    Checks whether a linked page embeds media (OpenGraph image/video/audio tags), using one pooled
+    HTTP session for the lifetime of the cog.
+
+    Pages are streamed and reading stops as soon as a media tag or the end of <head> is found, or
+    after 'max_bytes', so a probe usually reads a few kilobytes regardless of the page size.
+    """
+
+    def __init__(
+        self,
+        connections: int = 20,
+        connections_per_host: int = 4,
+        timeout: float = 10.0,
+        max_bytes: int = 512 * 1024,
+        chunk_size: int = 8192,
+    ):
+        self.connections = connections
+        self.connections_per_host = connections_per_host
+        self.timeout = ClientTimeout(
+            total=timeout, sock_connect=timeout / 2, sock_read=timeout / 2
+        )
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.session: Optional[ClientSession] = None
+
+        self.requests = 0
+        self.in_flight = 0
+        self.failures = 0
+        self.bytes_read = 0
+
+    def get_session(self) -> ClientSession:
+        # Created on first use so it binds to the running event loop
+        if self.session is None or self.session.closed:
+            self.session = ClientSession(
+                connector=TCPConnector(
+                    limit=self.connections,
+                    limit_per_host=self.connections_per_host,
+                    ttl_dns_cache=300,
+                ),
+                timeout=self.timeout,
+            )
+        return self.session
+
+    async def has_media(self, url: str) -> Optional[bool]:
+        """
+        Returns True if the URL is (or embeds) media, False if it isn't, or None if the page could
+        not be fetched.
+        """
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            async with self.get_session().get(url) as response:
+                if response.status >= 400:
+                    return None
+                content_type = response.content_type.lower()
+                if content_type.startswith(MEDIA_TYPES):
+                    return True
+                if content_type not in HTML_TYPES:
+                    return False
+
+                tail = b""
+                size = 0
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    size += len(chunk)
+                    self.bytes_read += len(chunk)
+                    window = tail + chunk.lower()
+                    if any(tag in window for tag in MEDIA_TAGS):
+                        return True
+                    if HEAD_END in window or size >= self.max_bytes:
+                        return False
+                    tail = window[-OVERLAP:]
+                return False
+        except (ClientError, AsyncTimeoutError, ValueError):
+            self.failures += 1
+            return None
+        finally:
+            self.in_flight -= 1
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
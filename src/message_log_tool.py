@@ -0,0 +1,136 @@
+import sqlite3
+from argparse import ArgumentParser
+from json import dumps as json_dumps
+from pathlib import Path
+
+from message_store import ExtraDataRows, decode_json, load_extra_data, migrate
+from utils import do_log
+
+SPLIT_KEYS = {"attachments", "embeds", "stickers"}
+
+
+def database_size(db_path: Path) -> int:
+    return sum(
+        path.stat().st_size
+        for path in (db_path, db_path.with_name(db_path.name + "-wal"))
+        if path.exists()
+    )
+
+
+def compact(db_path: Path, compress: bool, batch_size: int):
+    """
+    Converts an existing message log in place: attachments, embeds and stickers are moved out of
+    each row's 'extra_data' JSON into the normalized tables, and the remainder is optionally
+    compressed. Safe to run repeatedly; rows that are already converted are skipped.
+    """
+    connection = sqlite3.connect(db_path)
+    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    size_before = database_size(db_path)
+    migrate(connection)
+    cursor = connection.cursor()
+
+    last_message_id = -1
+    scanned = 0
+    converted = 0
+    while True:
+        rows = cursor.execute(
+            "SELECT message_id, extra_data FROM messages WHERE extra_data IS NOT NULL "
+            "AND message_id > ? ORDER BY message_id LIMIT ?",
+            (last_message_id, batch_size),
+        ).fetchall()
+        if not rows:
+            break
+        last_message_id = rows[-1][0]
+        scanned += len(rows)
+
+        extra_rows = ExtraDataRows()
+        updates = []
+        for message_id, value in rows:
+            extra_data = decode_json(value)
+            if not isinstance(extra_data, dict):
+                continue
+            already_compact = isinstance(value, bytes) or not compress
+            if already_compact and not SPLIT_KEYS & extra_data.keys():
+                continue
+            updates.append(
+                (extra_rows.split(message_id, extra_data, compress), message_id)
+            )
+
+        with connection:
+            extra_rows.insert(cursor)
+            cursor.executemany(
+                "UPDATE messages SET extra_data=? WHERE message_id=?", updates
+            )
+        converted += len(updates)
+        do_log(f"Scanned {scanned} rows with extra data, converted {converted}")
+
+    do_log("Reclaiming free space (VACUUM)")
+    connection.execute("VACUUM")
+    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    connection.close()
+
+    size_after = database_size(db_path)
+    saved = size_before - size_after
+    do_log(
+        f"Converted {converted} rows. Size {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB "
+        f"(saved {saved / 1e6:.1f} MB, {saved / max(size_before, 1):.0%})"
+    )
+
+
+def show(db_path: Path, message_id: int):
+    connection = sqlite3.connect(db_path)
+    row = connection.execute(
+        "SELECT message_id, utc_time, channel_id, author_id, message_content FROM messages "
+        "WHERE message_id=?",
+        (message_id,),
+    ).fetchone()
+    if row is None:
+        print(f"Message {message_id} not found")
+        return
+    keys = ["message_id", "utc_time", "channel_id", "author_id", "message_content"]
+    message = dict(zip(keys, row))
+    message["extra_data"] = load_extra_data(connection.cursor(), message_id)
+    revision_keys = ["utc_time", "event", "message_content", "extra_data"]
+    message["revisions"] = [
+        dict(zip(revision_keys, revision[:3] + (decode_json(revision[3]),)))
+        for revision in connection.execute(
+            "SELECT utc_time, event, message_content, extra_data FROM message_revisions "
+            "WHERE message_id=? ORDER BY utc_time",
+            (message_id,),
+        )
+    ]
+    print(json_dumps(message, indent=2, ensure_ascii=False))
+
+
+def main():
+    parser = ArgumentParser(description="Message log maintenance.")
+    parser.add_argument(
+        "--db",
+        help="Filepath for the message log database (stop the bot first)",
+        default=str(Path("data") / "message_log.sqlite"),
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser(
+        "compact", help="Convert extra_data to the compact storage format in place"
+    )
+    compact_parser.add_argument(
+        "--compress", action="store_true", help="Also zlib-compress leftover JSON"
+    )
+    compact_parser.add_argument("--batch-size", type=int, default=5000)
+    show_parser = subparsers.add_parser(
+        "show", help="Print a stored message with its extra_data and revisions"
+    )
+    show_parser.add_argument("message_id", type=int)
+    args = parser.parse_args()
+
+    db_path = Path(args.db)
+    if not db_path.exists():
+        raise FileNotFoundError(f"'{db_path}' not found.")
+    if args.command == "compact":
+        compact(db_path, args.compress, args.batch_size)
+    elif args.command == "show":
+        show(db_path, args.message_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+from asyncio import gather
+from time import perf_counter
+from traceback import format_exc
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import nextcord
+
+MessageHandler = Callable[[nextcord.Message], Awaitable[None]]
+
+
+class MessageRoute:
+    __slots__ = ("name", "handler", "channel_ids", "prefixes", "allow_bots", "calls")
+
+    def __init__(
+        self,
+        name: str,
+        handler: MessageHandler,
+        channel_ids: Optional[frozenset],
+        prefixes: Optional[Tuple[str, ...]],
+        allow_bots: bool,
+    ):
+        self.name = name
+        self.handler = handler
+        self.channel_ids = channel_ids
+        self.prefixes = prefixes
+        self.allow_bots = allow_bots
+        self.calls = 0
+
+
+class MessageRouter:
+    """
+    Decides once per message which handlers want it, from each handler's channel IDs, content
+    prefixes and whether it takes messages from bots, and only runs those. Handlers are indexed by
+    channel, so a message only looks at the routes for its own channel plus the catch-all ones,
+    and messages nobody wants don't cost a listener task per cog.
+    """
+
+    def __init__(
+        self,
+        on_error: Callable[[str], None],
+        observe: Optional[Callable[[str, float, bool], None]] = None,
+    ):
+        self.on_error = on_error
+        # Called with each handler's name, run time and whether it raised
+        self.observe = observe
+        self.routes: List[MessageRoute] = []
+        self.by_channel: Dict[int, List[MessageRoute]] = {}
+        self.any_channel: List[MessageRoute] = []
+
+        self.messages = 0
+        self.unrouted = 0
+        self.route_time = 0.0
+
+    def add(
+        self,
+        name: str,
+        handler: MessageHandler,
+        channel_ids: Optional[Iterable[int]] = None,
+        prefixes: Optional[Iterable[str]] = None,
+        allow_bots: bool = True,
+    ):
+        """
+        Routes messages to 'handler', only from 'channel_ids' and only starting with one of
+        'prefixes' if given. Handlers of the same message run in the order they were added.
+        """
+        self.remove(name)
+        self.routes.append(
+            MessageRoute(
+                name,
+                handler,
+                frozenset(channel_ids) if channel_ids is not None else None,
+                tuple(prefixes) if prefixes is not None else None,
+                allow_bots,
+            )
+        )
+        self.rebuild()
+
+    def remove(self, name: str):
+        self.routes = [route for route in self.routes if route.name != name]
+        self.rebuild()
+
+    def rebuild(self):
+        self.by_channel = {}
+        self.any_channel = []
+        for route in self.routes:
+            if route.channel_ids is None:
+                self.any_channel.append(route)
+                for routes in self.by_channel.values():
+                    routes.append(route)
+                continue
+            for channel_id in route.channel_ids:
+                self.by_channel.setdefault(channel_id, self.any_channel[:]).append(
+                    route
+                )
+
+    def route(self, message: nextcord.Message) -> List[MessageRoute]:
+        candidates = self.by_channel.get(message.channel.id, self.any_channel)
+        if not candidates:
+            return []
+        is_bot = message.author.bot
+        content = message.content
+        return [
+            route
+            for route in candidates
+            if (route.allow_bots or not is_bot)
+            and (route.prefixes is None or content.startswith(route.prefixes))
+        ]
+
+    async def dispatch(self, message: nextcord.Message):
+        start = perf_counter()
+        routes = self.route(message)
+        self.route_time += perf_counter() - start
+        self.messages += 1
+        if not routes:
+            self.unrouted += 1
+        elif len(routes) == 1:
+            await self.run(routes[0], message)
+        else:
+            await gather(*(self.run(route, message) for route in routes))
+
+    async def run(self, route: MessageRoute, message: nextcord.Message):
+        route.calls += 1
+        start = perf_counter()
+        failed = False
+        try:
+            await route.handler(message)
+        except Exception:
+            failed = True
+            self.on_error(f"[Uncaught Error] ({route.name})\n{format_exc()}")
+        if self.observe is not None:
+            self.observe(route.name, perf_counter() - start, failed)
+
+    def stats(self) -> str:
+        average_us = self.route_time / max(self.messages, 1) * 1e6
+        calls = ", ".join(f"{route.name} {route.calls}" for route in self.routes)
+        return (
+            f"{self.messages} messages ({average_us:.1f} µs to route), "
+            f"{self.unrouted} unrouted; {calls or 'no routes'}"
+        )
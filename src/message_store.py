@@ -0,0 +1,563 @@
+import sqlite3
+from hashlib import blake2b
+from json import dumps as json_dumps
+from json import loads as json_loads
+from typing import Any, Dict, List, Optional, Tuple, Union
+from zlib import compress as zlib_compress
+from zlib import decompress as zlib_decompress
+
+import nextcord
+from nextcord.types.message import Message as MessagePayload
+
+from utils import do_log
+
+MessageColumnsType = Tuple[int, float, int, int, str, Optional[Union[str, bytes]]]
+# Same layout as the table row, but with 'extra_data' still as a dict; the writer splits it into
+# the normalized tables and encodes whatever is left
+MessageRecordType = Tuple[int, float, int, int, str, Optional[Dict[str, Any]]]
+# (message_id, channel_id, utc_time, event, message_content, extra_data) for one edit, late embed
+# or deletion
+RevisionRecordType = Tuple[
+    int, int, float, str, Optional[str], Optional[Dict[str, Any]]
+]
+
+INSERT_MESSAGE_QUERY = "INSERT OR IGNORE INTO messages VALUES(?,?,?,?,?,?);"
+INSERT_ATTACHMENT_QUERY = "INSERT OR IGNORE INTO attachments VALUES(?,?,?,?,?);"
+INSERT_STICKER_QUERY = "INSERT OR IGNORE INTO stickers VALUES(?,?,?,?);"
+INSERT_MESSAGE_STICKER_QUERY = "INSERT OR IGNORE INTO message_stickers VALUES(?,?,?);"
+INSERT_EMBED_QUERY = "INSERT OR IGNORE INTO embeds VALUES(?,?);"
+INSERT_MESSAGE_EMBED_QUERY = "INSERT OR IGNORE INTO message_embeds VALUES(?,?,?);"
+ROLLUP_REBUILD_QUERY = (
+    "INSERT INTO activity_{period} SELECT CAST(utc_time / {seconds} AS INTEGER) AS bucket, "
+    "channel_id, author_id, COUNT(*) FROM messages "
+    "WHERE channel_id = ? AND utc_time >= ? AND message_id > ? GROUP BY bucket, author_id "
+    "ON CONFLICT({period_key}, channel_id, author_id) "
+    "DO UPDATE SET messages = messages + excluded.messages;"
+)
+INSERT_REVISION_QUERY = (
+    "INSERT INTO message_revisions(message_id, channel_id, utc_time, event, message_content, "
+    "extra_data) VALUES(?,?,?,?,?,?);"
+)
+UPDATE_CHECKPOINT_QUERY = (
+    "INSERT INTO channel_checkpoints VALUES(?,?) ON CONFLICT(channel_id) "
+    "DO UPDATE SET last_message_id=max(last_message_id, excluded.last_message_id);"
+)
+
+# Each entry upgrades the schema by one version (tracked with PRAGMA user_version). Databases
+# created before versioning existed start at version 0 and already have the 'messages' table.
+MIGRATIONS: List[List[str]] = [
+    [
+        "CREATE TABLE IF NOT EXISTS messages(message_id INTEGER PRIMARY KEY DESC, utc_time REAL, "
+        "channel_id INTEGER, author_id INTEGER, message_content TEXT, extra_data TEXT)",
+        "CREATE TABLE IF NOT EXISTS channel_checkpoints(channel_id INTEGER PRIMARY KEY, "
+        "last_message_id INTEGER)",
+    ],
+    [
+        "CREATE INDEX IF NOT EXISTS messages_channel_time ON messages(channel_id, utc_time)",
+        "INSERT INTO channel_checkpoints SELECT channel_id, MAX(message_id) FROM messages "
+        "WHERE true GROUP BY channel_id ON CONFLICT(channel_id) "
+        "DO UPDATE SET last_message_id=max(last_message_id, excluded.last_message_id)",
+    ],
+    [
+        # External-content FTS index over message_content, kept in sync by triggers so that every
+        # write path (live messages, backfill, maintenance) updates it in the same transaction
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(message_content, "
+        "content='messages', content_rowid='message_id')",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts(rowid, message_content) "
+        "VALUES(new.message_id, new.message_content); END",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, message_content) "
+        "VALUES('delete', old.message_id, old.message_content); END",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message_content "
+        "ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, message_content) "
+        "VALUES('delete', old.message_id, old.message_content); "
+        "INSERT INTO messages_fts(rowid, message_content) "
+        "VALUES(new.message_id, new.message_content); END",
+        "INSERT INTO messages_fts(messages_fts) VALUES('rebuild')",
+        "CREATE INDEX IF NOT EXISTS messages_author_time ON messages(author_id, utc_time)",
+    ],
+    [
+        # Normalized storage for what used to be repeated inside every row's extra_data JSON
+        "CREATE TABLE IF NOT EXISTS attachments(message_id INTEGER, position INTEGER, "
+        "content_type TEXT, filename TEXT, url TEXT, PRIMARY KEY(message_id, position)) "
+        "WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS stickers(sticker_id INTEGER PRIMARY KEY, name TEXT, "
+        "format TEXT, url TEXT)",
+        "CREATE TABLE IF NOT EXISTS message_stickers(message_id INTEGER, position INTEGER, "
+        "sticker_id INTEGER, PRIMARY KEY(message_id, position)) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS embeds(embed_hash BLOB PRIMARY KEY, data BLOB) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS message_embeds(message_id INTEGER, position INTEGER, "
+        "embed_hash BLOB, PRIMARY KEY(message_id, position)) WITHOUT ROWID",
+    ],
+    [
+        # Append-only history of edits and deletions; 'messages' keeps the original version
+        "CREATE TABLE IF NOT EXISTS message_revisions(revision_id INTEGER PRIMARY KEY, "
+        "message_id INTEGER, channel_id INTEGER, utc_time REAL, event TEXT, "
+        "message_content TEXT, extra_data TEXT)",
+        "CREATE INDEX IF NOT EXISTS message_revisions_message "
+        "ON message_revisions(message_id, utc_time)",
+    ],
+    [
+        # Message counts per channel and author, bucketed by UTC hour and day
+        "CREATE TABLE IF NOT EXISTS activity_hourly(hour INTEGER, channel_id INTEGER, "
+        "author_id INTEGER, messages INTEGER, PRIMARY KEY(hour, channel_id, author_id)) "
+        "WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS activity_daily(day INTEGER, channel_id INTEGER, "
+        "author_id INTEGER, messages INTEGER, PRIMARY KEY(day, channel_id, author_id)) "
+        "WITHOUT ROWID",
+        # Channels being backfilled, and the message ID their backfill started after. Rollups
+        # for these channels are skipped per row and rebuilt in one pass once the backfill ends.
+        "CREATE TABLE IF NOT EXISTS rollup_pending(channel_id INTEGER PRIMARY KEY, "
+        "after_id INTEGER)",
+        "CREATE TRIGGER IF NOT EXISTS activity_insert AFTER INSERT ON messages "
+        "WHEN NOT EXISTS (SELECT 1 FROM rollup_pending WHERE channel_id = new.channel_id) "
+        "BEGIN "
+        "INSERT INTO activity_hourly VALUES(CAST(new.utc_time / 3600 AS INTEGER), "
+        "new.channel_id, new.author_id, 1) ON CONFLICT(hour, channel_id, author_id) "
+        "DO UPDATE SET messages = messages + 1; "
+        "INSERT INTO activity_daily VALUES(CAST(new.utc_time / 86400 AS INTEGER), "
+        "new.channel_id, new.author_id, 1) ON CONFLICT(day, channel_id, author_id) "
+        "DO UPDATE SET messages = messages + 1; "
+        "END",
+        "INSERT INTO activity_hourly SELECT CAST(utc_time / 3600 AS INTEGER), channel_id, "
+        "author_id, COUNT(*) FROM messages WHERE true GROUP BY 1, 2, 3",
+        "INSERT INTO activity_daily SELECT hour / 24, channel_id, author_id, SUM(messages) "
+        "FROM activity_hourly WHERE true GROUP BY 1, 2, 3",
+    ],
+]
+
+DISCORD_EPOCH_MS = 1420070400000
+STICKER_URL = "https://cdn.discordapp.com/stickers"
+STICKER_FORMATS = {1: "png", 2: "apng", 3: "lottie", 4: "gif"}
+STICKER_EXTENSIONS = {1: "png", 2: "png", 3: "json", 4: "gif"}
+COMPRESS_MIN_LENGTH = 128  # Shorter JSON rarely gets smaller when compressed
+
+
+def migrate(connection: sqlite3.Connection) -> bool:
+    """
+    Brings the message log schema up to date. Returns True if the database had no message log
+    in it beforehand.
+    """
+    new_db = (
+        connection.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='messages'"
+        ).fetchone()
+        is None
+    )
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    for target_version in range(version + 1, len(MIGRATIONS) + 1):
+        do_log(f"Migrating message log database to version {target_version}")
+        with connection:
+            for query in MIGRATIONS[target_version - 1]:
+                connection.execute(query)
+            connection.execute(f"PRAGMA user_version={target_version}")
+    return new_db
+
+
+def fts_query(text: str) -> str:
+    """
+    Turns free text into an FTS5 query that matches every word, quoting each word so that user
+    input can never be parsed as FTS5 query syntax. A trailing '*' keeps prefix matching.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*") and len(word) > 1
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def build_search_query(
+    text: str,
+    author_id: Optional[int] = None,
+    channel_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: int = 10,
+    offset: int = 0,
+) -> Tuple[str, List[Any]]:
+    """
+    Builds a ranked full-text search over the message log. Time bounds are passed as snowflakes,
+    which lets FTS5 restrict its scan by rowid instead of filtering joined rows afterwards.
+    """
+    conditions = ["messages_fts MATCH ?"]
+    params: List[Any] = [fts_query(text)]
+    if after_id is not None:
+        conditions.append("messages_fts.rowid >= ?")
+        params.append(after_id)
+    if before_id is not None:
+        conditions.append("messages_fts.rowid < ?")
+        params.append(before_id)
+    if author_id is not None:
+        conditions.append("m.author_id = ?")
+        params.append(author_id)
+    if channel_id is not None:
+        conditions.append("m.channel_id = ?")
+        params.append(channel_id)
+    params += [limit, offset]
+    query = (
+        "SELECT m.message_id, m.channel_id, m.author_id, m.utc_time, "  # nosec
+        "snippet(messages_fts, 0, '**', '**', '...', 24) "
+        "FROM messages_fts JOIN messages m ON m.message_id = messages_fts.rowid "
+        f"WHERE {' AND '.join(conditions)} ORDER BY messages_fts.rank LIMIT ? OFFSET ?"
+    )
+    return query, params
+
+
+def encode_json(value: Any, compress: bool = False) -> Union[str, bytes]:
+    """
+    Serializes 'value' to compact JSON, zlib-compressed into a BLOB if 'compress' is set and the
+    text is long enough to benefit.
+    """
+    text = json_dumps(value, separators=(",", ":"), sort_keys=True)
+    if compress and len(text) >= COMPRESS_MIN_LENGTH:
+        return zlib_compress(text.encode("utf-8"), 6)
+    return text
+
+
+def decode_json(value: Optional[Union[str, bytes]]) -> Any:
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = zlib_decompress(value).decode("utf-8")
+    return json_loads(value)
+
+
+class ExtraDataRows:
+    """
+    Rows for the normalized tables, collected from the 'extra_data' of one or more messages.
+    """
+
+    def __init__(self):
+        self.attachments: List[Tuple] = []
+        self.stickers: List[Tuple] = []
+        self.message_stickers: List[Tuple] = []
+        self.embeds: Dict[bytes, Union[str, bytes]] = {}
+        self.message_embeds: List[Tuple] = []
+
+    def split(
+        self, message_id: int, extra_data: Optional[Dict[str, Any]], compress: bool
+    ) -> Optional[Union[str, bytes]]:
+        """
+        Moves attachments, embeds and stickers out of 'extra_data' into table rows, and returns
+        the encoded remainder for the 'extra_data' column (None if nothing is left).
+        """
+        if not extra_data:
+            return None
+        remaining = dict(extra_data)
+
+        for position, attachment in enumerate(remaining.pop("attachments", [])):
+            self.attachments.append(
+                (
+                    message_id,
+                    position,
+                    attachment.get("content_type"),
+                    attachment.get("filename"),
+                    attachment.get("url"),
+                )
+            )
+
+        for position, embed in enumerate(remaining.pop("embeds", [])):
+            embed_json = json_dumps(embed, separators=(",", ":"), sort_keys=True)
+            embed_hash = blake2b(embed_json.encode("utf-8"), digest_size=16).digest()
+            if embed_hash not in self.embeds:
+                self.embeds[embed_hash] = encode_json(embed, compress)
+            self.message_embeds.append((message_id, position, embed_hash))
+
+        unknown_stickers = []
+        for position, sticker in enumerate(remaining.pop("stickers", [])):
+            if sticker.get("id") is None:
+                unknown_stickers.append(sticker)
+                continue
+            sticker_format = sticker.get("format")
+            self.stickers.append(
+                (
+                    sticker["id"],
+                    sticker.get("name"),
+                    getattr(sticker_format, "name", sticker_format),
+                    sticker.get("url"),
+                )
+            )
+            self.message_stickers.append((message_id, position, sticker["id"]))
+        if unknown_stickers:
+            remaining["stickers"] = unknown_stickers
+
+        return encode_json(remaining, compress) if remaining else None
+
+    def insert(self, cursor: sqlite3.Cursor):
+        cursor.executemany(INSERT_ATTACHMENT_QUERY, self.attachments)
+        cursor.executemany(INSERT_STICKER_QUERY, self.stickers)
+        cursor.executemany(INSERT_MESSAGE_STICKER_QUERY, self.message_stickers)
+        cursor.executemany(INSERT_EMBED_QUERY, self.embeds.items())
+        cursor.executemany(INSERT_MESSAGE_EMBED_QUERY, self.message_embeds)
+
+
+def load_extra_data(cursor: sqlite3.Cursor, message_id: int) -> Dict[str, Any]:
+    """
+    Reassembles a message's full 'extra_data' dict (in the original format) from the
+    'extra_data' column and the normalized tables.
+    """
+    row = cursor.execute(
+        "SELECT extra_data FROM messages WHERE message_id=?", (message_id,)
+    ).fetchone()
+    extra_data: Dict[str, Any] = (decode_json(row[0]) if row else None) or {}
+
+    attachments = cursor.execute(
+        "SELECT content_type, filename, url FROM attachments WHERE message_id=? "
+        "ORDER BY position",
+        (message_id,),
+    ).fetchall()
+    if attachments:
+        extra_data["attachments"] = [
+            {"content_type": content_type, "filename": filename, "url": url}
+            for content_type, filename, url in attachments
+        ]
+
+    embeds = cursor.execute(
+        "SELECT e.data FROM message_embeds m JOIN embeds e ON e.embed_hash = m.embed_hash "
+        "WHERE m.message_id=? ORDER BY m.position",
+        (message_id,),
+    ).fetchall()
+    if embeds:
+        extra_data["embeds"] = [decode_json(data) for (data,) in embeds]
+
+    stickers = cursor.execute(
+        "SELECT s.sticker_id, s.name, s.format, s.url FROM message_stickers m "
+        "JOIN stickers s ON s.sticker_id = m.sticker_id WHERE m.message_id=? ORDER BY m.position",
+        (message_id,),
+    ).fetchall()
+    if stickers:
+        extra_data["stickers"] = [
+            {"id": sticker_id, "name": name, "format": sticker_format, "url": url}
+            for sticker_id, name, sticker_format, url in stickers
+        ] + extra_data.get("stickers", [])
+
+    return extra_data
+
+
+def message_to_record(message: nextcord.Message) -> MessageRecordType:
+    """
+    Builds a message record from a nextcord Message. 'payload_to_record' produces the same record
+    straight from the gateway/API payload, without building the Message first.
+    """
+    extra_data: Dict[str, Any] = {}
+
+    # Prioritizing edge case handling over readability
+    if message.reference is not None and message.reference.message_id is not None:
+        extra_data["replying_to"] = message.reference.message_id
+
+    attachments = []
+    for attachment in message.attachments:
+        attachment_obj: Dict[str, Any] = {
+            "content_type": None,
+            "filename": None,
+            "url": None,
+        }
+        try:
+            attachment_obj["content_type"] = attachment.content_type
+        except Exception:  # nosec
+            pass
+        try:
+            attachment_obj["filename"] = attachment.filename
+        except Exception:  # nosec
+            pass
+        try:
+            attachment_obj["url"] = attachment.url
+        except Exception:  # nosec
+            pass
+
+        attachments.append(attachment_obj)
+    if attachments:
+        extra_data["attachments"] = attachments
+
+    embeds = []
+    for embed in message.embeds:
+        try:
+            embeds.append(embed.to_dict())
+        except Exception:  # nosec
+            pass
+    if embeds:
+        extra_data["embeds"] = embeds
+
+    stickers = []
+    for sticker in message.stickers:
+        sticker_obj: Dict[str, Any] = {
+            "id": None,
+            "name": None,
+            "format": None,
+            "url": None,
+        }
+        try:
+            sticker_obj["id"] = sticker.id
+        except Exception:  # nosec
+            pass
+        try:
+            sticker_obj["name"] = sticker.name
+        except Exception:  # nosec
+            pass
+        try:
+            sticker_obj["format"] = sticker.format
+        except Exception:  # nosec
+            pass
+        try:
+            sticker_obj["url"] = sticker.url
+        except Exception:  # nosec
+            pass
+
+        stickers.append(sticker_obj)
+    if stickers:
+        extra_data["stickers"] = stickers
+
+    columns: MessageRecordType = (
+        int(message.id),
+        float(message.created_at.timestamp()),
+        int(message.channel.id),
+        int(message.author.id),
+        str(message.content),
+        extra_data if extra_data else None,
+    )
+    return columns
+
+
+def payload_to_record(data: MessagePayload) -> MessageRecordType:
+    """
+    Builds the same record as 'message_to_record' directly from a raw message payload (gateway
+    MESSAGE_CREATE data or a channel history page entry), skipping nextcord's object model.
+    """
+    message_id = int(data["id"])
+    extra_data: Dict[str, Any] = {}
+
+    reference = data.get("message_reference")
+    if reference is not None and reference.get("message_id") is not None:
+        extra_data["replying_to"] = int(reference["message_id"])
+
+    attachments = data.get("attachments")
+    if attachments:
+        extra_data["attachments"] = [
+            {
+                "content_type": attachment.get("content_type"),
+                "filename": attachment.get("filename"),
+                "url": attachment.get("url"),
+            }
+            for attachment in attachments
+        ]
+
+    embeds = data.get("embeds")
+    if embeds:
+        extra_data["embeds"] = embeds
+
+    stickers = data.get("sticker_items")
+    if stickers:
+        extra_data["stickers"] = [
+            {
+                "id": int(sticker["id"]),
+                "name": sticker.get("name"),
+                "format": STICKER_FORMATS.get(sticker.get("format_type", 0)),
+                "url": f"{STICKER_URL}/{sticker['id']}."
+                f"{STICKER_EXTENSIONS.get(sticker.get('format_type', 0), 'png')}",
+            }
+            for sticker in stickers
+        ]
+
+    return (
+        message_id,
+        ((message_id >> 22) + DISCORD_EPOCH_MS) / 1000,
+        int(data["channel_id"]),
+        int(data["author"]["id"]),
+        data.get("content", ""),
+        extra_data if extra_data else None,
+    )
+
+
+def insert_message_records(
+    cursor: sqlite3.Cursor,
+    records: List[MessageRecordType],
+    compress: bool = False,
+    advance_checkpoints: bool = True,
+):
+    """
+    Writer handler for 'message' items. Also advances each channel's checkpoint to the newest
+    message in the batch, so startup can find every resume point with one query. Live messages
+    stored before the backfill has caught up must not advance it, or the history between the old
+    checkpoint and them would be skipped on the next start.
+    """
+    extra_rows = ExtraDataRows()
+    rows: List[MessageColumnsType] = []
+    newest: Dict[int, int] = {}
+    for message_id, utc_time, channel_id, author_id, content, extra_data in records:
+        rows.append(
+            (
+                message_id,
+                utc_time,
+                channel_id,
+                author_id,
+                content,
+                extra_rows.split(message_id, extra_data, compress),
+            )
+        )
+        if message_id > newest.get(channel_id, 0):
+            newest[channel_id] = message_id
+    cursor.executemany(INSERT_MESSAGE_QUERY, rows)
+    extra_rows.insert(cursor)
+    if advance_checkpoints:
+        cursor.executemany(UPDATE_CHECKPOINT_QUERY, newest.items())
+
+
+def insert_revision_records(
+    cursor: sqlite3.Cursor, records: List[RevisionRecordType], compress: bool = False
+):
+    """
+    Writer handler for 'revision' items.
+    """
+    cursor.executemany(
+        INSERT_REVISION_QUERY,
+        [
+            (
+                message_id,
+                channel_id,
+                utc_time,
+                event,
+                content,
+                encode_json(extra_data, compress) if extra_data else None,
+            )
+            for message_id, channel_id, utc_time, event, content, extra_data in records
+        ],
+    )
+
+
+def pause_rollups(cursor: sqlite3.Cursor, channels: List[Tuple[int, int]]):
+    """
+    Stops per-row rollup updates for the given (channel_id, after_id) pairs until
+    'rebuild_pending_rollups' runs. A channel that is already pending (from an interrupted
+    backfill) keeps its original, earlier starting point.
+    """
+    cursor.executemany("INSERT OR IGNORE INTO rollup_pending VALUES(?,?);", channels)
+
+
+def rebuild_pending_rollups(cursor: sqlite3.Cursor) -> int:
+    """
+    Adds everything inserted into paused channels to the rollups in one aggregate pass per
+    channel, then resumes per-row updates. Returns the number of channels rebuilt.
+    """
+    pending = cursor.execute(
+        "SELECT channel_id, after_id FROM rollup_pending"
+    ).fetchall()
+    for channel_id, after_id in pending:
+        # Snowflakes only grow with time, so this bound lets the (channel_id, utc_time) index
+        # skip straight to the backfilled rows
+        after_time = ((after_id >> 22) + DISCORD_EPOCH_MS) / 1000 if after_id else 0.0
+        for period, period_key, seconds in (
+            ("hourly", "hour", 3600),
+            ("daily", "day", 86400),
+        ):
+            cursor.execute(
+                ROLLUP_REBUILD_QUERY.format(
+                    period=period, period_key=period_key, seconds=seconds
+                ),
+                (channel_id, after_time, after_id),
+            )
+    cursor.execute("DELETE FROM rollup_pending")
+    return len(pending)
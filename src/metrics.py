@@ -0,0 +1,278 @@
+from asyncio import Task, create_task
+from asyncio import sleep as async_sleep
+from bisect import bisect_left
+from functools import wraps
+from math import isinf, isnan
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from nextcord.ext import commands
+
+# Seconds; covers a cache hit (well under a millisecond) up to a probe hitting its deadline
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+GaugeCallback = Callable[[], Optional[float]]
+# (kind, name, elapsed seconds, failed) for work a cog times itself
+ObserveCallback = Callable[[str, str, float, bool], None]
+
+
+class Histogram:
+    __slots__ = ("bounds", "buckets", "count", "total")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)  # The last one is +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+
+class HandlerStats:
+    """
+    Calls, errors and latency of one listener, route or command. Wrappers hold on to their own
+    instance, so recording a call is a couple of additions and one bisect.
+    """
+
+    __slots__ = ("calls", "errors", "latency")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+
+    def record(self, elapsed: float, failed: bool):
+        self.calls += 1
+        if failed:
+            self.errors += 1
+        self.latency.observe(elapsed)
+
+
+def format_value(value: float) -> str:
+    if isnan(value):
+        return "NaN"
+    if isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    pairs = (
+        name
+        + '="'
+        + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        + '"'
+        for name, value in labels
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metrics:
+    """
+    Counts and times every cog listener, message route and command, samples event loop lag, and
+    reads gauges (queue depths, probes in flight, gateway latency) only when scraped. Everything is
+    served in the Prometheus text format from a small local HTTP endpoint.
+    """
+
+    def __init__(self, lag_interval: float = 0.5):
+        self.handlers: Dict[Tuple[str, str], HandlerStats] = {}
+        self.gauges: List[Tuple[str, str, GaugeCallback]] = []
+        self.lag_interval = lag_interval
+        self.lag = Histogram(LAG_BUCKETS)
+        self.last_lag = 0.0
+        self.lag_task: Optional[Task] = None
+        self.runner: Optional[web.AppRunner] = None
+
+    def handler(self, kind: str, name: str) -> HandlerStats:
+        stats = self.handlers.get((kind, name))
+        if stats is None:
+            stats = self.handlers[(kind, name)] = HandlerStats()
+        return stats
+
+    def observe(self, kind: str, name: str, elapsed: float, failed: bool):
+        self.handler(kind, name).record(elapsed, failed)
+
+    def gauge(self, name: str, description: str, callback: GaugeCallback):
+        """
+        Registers a gauge read by calling 'callback' on every scrape; None leaves it out.
+        """
+        self.gauges = [gauge for gauge in self.gauges if gauge[0] != name]
+        self.gauges.append((name, description, callback))
+
+    def instrument_cog(self, cog: commands.Cog) -> commands.Cog:
+        """
+        Replaces the cog's listeners with timed wrappers. Call before adding the cog, since that is
+        when nextcord looks its listeners up. Cogs whose work runs outside listeners (gateway
+        parser hooks, background queues) have an 'observe' attribute to report it through.
+        """
+        for _, method_name in cog.__cog_listeners__:
+            listener = getattr(cog, method_name)
+            stats = self.handler("listener", f"{cog.qualified_name}.{method_name}")
+            setattr(cog, method_name, timed(listener, stats))
+        if hasattr(cog, "observe"):
+            setattr(cog, "observe", self.cog_observer(cog.qualified_name))
+        return cog
+
+    def cog_observer(self, cog_name: str) -> ObserveCallback:
+        def observe(kind: str, name: str, elapsed: float, failed: bool):
+            self.observe(kind, f"{cog_name}.{name}", elapsed, failed)
+
+        return observe
+
+    def install(self, client: commands.Bot):
+        """
+        Times every command through the bot-wide before/after invoke hooks, which also run when the
+        command raises.
+        """
+
+        async def before_invoke(ctx: commands.Context):
+            ctx.metrics_start = perf_counter()  # type: ignore[attr-defined]
+
+        async def after_invoke(ctx: commands.Context):
+            start = getattr(ctx, "metrics_start", None)
+            if start is None or ctx.command is None:
+                return
+            self.observe(
+                "command",
+                ctx.command.qualified_name,
+                perf_counter() - start,
+                ctx.command_failed,
+            )
+
+        client.before_invoke(before_invoke)
+        client.after_invoke(after_invoke)
+
+    async def lag_loop(self):
+        while True:
+            start = perf_counter()
+            await async_sleep(self.lag_interval)
+            self.last_lag = max(0.0, perf_counter() - start - self.lag_interval)
+            self.lag.observe(self.last_lag)
+
+    async def start(self, host: str, port: int):
+        self.lag_task = create_task(self.lag_loop())
+        app = web.Application()
+        app.router.add_get("/metrics", self.metrics_handler)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def stop(self):
+        if self.lag_task is not None:
+            self.lag_task.cancel()
+            self.lag_task = None
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def metrics_handler(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=self.render(), content_type="text/plain", charset="utf-8"
+        )
+
+    def render(self) -> str:
+        lines: List[str] = []
+        handlers = sorted(self.handlers.items())
+
+        lines.append(
+            "# HELP bot_handler_calls_total Calls per listener, route, command and cog job."
+        )
+        lines.append("# TYPE bot_handler_calls_total counter")
+        for (kind, name), stats in handlers:
+            labels = format_labels((("kind", kind), ("handler", name)))
+            lines.append(f"bot_handler_calls_total{labels} {stats.calls}")
+
+        lines.append("# HELP bot_handler_errors_total Calls that raised.")
+        lines.append("# TYPE bot_handler_errors_total counter")
+        for (kind, name), stats in handlers:
+            labels = format_labels((("kind", kind), ("handler", name)))
+            lines.append(f"bot_handler_errors_total{labels} {stats.errors}")
+
+        lines.append(
+            "# HELP bot_handler_seconds Time from a handler's start to its return."
+        )
+        lines.append("# TYPE bot_handler_seconds histogram")
+        for (kind, name), stats in handlers:
+            render_histogram(
+                lines,
+                "bot_handler_seconds",
+                (("kind", kind), ("handler", name)),
+                stats.latency,
+            )
+
+        lines.append(
+            "# HELP bot_event_loop_lag_seconds How late the event loop woke a sleeper."
+        )
+        lines.append("# TYPE bot_event_loop_lag_seconds histogram")
+        render_histogram(lines, "bot_event_loop_lag_seconds", (), self.lag)
+        lines.append(
+            "# HELP bot_event_loop_lag_last_seconds Latest event loop lag sample."
+        )
+        lines.append("# TYPE bot_event_loop_lag_last_seconds gauge")
+        lines.append(f"bot_event_loop_lag_last_seconds {format_value(self.last_lag)}")
+
+        for name, description, callback in self.gauges:
+            try:
+                value = callback()
+            except Exception:  # nosec
+                continue  # A half-loaded or unloaded cog; leave the gauge out
+            if value is None:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {format_value(float(value))}")
+        return "\n".join(lines) + "\n"
+
+
+def render_histogram(
+    lines: List[str],
+    name: str,
+    labels: Tuple[Tuple[str, str], ...],
+    histogram: Histogram,
+):
+    cumulative = 0
+    for bound, count in zip(histogram.bounds + (float("inf"),), histogram.buckets):
+        cumulative += count
+        bucket_labels = format_labels(labels + (("le", format_value(bound)),))
+        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+    lines.append(f"{name}_sum{format_labels(labels)} {format_value(histogram.total)}")
+    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+
+def timed(function: Callable[..., Any], stats: HandlerStats) -> Callable[..., Any]:
+    @wraps(function)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start = perf_counter()
+        failed = True
+        try:
+            result = await function(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            stats.record(perf_counter() - start, failed)
+
+    return wrapper
@@ -0,0 +1,162 @@
+import sys
+import threading
+from asyncio import AbstractEventLoop, Handle, current_task
+from collections import Counter
+from os.path import basename
+from time import monotonic
+from traceback import format_stack
+from types import FrameType
+from typing import Callable, List, Optional, Tuple
+
+
+def frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame: Optional[FrameType]) -> str:
+    """
+    The stack ending in 'frame', outermost call first, in the ';'-separated form flame graph
+    tools read.
+    """
+    labels: List[str] = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """
+    Samples one thread's stack every 'interval' seconds from a background thread and counts
+    identical stacks. Unlike cProfile it doesn't hook every call, so the profiled thread runs at
+    close to full speed.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.stacks[collapse_stack(frame)] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """
+        One 'stack count' line per distinct stack, most sampled first.
+        """
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+
+class LoopMonitor:
+    """
+    Detects callbacks that block the event loop for more than 'threshold' seconds.
+
+    The loop schedules a heartbeat every 'threshold / 2' seconds. A watchdog thread checks the
+    heartbeat and, once it is overdue by more than 'threshold', captures the loop thread's stack
+    and the task it is running while the blocking call is still on it. When the heartbeat finally
+    runs it knows exactly how late it is, and passes that and the captured stack to 'on_slow'.
+    """
+
+    def __init__(
+        self,
+        loop: AbstractEventLoop,
+        threshold: float,
+        on_slow: Callable[[str], None],
+    ):
+        self.loop = loop
+        self.threshold = threshold
+        self.interval = threshold / 2
+        self.on_slow = on_slow
+        self.thread_id = 0
+        self.expected = 0.0
+        self.handle: Optional[Handle] = None
+        # (heartbeat it was captured for, task name, formatted stack)
+        self.captured: Optional[Tuple[float, str, str]] = None
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, name="loop-monitor", daemon=True
+        )
+
+        self.slow_callbacks = 0
+        self.max_blocked = 0.0
+
+    def start(self):
+        """
+        Call from the event loop's thread.
+        """
+        self.thread_id = threading.get_ident()
+        self.schedule()
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.handle is not None:
+            self.handle.cancel()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def schedule(self):
+        self.expected = monotonic() + self.interval
+        self.handle = self.loop.call_later(self.interval, self.beat)
+
+    def beat(self):
+        late = monotonic() - self.expected
+        captured, self.captured = self.captured, None
+        if late > self.threshold:
+            self.slow_callbacks += 1
+            self.max_blocked = max(self.max_blocked, late)
+            if captured is not None and captured[0] == self.expected:
+                _, task_name, stack = captured
+                report = f"in {task_name}, stack while blocked:\n{stack}"
+            else:
+                report = "(ended before its stack could be captured)"
+            self.on_slow(
+                f"[Loop monitor] A callback blocked the event loop for {late:.3f}s "
+                + report
+            )
+        self.schedule()
+
+    def _run(self):
+        while not self.stopping.wait(self.interval / 2):
+            expected = self.expected
+            if monotonic() - expected <= self.threshold:
+                continue
+            if self.captured is not None and self.captured[0] == expected:
+                continue  # Already captured this block
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = "".join(format_stack(frame))
+            self.captured = (expected, self.describe_task(), stack)
+
+    def describe_task(self) -> str:
+        task = current_task(self.loop)
+        if task is None:
+            return "a callback outside any task"
+        coro = task.get_coro()
+        name = getattr(coro, "__qualname__", repr(coro))
+        return f"task '{task.get_name()}' ({name})"
+
+    def stats(self) -> str:
+        return (
+            f"{self.slow_callbacks} callbacks over {self.threshold}s, "
+            f"longest {self.max_blocked:.3f}s"
+        )
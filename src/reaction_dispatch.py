@@ -0,0 +1,135 @@
+from asyncio import Task, create_task
+from asyncio import sleep as async_sleep
+from collections import deque
+from time import monotonic
+from typing import Deque, Dict, Iterable, List
+
+import nextcord
+
+from utils import do_log
+
+
+class ReactionJob:
+    __slots__ = ("message", "emojis", "queued", "deleted")
+
+    def __init__(self, message: nextcord.Message, emojis: List[str]):
+        self.message = message
+        self.emojis = emojis
+        self.queued = monotonic()
+        self.deleted = False
+
+
+class ReactionDispatcher:
+    """
+    Adds reactions in the background so listeners don't wait on them. Every channel has its own
+    FIFO queue and worker, and a worker adds at most one reaction per 'interval' seconds, matching
+    Discord's per-channel reaction rate limit instead of running into it. Queued reactions for
+    messages that get deleted are dropped without any API call.
+    """
+
+    def __init__(self, interval: float = 0.25, name: str = "reactions"):
+        self.interval = interval
+        self.name = name
+        self.queues: Dict[int, Deque[ReactionJob]] = {}
+        self.workers: Dict[int, Task] = {}
+        # A message can have several jobs, e.g. the rating reactions and a later repost mark
+        self.jobs: Dict[int, List[ReactionJob]] = {}
+
+        self.reactions = 0
+        self.completed = 0
+        self.dropped = 0
+        self.failures = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+
+    def enqueue(self, message: nextcord.Message, emojis: List[str]):
+        job = ReactionJob(message, emojis)
+        self.jobs.setdefault(message.id, []).append(job)
+        channel_id = message.channel.id
+        self.queues.setdefault(channel_id, deque()).append(job)
+        if channel_id not in self.workers:
+            self.workers[channel_id] = create_task(self.run_channel(channel_id))
+
+    def discard(self, message_ids: Iterable[int]):
+        """
+        Drops any queued (or partly done) reactions for deleted messages.
+        """
+        for message_id in message_ids:
+            for job in self.jobs.pop(message_id, []):
+                job.deleted = True
+
+    def depth(self) -> int:
+        return sum(len(jobs) for jobs in self.jobs.values())
+
+    def lag(self) -> float:
+        """
+        Seconds the oldest queued message has been waiting.
+        """
+        now = monotonic()
+        return max(
+            (now - queue[0].queued for queue in self.queues.values() if queue),
+            default=0.0,
+        )
+
+    def stats(self) -> str:
+        average_lag = self.total_lag / max(self.completed, 1)
+        return (
+            f"{self.depth()} queued ({self.lag():.1f}s oldest), {self.reactions} reactions on "
+            f"{self.completed} messages (lag avg {average_lag:.2f}s, max {self.max_lag:.2f}s), "
+            f"{self.dropped} dropped for deleted messages, {self.failures} failed"
+        )
+
+    async def run_channel(self, channel_id: int):
+        queue = self.queues[channel_id]
+        next_reaction = 0.0
+        try:
+            while queue:
+                job = queue[0]
+                reacted = False
+                for emoji in job.emojis:
+                    if job.deleted:
+                        break
+                    delay = next_reaction - monotonic()
+                    if delay > 0:
+                        await async_sleep(delay)
+                        if job.deleted:
+                            break
+                    next_reaction = monotonic() + self.interval
+                    try:
+                        await job.message.add_reaction(emoji)
+                    except nextcord.NotFound:
+                        job.deleted = True
+                    except nextcord.HTTPException as e:
+                        self.failures += 1
+                        do_log(
+                            f"[{self.name}] Could not add reaction to {job.message.id} ({e})"
+                        )
+                    else:
+                        self.reactions += 1
+                        if not reacted:
+                            reacted = True
+                            lag = monotonic() - job.queued
+                            self.total_lag += lag
+                            self.max_lag = max(self.max_lag, lag)
+                queue.popleft()
+                self.forget(job)
+                if job.deleted:
+                    self.dropped += 1
+                else:
+                    self.completed += 1
+        finally:
+            del self.workers[channel_id]
+            if not queue:
+                del self.queues[channel_id]
+
+    def forget(self, job: ReactionJob):
+        jobs = self.jobs.get(job.message.id)
+        if jobs is None:
+            return  # Discarded already
+        jobs.remove(job)
+        if not jobs:
+            del self.jobs[job.message.id]
+
+    def close(self):
+        for worker in list(self.workers.values()):
+            worker.cancel()
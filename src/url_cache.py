@@ -0,0 +1,126 @@
+import os
+from collections import OrderedDict
+from json import dump as json_dump
+from json import load as json_load
+from pathlib import Path
+from time import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from utils import do_log
+
+# Query parameters that only track where a link was shared from
+TRACKING_PARAMS = {"fbclid", "gclid", "igshid", "ref", "ref_src", "s", "si", "t"}
+
+
+def normalize_url(url: str) -> str:
+    """
+    Reduces a URL to a cache key: lowercased scheme and host without 'www.', no fragment, no
+    trailing slash, and sorted query parameters without tracking parameters.
+    """
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith("utm_")
+    )
+    path = parts.path.rstrip("/") if len(parts.path) > 1 else ""
+    return urlunsplit((parts.scheme.lower(), host, path, urlencode(query), ""))
+
+
+class UrlVerdictCache:
+    """
+    LRU cache of normalized URL -> has-media verdicts, each expiring after 'ttl' seconds. Failed
+    probes are cached as "no media" for the shorter 'failure_ttl' so a dead link isn't re-fetched
+    on every repost, but is retried eventually.
+
+    Entries are saved to and loaded from a JSON file so the cache survives restarts.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_entries: int = 10000,
+        ttl: float = 7 * 86400,
+        failure_ttl: float = 3600,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.entries: OrderedDict[str, Tuple[bool, float]] = OrderedDict()
+        self.dirty = False
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url: str) -> Optional[bool]:
+        """
+        Returns the cached verdict for a URL, or None if it isn't cached (or has expired).
+        """
+        key = normalize_url(url)
+        entry = self.entries.get(key)
+        if entry is None or entry[1] < time():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, url: str, verdict: Optional[bool]):
+        """
+        Caches a probe result; None means the probe failed.
+        """
+        ttl = self.failure_ttl if verdict is None else self.ttl
+        key = normalize_url(url)
+        self.entries[key] = (bool(verdict), time() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.dirty = True
+
+    def hit_rate(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def stats(self) -> str:
+        return (
+            f"{len(self.entries)} entries, {self.hits} hits, {self.misses} misses "
+            f"({self.hit_rate():.0%} hit rate)"
+        )
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as cache_file:
+                saved: Dict[str, List] = json_load(cache_file)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            do_log(f"Ignoring unreadable URL cache '{self.path}'")
+            return
+        now = time()
+        # Saved oldest first, so the least recently used entries are evicted first
+        for key, (verdict, expires) in saved.get("entries", {}).items():
+            if expires > now:
+                self.entries[key] = (verdict, expires)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        """
+        Writes the cache to a temporary file and swaps it in, so a crash mid-write can't leave a
+        truncated cache behind.
+        """
+        if not self.dirty:
+            return
+        self.dirty = False
+        snapshot = {"entries": dict(self.entries)}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as cache_file:
+            json_dump(snapshot, cache_file)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,136 @@
+from mimetypes import guess_type
+from re import Pattern
+from re import compile as regex_compile
+from re import error as regex_error
+from typing import Any, Dict, List, NamedTuple, Optional
+from urllib.parse import parse_qs, urlsplit
+
+MEDIA = "media"
+NOT_MEDIA = "not_media"
+PROBE = "probe"
+VERDICTS = (MEDIA, NOT_MEDIA, PROBE)
+
+MEDIA_MIME_TYPES = ("image", "video", "audio")
+# Downloads and documents that can't embed media. Other types (including server-side script
+# extensions such as .php, which serve pages) still need a probe.
+NOT_MEDIA_MIME_TYPES = (
+    "application/gzip",
+    "application/json",
+    "application/pdf",
+    "application/vnd.",
+    "application/x-7z",
+    "application/x-msdos-program",
+    "application/x-msdownload",
+    "application/x-rar",
+    "application/x-tar",
+    "application/zip",
+    "text/csv",
+    "text/plain",
+)
+
+# Checked after any rules from the config. Hosts match themselves and all of their subdomains;
+# for a host, the first rule whose path pattern and query parameter (if any) match wins.
+DEFAULT_RULES: List[Dict[str, str]] = [
+    {"host": "tenor.com", "path": r"^/view/", "verdict": MEDIA},
+    {"host": "media.tenor.com", "verdict": MEDIA},
+    {"host": "i.imgur.com", "verdict": MEDIA},
+    {
+        "host": "imgur.com",
+        "path": r"^/(a/|gallery/|[A-Za-z0-9]{5,8}$)",
+        "verdict": MEDIA,
+    },
+    {"host": "youtube.com", "path": r"^/watch$", "query": "v", "verdict": MEDIA},
+    {"host": "youtube.com", "path": r"^/(shorts|embed|live)/", "verdict": MEDIA},
+    {"host": "youtu.be", "path": r"^/.", "verdict": MEDIA},
+    {"host": "i.redd.it", "verdict": MEDIA},
+    {"host": "v.redd.it", "verdict": MEDIA},
+    {"host": "preview.redd.it", "verdict": MEDIA},
+    {
+        "host": "cdn.discordapp.com",
+        "path": r"^/(attachments|emojis)/",
+        "verdict": MEDIA,
+    },
+    {"host": "media.discordapp.net", "verdict": MEDIA},
+    {"host": "discord.gg", "verdict": NOT_MEDIA},
+    {"host": "discord.com", "path": r"^/(invite|channels)/", "verdict": NOT_MEDIA},
+    {"host": "discordapp.com", "path": r"^/(invite|channels)/", "verdict": NOT_MEDIA},
+    {"host": "twitter.com", "path": r"^/[^/]+/status/\d+", "verdict": MEDIA},
+    {"host": "x.com", "path": r"^/[^/]+/status/\d+", "verdict": MEDIA},
+    {"host": "gfycat.com", "path": r"^/.", "verdict": MEDIA},
+    {"host": "giphy.com", "path": r"^/(gifs|clips)/", "verdict": MEDIA},
+    {"host": "media.giphy.com", "verdict": MEDIA},
+    {"host": "streamable.com", "path": r"^/.", "verdict": MEDIA},
+    {"host": "clips.twitch.tv", "verdict": MEDIA},
+    {"host": "twitch.tv", "path": r"^/[^/]+/clip/", "verdict": MEDIA},
+    {"host": "tiktok.com", "path": r"/video/\d+", "verdict": MEDIA},
+    {"host": "vm.tiktok.com", "verdict": MEDIA},
+]
+
+
+class UrlRule(NamedTuple):
+    path: Optional[Pattern]
+    query: Optional[str]
+    verdict: str
+
+
+class UrlRules:
+    """
+    Classifies URLs as media, not media, or needing a probe, without any network access.
+
+    Rules are grouped by host, so a lookup only tries the rules of the URL's host and its parent
+    domains (most specific first) instead of every rule. URLs no rule matches fall back to their
+    file extension, and only if that is unknown too does the URL need probing.
+    """
+
+    def __init__(
+        self, rules: Optional[List[Dict[str, Any]]] = None, defaults: bool = True
+    ):
+        self.rules: Dict[str, List[UrlRule]] = {}
+        for rule in (rules or []) + (DEFAULT_RULES if defaults else []):
+            self.add(**rule)
+
+    def add(
+        self,
+        host: str,
+        verdict: str,
+        path: Optional[str] = None,
+        query: Optional[str] = None,
+    ):
+        if verdict not in VERDICTS:
+            raise ValueError(
+                f"Invalid verdict '{verdict}' for '{host}' (expected one of {VERDICTS})"
+            )
+        try:
+            pattern = regex_compile(path) if path else None
+        except regex_error as e:
+            # Not a ValueError, which is what callers check rules for
+            raise ValueError(f"Invalid path pattern '{path}' for '{host}' ({e})")
+        host = host.lower().strip(".")
+        if host.startswith("www."):
+            host = host[4:]
+        self.rules.setdefault(host, []).append(UrlRule(pattern, query, verdict))
+
+    def classify(self, url: str) -> str:
+        parts = urlsplit(url)
+        host = parts.hostname or ""
+        query: Optional[Dict[str, List[str]]] = None
+        while host:
+            for rule in self.rules.get(host, ()):
+                if rule.path is not None and not rule.path.search(parts.path):
+                    continue
+                if rule.query is not None:
+                    if query is None:
+                        query = parse_qs(parts.query)
+                    if rule.query not in query:
+                        continue
+                return rule.verdict
+            _, _, host = host.partition(".")
+
+        mime_type, _ = guess_type(parts.path)
+        if mime_type is None:
+            return PROBE
+        if mime_type.startswith(MEDIA_MIME_TYPES):
+            return MEDIA
+        if mime_type.startswith(NOT_MEDIA_MIME_TYPES):
+            return NOT_MEDIA
+        return PROBE
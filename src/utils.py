@@ -1,10 +1,25 @@
+import atexit
 import logging
+import sys
 from argparse import ArgumentParser
 from datetime import datetime
+from datetime import timezone as dt_timezone
+from functools import partial
+from json import JSONDecodeError
+from json import dumps as json_dumps
 from json import load as load_json
+from logging.handlers import (
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
 from math import floor
-from typing import Any, Dict, List, TextIO, Tuple, Union
+from pathlib import Path
+from queue import SimpleQueue
+from time import time
+from typing import Any, Dict, List, Optional, TextIO, Tuple, Union
 
+from nextcord import AllowedMentions
 from nextcord import Guild as DiscordGuild
 from nextcord import Intents as DiscordIntents
 from nextcord import Message as DiscordMessage
@@ -15,6 +30,14 @@ from nextcord import Webhook as DiscordWebhook
 from nextcord.ext.commands import Bot as DiscordBot
 from pytz import timezone
 
+from config_schema import ConfigError, validate_config
+from message_router import MessageRouter
+from metrics import Metrics
+
+EST_TIMEZONE = timezone("America/Toronto")
+UTC_TIMEZONE = timezone("UTC")
+EST_TIME_FORMAT = "%Y-%b-%d %I:%M:%S %p EST"
+
 
 class BotClass:
     def __init__(self):
@@ -36,13 +59,36 @@ class BotClass:
         self.logger.addHandler(self.handler)
 
         self.CFG: Dict[Any, Any] = {}
+        self.config_path = Path("config.json")
         self.guild = DiscordGuild
         self.channels: Dict[str, DiscordChannel] = {}
         self.roles: Dict[str, DiscordRole] = {}
+        self.metrics = Metrics()
+        self.router = MessageRouter(
+            on_error=log_error, observe=partial(self.metrics.observe, "route")
+        )
         self.ready = False
         do_log("Initialized Discord Client")
 
 
+def is_owner(bot_instance: BotClass, member: Any) -> bool:
+    """
+    Checks if 'member' is the configured bot owner.
+    """
+    return member.id == bot_instance.CFG.get("discord_bot_owner_id")
+
+
+def is_staff(bot_instance: BotClass, member: Any) -> bool:
+    """
+    Checks if 'member' is the bot owner or has one of the configured 'admin' or 'mod' roles.
+    """
+    if is_owner(bot_instance, member):
+        return True
+    staff_roles = [bot_instance.roles.get(name) for name in ("admin", "mod")]
+    member_roles = getattr(member, "roles", [])
+    return any(role is not None and role in member_roles for role in staff_roles)
+
+
 def censor_text(text: str, leave_uncensored: int = 4) -> str:
     """
     Censors the second half (excluding the last 'leave_uncensored' number of letters) for the
@@ -60,38 +106,184 @@ def get_est_time(datetime_to_convert: datetime = None) -> str:
     Gets the current time (or 'datetime_to_convert' arg, if provided) as datetime and converts it to a
     readable string
     """
-    desired_timezone = timezone("America/Toronto")
     if datetime_to_convert is not None:
-        input_timezone = timezone("UTC")
         if datetime_to_convert.tzinfo is not None:
             # TODO: Convert datetime tzinfo to pytz accordingly
             do_log("GET_EST_TIME ERROR, PLEASE IMPLEMENT CONVERTER")
             return "ERROR"
-        timezoned_datetime = input_timezone.localize(datetime_to_convert)
-        output_datetime = timezoned_datetime.astimezone(desired_timezone)
+        timezoned_datetime = UTC_TIMEZONE.localize(datetime_to_convert)
+        output_datetime = timezoned_datetime.astimezone(EST_TIMEZONE)
     else:
-        output_datetime = datetime.now(desired_timezone)
+        output_datetime = datetime.now(EST_TIMEZONE)
+
+    return output_datetime.strftime(EST_TIME_FORMAT)
+
+
+class EstFormatter(logging.Formatter):
+    def __init__(self, fmt: str):
+        super().__init__(fmt)
+        self.cached_second = -1
+        self.cached_time = ""
+
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None):
+        # Records mostly arrive in bursts, so the formatted time is reused within a second
+        second = int(record.created)
+        if second != self.cached_second:
+            self.cached_second = second
+            self.cached_time = datetime.fromtimestamp(second, EST_TIMEZONE).strftime(
+                EST_TIME_FORMAT
+            )
+        return self.cached_time
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        repeats = getattr(record, "repeats", 0)
+        if repeats:
+            message += f"\n(Repeated {repeats} more times before this)"
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, for tools that parse the log.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, dt_timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        repeats = getattr(record, "repeats", 0)
+        if repeats:
+            entry["repeats"] = repeats
+        return json_dumps(entry, ensure_ascii=False)
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Drops errors identical to one already logged in the last 'window' seconds. The next copy
+    logged after the window carries the number dropped in between as 'repeats'.
+    """
+
+    def __init__(self, window: float = 60.0, max_tracked: int = 1000):
+        super().__init__()
+        self.window = window
+        self.max_tracked = max_tracked
+        # message -> (time it was last logged, copies dropped since)
+        self.seen: Dict[str, Tuple[float, int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.ERROR:
+            return True
+        message = record.getMessage()
+        last = self.seen.get(message)
+        if last is not None and record.created - last[0] < self.window:
+            self.seen[message] = (last[0], last[1] + 1)
+            return False
+        if last is None and len(self.seen) >= self.max_tracked:
+            self.seen = {
+                key: value
+                for key, value in self.seen.items()
+                if record.created - value[0] < self.window
+            }
+        setattr(record, "repeats", last[1] if last is not None else 0)
+        self.seen[message] = (record.created, 0)
+        return True
+
 
-    return output_datetime.strftime("%Y-%b-%d %I:%M:%S %p EST")
+class LogListener(QueueListener):
+    """
+    Turns queued (time, level, message) tuples into log records on the listener thread, so the
+    caller doesn't pay for building a LogRecord either.
+    """
+
+    def __init__(self, log_queue: SimpleQueue, *handlers: logging.Handler):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.log_queue = log_queue
+        self.filters: List[logging.Filter] = []
+
+    def dequeue(self, block: bool) -> Any:
+        item = self.log_queue.get(block)
+        if not isinstance(item, tuple):  # The listener's stop sentinel
+            return item
+        created, level, message = item
+        record = logging.LogRecord("bot", level, "", 0, message, None, None)
+        record.created = created
+        return record
+
+    def handle(self, record: logging.LogRecord):
+        if all(log_filter.filter(record) for log_filter in self.filters):
+            super().handle(record)
+
+
+log_queue: Optional[SimpleQueue] = None
+
+
+def setup_logging(
+    error_log: str = "errors.log",
+    error_log_max_bytes: int = 5 * 1024 * 1024,
+    error_log_backups: int = 5,
+    json_log: str = "log.jsonl",
+    json_log_days: int = 14,
+    repeat_window: float = 60.0,
+) -> SimpleQueue:
+    """
+    Starts the thread that writes log messages: to the console, to 'error_log' for errors
+    (rotated by size) and as JSON lines to 'json_log' (rotated daily). From then on 'do_log' and
+    'log_error' only put messages on the returned queue, so logging costs the caller an enqueue.
+    Until it is called (in scripts and worker processes that only import this module), messages
+    are just printed.
+    """
+    global log_queue
+    if log_queue is not None:
+        return log_queue
+
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(EstFormatter("[%(asctime)s] %(message)s"))
+    error_handler = RotatingFileHandler(
+        error_log,
+        maxBytes=error_log_max_bytes,
+        backupCount=error_log_backups,
+        encoding="utf-8",
+        delay=True,
+    )
+    error_handler.setLevel(logging.ERROR)
+    error_handler.setFormatter(EstFormatter("[%(asctime)s]\n%(message)s"))
+    error_handler.terminator = "\n\n"
+    json_handler = TimedRotatingFileHandler(
+        json_log,
+        when="midnight",
+        backupCount=json_log_days,
+        encoding="utf-8",
+        delay=True,
+        utc=True,
+    )
+    json_handler.setFormatter(JsonFormatter())
 
+    log_queue = SimpleQueue()
+    listener = LogListener(log_queue, console_handler, error_handler, json_handler)
+    listener.filters.append(RepeatFilter(repeat_window))
+    listener.start()
+    atexit.register(listener.stop)  # Writes out whatever is still queued
+    return log_queue
 
-def do_log(message: str):
-    print(f"[{get_est_time()}] {message}")
+
+def do_log(message: str, level: int = logging.INFO):
+    if log_queue is None:
+        print(f"[{get_est_time()}] {message}")
+        return
+    log_queue.put((time(), level, message))
 
 
 def log_error(error: str):
     if "KeyboardInterrupt" in error:
         raise KeyboardInterrupt
-    error_message = f"[{get_est_time()}]\n{error}"
-    error_log_filename = "errors.log"
-    try:
-        with open(error_log_filename, "a") as error_log:
-            error_log.write(error_message)
-    except FileNotFoundError:
-        with open(error_log_filename, "w") as error_log:
-            error_message = f"[{get_est_time()}] WARNING: Failed to find existing error log. Writing to new.\n\n{error}"
-            error_log.write(error_message)
-    do_log(error_message)
+    if log_queue is None:
+        print(f"[{get_est_time()}]\n{error}", file=sys.stderr)
+        return
+    log_queue.put((time(), logging.ERROR, error))
 
 
 def json_eval_object_pairs_hook(ordered_pairs: List[Tuple[Any, Any]]) -> Dict:
@@ -143,6 +335,28 @@ async def get_hook_in_server(
     return found_hook
 
 
+async def send_lines(
+    destination: Any,
+    lines: List[str],
+    limit: int = 2000,
+    allowed_mentions: Optional[AllowedMentions] = None,
+):
+    """
+    Sends 'lines' in as few messages as possible without exceeding Discord's length limit, and
+    (unless 'allowed_mentions' says otherwise) without pinging anyone mentioned in them.
+    """
+    if allowed_mentions is None:
+        allowed_mentions = AllowedMentions.none()
+    response = ""
+    for line in lines:
+        if response and len(response) + len(line) + 1 > limit:
+            await destination.send(response, allowed_mentions=allowed_mentions)
+            response = ""
+        response += line[: limit - 1] + "\n"
+    if response:
+        await destination.send(response, allowed_mentions=allowed_mentions)
+
+
 async def get_english_timestamp(time_var: Union[int, float]) -> str:
     """
     Takes in a time, in seconds, and converts it to a readable string representing
@@ -171,15 +385,35 @@ async def get_english_timestamp(time_var: Union[int, float]) -> str:
     )
 
 
+def read_config(path: Path) -> Dict[Any, Any]:
+    """
+    Loads and validates a config file, raising ConfigError listing every problem found. Warnings
+    (such as unknown settings) are logged.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as config_file:
+            loaded_config = json_load_eval(config_file)
+    except JSONDecodeError as e:
+        raise ConfigError([f"'{path}' is not valid JSON ({e})"])
+    if not isinstance(loaded_config, dict):
+        raise ConfigError([f"'{path}' should contain a JSON object"])
+    problems, warnings = validate_config(loaded_config)
+    for warning in warnings:
+        do_log(f"[Config] {warning}", logging.WARNING)
+    if problems:
+        raise ConfigError(problems)
+    return loaded_config
+
+
 def load_config_to_bot(bot_instance: BotClass) -> BotClass:
     parser = ArgumentParser(description="Discord bot arguments.")
     parser.add_argument(
         "--config", help="Filepath for the config JSON file", default="config.json"
     )
     args = parser.parse_args()
+    bot_instance.config_path = Path(args.config)
     try:
-        with open(args.config, "r", encoding="utf-8") as config_file:
-            loaded_config = json_load_eval(config_file)
+        loaded_config = read_config(bot_instance.config_path)
     except FileNotFoundError:
         raise FileNotFoundError(f"'{args.config}' not found.")
     for config_key in loaded_config:
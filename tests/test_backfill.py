@@ -0,0 +1,26 @@
+import asyncio
+from time import monotonic
+
+from backfill import RateLimiter
+
+
+def test_limiter_spaces_requests_past_the_burst():
+    async def run():
+        limiter = RateLimiter(50.0, burst=2)
+        start = monotonic()
+        for _ in range(4):
+            await limiter.acquire()
+        # Two from the burst, then one every 20 ms
+        assert monotonic() - start >= 0.035
+
+    asyncio.run(run())
+
+
+def test_zero_rate_is_unlimited():
+    async def run():
+        limiter = RateLimiter(0.0)
+        await asyncio.wait_for(
+            asyncio.gather(*(limiter.acquire() for _ in range(100))), timeout=1
+        )
+
+    asyncio.run(run())
@@ -0,0 +1,228 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from typing import Any, Dict, List, Set
+
+import pytest
+
+from cogs.config_reload import ConfigReload
+from config_schema import ConfigError, changed_settings, validate_config
+from utils import read_config
+
+
+def make_settings(**settings: Any) -> Dict[str, Any]:
+    return {
+        "discord_bot_owner_id": 1,
+        "discord_channel_ids": {"general": 10, "media": 11},
+        "discord_guild_id": 2,
+        "discord_role_ids": {"admin": 20},
+        **settings,
+    }
+
+
+def test_valid_config_has_no_problems():
+    problems, warnings = validate_config(
+        make_settings(
+            media_rate_channels=["media"],
+            message_log_backfill_rps=2.5,
+            custom_invite_format="{member_name} joined from {invite_name}",
+        )
+    )
+    assert problems == [] and warnings == []
+
+
+def test_missing_required_settings():
+    problems, _ = validate_config({"discord_guild_id": 2})
+    assert problems == [
+        "'discord_bot_owner_id' is missing",
+        "'discord_channel_ids' is missing",
+        "'discord_role_ids' is missing",
+    ]
+
+
+def test_wrong_types_and_negative_numbers():
+    problems, _ = validate_config(
+        make_settings(
+            message_log="yes",
+            message_log_batch_size=True,
+            message_log_flush_interval=-1.5,
+            media_rate_cache_size=-1,
+            config_watch_interval=0,
+        )
+    )
+    assert problems == [
+        "'message_log' should be true or false, not a string",
+        "'message_log_batch_size' should be a whole number, not true or false",
+        "'message_log_flush_interval' can't be negative",
+        "'media_rate_cache_size' can't be negative",
+    ]
+
+
+def test_ids_must_be_numbers():
+    problems, _ = validate_config(
+        make_settings(discord_channel_ids={"general": "10"}, discord_role_ids={})
+    )
+    assert problems == ["'discord_channel_ids': 'general' should be an ID"]
+
+
+def test_unknown_settings_and_channels_are_warnings():
+    problems, warnings = validate_config(
+        make_settings(
+            media_rate_chanels=["media"],
+            media_rate_channels=["media", "memes"],
+            custom_invite_channel="welcome",
+        )
+    )
+    assert problems == []
+    assert warnings == [
+        "'media_rate_chanels' is not a known setting",
+        "'media_rate_channels': 'memes' is not in 'discord_channel_ids'",
+        "'custom_invite_channel': 'welcome' is not in 'discord_channel_ids'",
+    ]
+
+
+def test_invite_format_and_messages():
+    problems, _ = validate_config(
+        make_settings(
+            custom_invite_format="{member_name} via {inviter}",
+            custom_invite_messages={"abc": 5},
+        )
+    )
+    assert problems == [
+        "'custom_invite_messages': 'abc' should be a string",
+        "'custom_invite_format': unknown fields inviter"
+        " (only member_name and invite_name are filled in)",
+    ]
+    problems, _ = validate_config(make_settings(custom_invite_format="{member_name"))
+    assert len(problems) == 1
+    assert problems[0].startswith("'custom_invite_format': ")
+
+
+def test_bad_url_rules():
+    problems, _ = validate_config(
+        make_settings(media_rate_url_rules=[{"host": "a.com", "verdict": "maybe"}])
+    )
+    assert len(problems) == 1
+    assert problems[0].startswith("'media_rate_url_rules': ")
+
+
+def test_bad_url_rule_pattern_is_a_problem(tmp_path):
+    settings = make_settings(
+        media_rate_url_rules=[{"host": "a.com", "path": "^/(", "verdict": "media"}]
+    )
+    problems, _ = validate_config(settings)
+    assert len(problems) == 1
+    assert problems[0].startswith(
+        "'media_rate_url_rules': Invalid path pattern '^/(' for 'a.com'"
+    )
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps(settings))
+    with pytest.raises(ConfigError):
+        read_config(config_path)
+
+
+def test_changed_settings_includes_added_and_removed_keys():
+    old = {"a": 1, "b": 2, "c": 3}
+    new = {"a": 1, "b": 5, "d": 4}
+    assert changed_settings(old, new) == {"b", "c", "d"}
+
+
+class FakeGuild:
+    def get_channel(self, channel_id: int):
+        return SimpleNamespace(id=channel_id)
+
+    def get_role(self, role_id: int):
+        return SimpleNamespace(id=role_id)
+
+
+def make_reload_cog(tmp_path, fail_once: bool):
+    """
+    Call inside a running event loop.
+    """
+    config_path = tmp_path / "config.json"
+    settings = make_settings(config_watch_interval=0)
+    config_path.write_text(json.dumps(settings))
+    bot = SimpleNamespace(
+        CFG=settings,
+        channels={},
+        roles={},
+        guild=FakeGuild(),
+        config_path=config_path,
+    )
+    applied: List[Dict[str, Any]] = []
+
+    async def apply_config(changed: Set[str]) -> List[str]:
+        applied.append(bot.CFG)
+        if fail_once and len(applied) == 1:
+            raise RuntimeError("cog failed to start")
+        return []
+
+    cog = ConfigReload(bot, apply_config)
+    cog.watch_task.cancel()
+    return cog, applied
+
+
+def test_reload_swaps_in_a_valid_config(tmp_path):
+    async def run():
+        cog, applied = make_reload_cog(tmp_path, fail_once=False)
+        cog.bot.config_path.write_text(
+            json.dumps(make_settings(config_watch_interval=0, message_log=True))
+        )
+        lines = await cog.reload()
+        assert lines[0].startswith("Applied the new config")
+        assert cog.bot.CFG["message_log"] is True
+        assert cog.bot.channels["media"].id == 11
+        assert len(applied) == 1
+
+    asyncio.run(run())
+
+
+def test_reload_keeps_the_old_config_if_applying_fails(tmp_path, capsys):
+    async def run():
+        cog, applied = make_reload_cog(tmp_path, fail_once=True)
+        old_settings = cog.bot.CFG
+        cog.bot.config_path.write_text(
+            json.dumps(make_settings(config_watch_interval=0, message_log=True))
+        )
+        lines = await cog.reload()
+        assert lines == ["Kept the current config, applying the new one failed"]
+        assert cog.bot.CFG is old_settings
+        assert cog.bot.channels == {}
+        # Applied once with the new settings, then again with the old ones
+        assert [settings.get("message_log") for settings in applied] == [True, None]
+
+    asyncio.run(run())
+    assert "cog failed to start" in capsys.readouterr().err
+
+
+def test_reload_refuses_restart_settings(tmp_path):
+    async def run():
+        cog, applied = make_reload_cog(tmp_path, fail_once=False)
+        cog.bot.config_path.write_text(
+            json.dumps(make_settings(config_watch_interval=0, metrics_port=9000))
+        )
+        lines = await cog.reload()
+        assert lines == [
+            "Kept the current config, metrics_port can only change with a restart"
+        ]
+        assert applied == []
+
+    asyncio.run(run())
+
+
+def test_reload_keeps_the_old_config_if_a_url_rule_is_broken(tmp_path):
+    async def run():
+        cog, applied = make_reload_cog(tmp_path, fail_once=False)
+        old_settings = cog.bot.CFG
+        rules = [{"host": "a.com", "path": "[", "verdict": "media"}]
+        cog.bot.config_path.write_text(
+            json.dumps(
+                make_settings(config_watch_interval=0, media_rate_url_rules=rules)
+            )
+        )
+        lines = await cog.reload()
+        assert lines[0] == "Kept the current config, the new one is invalid:"
+        assert cog.bot.CFG is old_settings
+        assert applied == []
+
+    asyncio.run(run())
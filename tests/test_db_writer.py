@@ -0,0 +1,199 @@
+import asyncio
+import sqlite3
+from asyncio import create_task
+from time import sleep
+from typing import Any, List
+
+import pytest
+
+from db_writer import BatchedWriter
+
+
+def insert_values(cursor: sqlite3.Cursor, items: List[Any]):
+    cursor.executemany("INSERT INTO items (value) VALUES (?)", [(i,) for i in items])
+
+
+def make_writer(tmp_path, **kwargs: Any) -> BatchedWriter:
+    writer = BatchedWriter(tmp_path / "test.sqlite", {"item": insert_values}, **kwargs)
+    connection = writer.connect()
+    connection.execute("CREATE TABLE items (value INTEGER)")
+    connection.commit()
+    connection.close()
+    writer.start()
+    return writer
+
+
+def stored(writer: BatchedWriter) -> List[int]:
+    connection = writer.connect()
+    rows = connection.execute("SELECT value FROM items ORDER BY rowid").fetchall()
+    connection.close()
+    return [value for (value,) in rows]
+
+
+def test_flush_commits_everything_queued(tmp_path):
+    async def run():
+        writer = make_writer(tmp_path, batch_size=1000, flush_interval=60)
+        await writer.put_many("item", range(10))
+        writer.submit("item", 10)
+        await writer.flush()
+        assert stored(writer) == list(range(11))
+        writer.close()
+
+    asyncio.run(run())
+
+
+def test_full_batch_commits_without_flush(tmp_path):
+    async def run():
+        writer = make_writer(tmp_path, batch_size=5, flush_interval=60)
+        await writer.put_many("item", range(5))
+        for _ in range(100):
+            if writer.committed_items == 5:
+                break
+            await asyncio.sleep(0.01)
+        assert stored(writer) == list(range(5))
+        writer.close()
+
+    asyncio.run(run())
+
+
+def test_old_batch_commits_after_flush_interval(tmp_path):
+    async def run():
+        writer = make_writer(tmp_path, batch_size=1000, flush_interval=0.05)
+        await writer.put("item", 1)
+        await asyncio.sleep(0.3)
+        assert stored(writer) == [1]
+        writer.close()
+
+    asyncio.run(run())
+
+
+def test_call_runs_after_earlier_items(tmp_path):
+    async def run():
+        writer = make_writer(tmp_path, batch_size=1000, flush_interval=60)
+        await writer.put_many("item", [1, 2, 3])
+        count = await writer.call(
+            lambda cursor: cursor.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        )
+        assert count == 3
+        writer.close()
+
+    asyncio.run(run())
+
+
+def test_close_commits_pending_items(tmp_path):
+    async def run():
+        writer = make_writer(tmp_path, batch_size=1000, flush_interval=60)
+        await writer.put_many("item", range(50))
+        writer.close()
+        assert stored(writer) == list(range(50))
+        assert writer.dropped_items == 0
+
+    asyncio.run(run())
+
+
+def test_put_blocking_before_close_is_committed(tmp_path):
+    writer = make_writer(tmp_path, batch_size=2, flush_interval=60, max_queue=2)
+    writer.put_blocking("item", range(10))
+    writer.close()
+    assert stored(writer) == list(range(10))
+
+
+def test_writes_after_close_are_reported_not_queued(tmp_path, capsys):
+    async def run():
+        writer = make_writer(tmp_path)
+        writer.close()
+        await writer.put("item", 1)
+        writer.submit("item", 2)
+        with pytest.raises(RuntimeError):
+            await writer.call(lambda cursor: None)
+        assert writer.dropped_items == 2
+        assert writer.queue.empty()
+        assert stored(writer) == []
+
+    asyncio.run(run())
+    assert "Dropped 1 'item' items" in capsys.readouterr().err
+
+
+def test_close_is_idempotent(tmp_path):
+    writer = make_writer(tmp_path)
+    writer.close()
+    writer.close()
+    assert not writer.thread.is_alive()
+
+
+def test_full_queue_delays_instead_of_dropping(tmp_path):
+    async def run():
+        writer = make_writer(tmp_path, batch_size=2, flush_interval=60, max_queue=2)
+        for value in range(20):
+            writer.submit("item", value)
+        await writer.put_many("item", range(20, 30))
+        await writer.flush()
+        assert sorted(stored(writer)) == list(range(30))
+        assert writer.dropped_items == 0
+        writer.close()
+
+    asyncio.run(run())
+
+
+def test_resize_queue_lets_waiting_puts_in(tmp_path):
+    async def run():
+        writer = make_writer(tmp_path, batch_size=1000, flush_interval=60, max_queue=1)
+        writer.resize_queue(100)
+        await writer.put_many("item", range(50))
+        assert writer.queue.maxsize == 100
+        await writer.flush()
+        assert stored(writer) == list(range(50))
+        writer.close()
+
+    asyncio.run(run())
+
+
+def test_waiting_puts_leave_worker_threads_free(tmp_path):
+    async def run():
+        writer = make_writer(tmp_path, batch_size=1000, flush_interval=60, max_queue=2)
+        busy = create_task(writer.call(lambda cursor: sleep(0.5)))
+        await asyncio.sleep(0.05)  # The writer thread is now stuck in the call
+        waiting = [create_task(writer.put("item", value)) for value in range(100)]
+        for value in range(100, 200):
+            writer.submit("item", value)
+        # Waiting puts used to hold executor threads, starving reads like this one
+        await asyncio.wait_for(asyncio.to_thread(lambda: None), timeout=0.2)
+        await asyncio.gather(busy, *waiting)
+        await writer.flush()
+        assert sorted(stored(writer)) == list(range(200))
+        # Submitted items keep their order
+        assert [value for value in stored(writer) if value >= 100] == list(
+            range(100, 200)
+        )
+        writer.close()
+
+    asyncio.run(run())
+
+
+def test_close_writes_submitted_overflow(tmp_path):
+    async def run():
+        writer = make_writer(tmp_path, batch_size=1000, flush_interval=60, max_queue=2)
+        for value in range(20):
+            writer.submit("item", value)
+        writer.close()
+        assert stored(writer) == list(range(20))
+        assert writer.dropped_items == 0
+
+    asyncio.run(run())
+
+
+def test_close_reports_puts_still_waiting(tmp_path):
+    async def run():
+        writer = make_writer(tmp_path, batch_size=1000, flush_interval=60, max_queue=1)
+        busy = create_task(writer.call(lambda cursor: sleep(0.2)))
+        await asyncio.sleep(0.05)
+        await writer.put("item", 1)
+        waiting = create_task(writer.put("item", 2))
+        await asyncio.sleep(0.01)
+        writer.close()
+        await asyncio.wait_for(waiting, timeout=1)
+        await busy
+        assert stored(writer) == [1]
+        assert writer.dropped_items == 1
+
+    asyncio.run(run())
@@ -0,0 +1,234 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from time import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from cogs.invite_check import InviteCheck
+from invite_state import InviteRecord
+
+
+class FakeChannel:
+    def __init__(self):
+        self.sent: List[str] = []
+
+    async def send(self, content: str, **kwargs: Any):
+        self.sent.append(content)
+
+
+class FakeGuild:
+    def __init__(self):
+        self.current_invites: List[Any] = []
+        self.members: List[Any] = []
+
+    async def invites(self) -> List[Any]:
+        return self.current_invites
+
+
+def make_invite(code: str, uses: int, max_uses: int = 0, inviter_id: int = 1):
+    return SimpleNamespace(
+        code=code,
+        uses=uses,
+        max_uses=max_uses,
+        inviter=SimpleNamespace(id=inviter_id),
+        expires_at=None,
+        max_age=0,
+        created_at=None,
+    )
+
+
+def make_member(member_id: int, joined: Optional[float] = None):
+    joined_at = datetime.fromtimestamp(joined or time(), timezone.utc)
+    return SimpleNamespace(id=member_id, mention=f"<@{member_id}>", joined_at=joined_at)
+
+
+def make_cog(settings: Optional[Dict[str, Any]] = None) -> InviteCheck:
+    """
+    Call inside a running event loop, from a temporary working directory.
+    """
+    channel = FakeChannel()
+    bot = SimpleNamespace(
+        CFG={
+            "custom_invite_attempts": 1,
+            "custom_invite_format": "{member_name} joined from {invite_name}",
+            **(settings or {}),
+        },
+        channels={"welcome": channel},
+        guild=FakeGuild(),
+    )
+    cog = InviteCheck(bot)
+    # The tests drive reconciliation and snapshots themselves
+    cog.reconcile_task.cancel()
+    cog.snapshot_task.cancel()
+    return cog
+
+
+def welcomes(cog: InviteCheck) -> List[str]:
+    return "".join(cog.welcome_channel.sent).splitlines()
+
+
+def test_single_use_invite_deleted_at_join_is_attributed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        cog = make_cog()
+        cog.state_current = True
+        cog.invite_state.add(InviteRecord("once", 0, 1, 7))
+        await cog.on_invite_delete(SimpleNamespace(code="once"))
+        await cog.welcome_members([make_member(100)])
+        assert welcomes(cog) == ["<@100> joined from <@7>'s invite (once)"]
+        assert cog.deleted_invites == []
+
+    asyncio.run(run())
+
+
+def test_old_delete_is_not_attributed_to_a_later_join(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        cog = make_cog()
+        cog.state_current = True
+        cog.invite_state.add(InviteRecord("open", 3, 0, 8))
+        # Deleted by hand a minute before anyone joined
+        cog.deleted_invites.append((time() - 60, InviteRecord("once", 0, 1, 7)))
+        cog.bot.guild.current_invites = [make_invite("open", 4, inviter_id=8)]
+        await cog.welcome_members([make_member(100)])
+        assert welcomes(cog) == ["<@100> joined from <@8>'s invite (open)"]
+        assert cog.deleted_invites == []
+
+    asyncio.run(run())
+
+
+def test_recent_delete_waits_for_the_next_join(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        cog = make_cog()
+        cog.invite_state.add(InviteRecord("once", 0, 1, 7))
+        await cog.on_invite_delete(SimpleNamespace(code="once"))
+        assert len(cog.deleted_invites) == 1
+        used = cog.find_used_invites([], [make_member(100, time() - 30)])
+        assert used == []
+        assert len(cog.deleted_invites) == 1
+
+    asyncio.run(run())
+
+
+def test_vanished_single_use_invite_is_counted_as_used(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        cog = make_cog()
+        cog.invite_state.add(InviteRecord("once", 0, 1, 7))
+        used = cog.find_used_invites([], [make_member(100)])
+        assert [record.code for record in used] == ["once"]
+
+    asyncio.run(run())
+
+
+def test_vanished_expired_invite_is_not_counted_as_used(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        cog = make_cog()
+        cog.invite_state.add(InviteRecord("expired", 0, 1, 7, expires_at=time() - 5))
+        cog.invite_state.add(InviteRecord("open", 3, 0, 8))
+        used = cog.find_used_invites(
+            [make_invite("open", 4, inviter_id=8)], [make_member(100)]
+        )
+        assert [record.code for record in used] == ["open"]
+
+    asyncio.run(run())
+
+
+def test_expired_invite_delete_is_not_kept(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        cog = make_cog()
+        cog.invite_state.add(InviteRecord("expired", 0, 1, 7, expires_at=time() - 5))
+        await cog.on_invite_delete(SimpleNamespace(code="expired"))
+        assert cog.deleted_invites == []
+
+    asyncio.run(run())
+
+
+def write_snapshot(tmp_path, saved_at: float, invites: Dict[str, List[Any]]):
+    (tmp_path / "data").mkdir()
+    with open(tmp_path / "data" / "invite_snapshot.json", "w") as snapshot_file:
+        json.dump({"saved_at": saved_at, "invites": invites}, snapshot_file)
+
+
+def test_fresh_snapshot_is_used_as_the_baseline(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # Snapshots from before expiry times were saved have three fields per invite
+    write_snapshot(tmp_path, time() - 10, {"open": [3, 0, 8]})
+
+    async def run():
+        cog = make_cog()
+        assert cog.state_current
+        cog.bot.guild.current_invites = [make_invite("open", 4, inviter_id=8)]
+        await cog.welcome_members([make_member(100)])
+        assert welcomes(cog) == ["<@100> joined from <@8>'s invite (open)"]
+
+    asyncio.run(run())
+
+
+def test_stale_snapshot_skips_attribution_until_refetched(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_snapshot(tmp_path, time() - 7200, {"open": [3, 0, 8, None]})
+    snapshot_path = tmp_path / "data" / "invite_snapshot.json"
+
+    async def run():
+        cog = make_cog({"custom_invite_gap_limit": 3600})
+        assert not cog.state_current
+        cog.save_snapshot()
+        assert json.loads(snapshot_path.read_text())["saved_at"] < time() - 3600
+
+        # Dozens of uses happened while the bot was down; none of them are this member's
+        cog.bot.guild.current_invites = [make_invite("open", 40, inviter_id=8)]
+        await cog.welcome_members([make_member(100)])
+        assert welcomes(cog) == ["<@100> joined from an unknown invite"]
+        assert cog.state_current
+        assert cog.invite_state.get("open").uses == 40
+
+        cog.bot.guild.current_invites = [make_invite("open", 41, inviter_id=8)]
+        await cog.welcome_members([make_member(101)])
+        assert welcomes(cog)[-1] == "<@101> joined from <@8>'s invite (open)"
+
+    asyncio.run(run())
+
+
+def test_no_snapshot_waits_for_the_first_fetch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        cog = make_cog()
+        assert not cog.state_current
+        cog.bot.guild.current_invites = [make_invite("open", 40, inviter_id=8)]
+        await cog.reconcile_invites()
+        assert cog.state_current
+        cog.bot.guild.current_invites = [make_invite("open", 41, inviter_id=8)]
+        await cog.welcome_members([make_member(100)])
+        assert welcomes(cog) == ["<@100> joined from <@8>'s invite (open)"]
+
+    asyncio.run(run())
+
+
+def test_member_without_joined_at_uses_the_time_it_was_queued(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        cog = make_cog()
+        cog.join_window = 60  # Keep the window from running
+        member = SimpleNamespace(id=100, mention="<@100>", joined_at=None)
+        await cog.on_member_join(member)
+        assert cog.join_time(member) == cog.queued_at[100]
+        # Queued a minute before the invite was deleted, so it can't have used it up
+        cog.queued_at[100] -= 60
+        cog.deleted_invites.append((time(), InviteRecord("once", 0, 1, 7)))
+        assert cog.find_used_invites([], [member]) == []
+        cog.join_task.cancel()
+
+    asyncio.run(run())
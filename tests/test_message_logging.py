@@ -0,0 +1,43 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Any, Dict, List, Tuple
+
+from cogs.message_logging import MessageLogging
+
+
+class FakeWriter:
+    def __init__(self):
+        self.items: List[Tuple[str, Any]] = []
+
+    async def put(self, kind: str, item: Any):
+        self.items.append((kind, item))
+
+
+def edit_revisions(data: Dict[str, Any]) -> List[Any]:
+    # Only the listener's own attributes are needed, not a whole cog
+    cog = SimpleNamespace(
+        disabled=False,
+        bot=SimpleNamespace(guild=SimpleNamespace(id=1)),
+        writer=FakeWriter(),
+    )
+    payload = SimpleNamespace(guild_id=1, message_id=10, channel_id=5, data=data)
+    asyncio.run(MessageLogging.on_raw_message_edit(cog, payload))
+    return [item for _, item in cog.writer.items]
+
+
+def test_edits_are_stored_at_their_edit_time():
+    revisions = edit_revisions(
+        {"content": "fixed", "edited_timestamp": "2022-03-01T12:00:00+00:00"}
+    )
+    assert revisions == [(10, 5, 1646136000.0, "edit", "fixed", None)]
+
+
+def test_late_link_previews_are_embed_revisions():
+    embed = {"type": "link", "url": "https://example.com"}
+    revisions = edit_revisions({"content": "https://example.com", "embeds": [embed]})
+    assert len(revisions) == 1
+    assert revisions[0][3:] == ("embed", None, {"embeds": [embed]})
+
+
+def test_updates_without_edits_or_embeds_are_skipped():
+    assert edit_revisions({"pinned": True}) == []
@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+from typing import List, Tuple
+
+from message_router import MessageRouter
+
+
+def make_message(channel_id: int = 1, content: str = "hello", bot: bool = False):
+    return SimpleNamespace(
+        channel=SimpleNamespace(id=channel_id),
+        author=SimpleNamespace(bot=bot),
+        content=content,
+    )
+
+
+def record(calls: List[str], name: str):
+    async def handle(message):
+        calls.append(name)
+
+    return handle
+
+
+def routed(router: MessageRouter, message) -> List[str]:
+    return [route.name for route in router.route(message)]
+
+
+def test_channel_routes_only_see_their_channels():
+    router = MessageRouter(on_error=print)
+    calls: List[str] = []
+    router.add("media", record(calls, "media"), channel_ids=[1, 2])
+    router.add("other", record(calls, "other"), channel_ids=[3])
+    assert routed(router, make_message(channel_id=2)) == ["media"]
+    assert routed(router, make_message(channel_id=3)) == ["other"]
+    assert routed(router, make_message(channel_id=4)) == []
+
+
+def test_catch_all_routes_keep_the_order_they_were_added_in():
+    router = MessageRouter(on_error=print)
+    calls: List[str] = []
+    router.add("first", record(calls, "first"))
+    router.add("media", record(calls, "media"), channel_ids=[1])
+    router.add("last", record(calls, "last"))
+    assert routed(router, make_message(channel_id=1)) == ["first", "media", "last"]
+    assert routed(router, make_message(channel_id=2)) == ["first", "last"]
+
+
+def test_prefix_and_bot_filters():
+    router = MessageRouter(on_error=print)
+    calls: List[str] = []
+    router.add("commands", record(calls, "commands"), prefixes=["/", "!"])
+    router.add("humans", record(calls, "humans"), allow_bots=False)
+    assert routed(router, make_message(content="/help")) == ["commands", "humans"]
+    assert routed(router, make_message(content="!help", bot=True)) == ["commands"]
+    assert routed(router, make_message(content="hi", bot=True)) == []
+
+
+def test_adding_a_name_again_replaces_the_route():
+    router = MessageRouter(on_error=print)
+    calls: List[str] = []
+    router.add("media", record(calls, "media"), channel_ids=[1])
+    router.add("media", record(calls, "media"), channel_ids=[2])
+    assert routed(router, make_message(channel_id=1)) == []
+    assert routed(router, make_message(channel_id=2)) == ["media"]
+    router.remove("media")
+    assert routed(router, make_message(channel_id=2)) == []
+
+
+def test_dispatch_runs_routes_and_reports_errors():
+    calls: List[str] = []
+    observed: List[Tuple[str, bool]] = []
+    router = MessageRouter(
+        on_error=calls.append,
+        observe=lambda name, seconds, failed: observed.append((name, failed)),
+    )
+
+    async def broken(message):
+        raise ValueError("broken handler")
+
+    router.add("broken", broken)
+    router.add("works", record(calls, "works"))
+
+    async def run():
+        await router.dispatch(make_message())
+
+    asyncio.run(run())
+    assert calls[0].startswith("[Uncaught Error] (broken)")
+    assert "ValueError: broken handler" in calls[0]
+    assert calls[1:] == ["works"]
+    assert observed == [("broken", True), ("works", False)]
+    assert router.messages == 1 and router.unrouted == 0
@@ -0,0 +1,43 @@
+import sqlite3
+
+from message_store import build_search_query, fts_query, insert_message_records, migrate
+
+
+def make_db() -> sqlite3.Connection:
+    connection = sqlite3.connect(":memory:")
+    migrate(connection)
+    return connection
+
+
+def checkpoints(connection: sqlite3.Connection):
+    return dict(connection.execute("SELECT * FROM channel_checkpoints").fetchall())
+
+
+def test_fts_query_quotes_words_and_keeps_prefixes():
+    assert fts_query('cat* "dog" OR') == '"cat"* """dog""" "OR"'
+
+
+def test_fts_query_of_only_wildcards_is_empty():
+    assert fts_query("* ** *") == ""
+
+
+def test_search_query_finds_messages():
+    connection = make_db()
+    insert_message_records(
+        connection.cursor(),
+        [(10, 1.0, 5, 7, "hello world", None), (11, 2.0, 5, 8, "goodbye", None)],
+    )
+    sql, params = build_search_query("hello", author_id=7)
+    rows = connection.execute(sql, params).fetchall()
+    assert [row[0] for row in rows] == [10]
+
+
+def test_insert_advances_checkpoints_unless_told_not_to():
+    connection = make_db()
+    cursor = connection.cursor()
+    insert_message_records(cursor, [(10, 1.0, 5, 7, "a", None)])
+    insert_message_records(
+        cursor, [(20, 2.0, 5, 7, "b", None)], advance_checkpoints=False
+    )
+    assert checkpoints(connection) == {5: 10}
+    assert connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 2
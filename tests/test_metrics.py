@@ -0,0 +1,36 @@
+import asyncio
+from typing import Any, List, Optional
+
+from nextcord.ext import commands
+
+from metrics import Metrics
+
+
+class JoinCog(commands.Cog):
+    def __init__(self):
+        self.observe: Optional[Any] = None
+        self.joins: List[int] = []
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member_id: int):
+        self.joins.append(member_id)
+
+    def process_window(self):
+        if self.observe is not None:
+            self.observe("job", "welcome_members", 0.2, False)
+
+
+def test_instrumented_cog_times_listeners_and_its_own_jobs():
+    metrics = Metrics()
+    cog = metrics.instrument_cog(JoinCog())
+    asyncio.run(cog.on_member_join(5))
+    cog.process_window()
+    assert cog.joins == [5]
+    assert metrics.handlers[("listener", "JoinCog.on_member_join")].calls == 1
+    job = metrics.handlers[("job", "JoinCog.welcome_members")]
+    assert (job.calls, job.errors, job.latency.total) == (1, 0, 0.2)
+    rendered = metrics.render()
+    assert (
+        'bot_handler_calls_total{kind="job",handler="JoinCog.welcome_members"} 1'
+        in rendered
+    )
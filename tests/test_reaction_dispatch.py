@@ -0,0 +1,56 @@
+import asyncio
+from types import SimpleNamespace
+from typing import List, Tuple
+
+from reaction_dispatch import ReactionDispatcher
+
+Added = List[Tuple[int, str]]
+
+
+def make_message(message_id: int, added: Added, channel_id: int = 1):
+    async def add_reaction(emoji: str):
+        added.append((message_id, emoji))
+
+    return SimpleNamespace(
+        id=message_id, channel=SimpleNamespace(id=channel_id), add_reaction=add_reaction
+    )
+
+
+async def drain(dispatcher: ReactionDispatcher):
+    while dispatcher.workers:
+        await asyncio.sleep(0.01)
+
+
+def test_jobs_for_the_same_message_are_all_kept():
+    async def run():
+        added: Added = []
+        dispatcher = ReactionDispatcher(interval=0.01)
+        message = make_message(10, added)
+        dispatcher.enqueue(message, ["up", "down"])
+        dispatcher.enqueue(message, ["repost"])
+        assert dispatcher.depth() == 2
+        await drain(dispatcher)
+        assert added == [(10, "up"), (10, "down"), (10, "repost")]
+        assert dispatcher.depth() == 0
+        assert dispatcher.jobs == {}
+
+    asyncio.run(run())
+
+
+def test_discard_drops_every_job_for_the_message():
+    async def run():
+        added: Added = []
+        dispatcher = ReactionDispatcher(interval=0.05)
+        deleted = make_message(10, added)
+        kept = make_message(11, added)
+        dispatcher.enqueue(deleted, ["up", "down"])
+        dispatcher.enqueue(kept, ["up"])
+        dispatcher.enqueue(deleted, ["repost"])
+        dispatcher.discard([10])
+        assert dispatcher.depth() == 1
+        await drain(dispatcher)
+        assert added == [(11, "up")]
+        assert dispatcher.dropped == 2
+        assert dispatcher.completed == 1
+
+    asyncio.run(run())
@@ -0,0 +1,41 @@
+from random import Random
+
+import pytest
+
+from repost_index import HammingIndex, to_signed, to_unsigned
+
+
+@pytest.mark.parametrize(
+    "max_distance,expected_size", [(0, 1000), (6, 1000), (6, 10 ** 6), (10, 5000)]
+)
+def test_search_matches_a_linear_scan(max_distance, expected_size):
+    random = Random(max_distance)
+    hashes = [random.getrandbits(64) for _ in range(3000)]
+    index = HammingIndex(max_distance, expected_size=expected_size)
+    for position, value in enumerate(hashes):
+        index.add(value, position)
+
+    for i in range(200):
+        query = hashes[i] if i % 2 else random.getrandbits(64)
+        for bit in random.sample(range(64), random.randint(0, max_distance)):
+            query ^= 1 << bit
+        expected = sorted(
+            (distance, position)
+            for position, value in enumerate(hashes)
+            if (distance := (value ^ query).bit_count()) <= max_distance
+        )
+        assert sorted(index.search(query)) == expected
+
+
+def test_search_returns_closest_first():
+    index = HammingIndex(6)
+    index.add(0b111, "three bits")
+    index.add(0b1, "one bit")
+    index.add(1 << 63, "high bit")
+    assert index.search(0) == [(1, "one bit"), (1, "high bit"), (3, "three bits")]
+
+
+def test_signed_round_trip():
+    for value in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+        assert to_unsigned(to_signed(value)) == value
+        assert -(1 << 63) <= to_signed(value) < 1 << 63
@@ -0,0 +1,19 @@
+import pytest
+
+from url_rules import MEDIA, NOT_MEDIA, PROBE, UrlRules
+
+
+def test_config_rules_come_before_defaults():
+    rules = UrlRules(
+        [{"host": "www.i.imgur.com", "path": r"\.zip$", "verdict": NOT_MEDIA}]
+    )
+    assert rules.classify("https://i.imgur.com/a.zip") == NOT_MEDIA
+    assert rules.classify("https://i.imgur.com/a") == MEDIA
+    assert rules.classify("https://example.com/page") == PROBE
+
+
+def test_bad_rules_raise_value_errors():
+    with pytest.raises(ValueError, match="Invalid verdict 'maybe' for 'a.com'"):
+        UrlRules([{"host": "a.com", "verdict": "maybe"}])
+    with pytest.raises(ValueError, match=r"Invalid path pattern '\^/\(' for 'a.com'"):
+        UrlRules([{"host": "a.com", "path": "^/(", "verdict": MEDIA}])